@@ -1,135 +1,109 @@
 import os
-import re
+import sys
 import csv
+import copy
+import queue
+import time
+import logging
+from datetime import date, timedelta
+import threading
+import multiprocessing
 import webbrowser
-import pdfplumber
-from typing import Optional, List, Dict
+from typing import Optional, List
 from datetime import datetime
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk, BooleanVar, Text, Scrollbar, Toplevel
 
-class CupomReader:
-    def __init__(self):
-        self.agrupar_itens = True
+from cupom_reader import CupomReader, CupomError, NoItemsError, ProcessingCancelled
+from cupom_cache import CupomCache
+from cupom_metricas import Metricas
+from cupom_store import CupomStore, ARMAZEM_PADRAO
+from cupom_ocr import LeitorOCR, ocr_disponivel
+from cupom_paralelo import LeitorParalelo
+from cupom_agregacao import VisaoCupom, RelatorioIncremental
+from cupom_xml import processar_xml, EXTENSOES_XML
+from cupom_devolucao import IndiceDevolucao, STATUS_OK, STATUS_PARCIAL, STATUS_NAO_ENCONTRADO
 
-    def set_agrupar_itens(self, valor: bool):
-        self.agrupar_itens = valor
+logger = logging.getLogger(__name__)
 
-    def extract_text_with_layout(self, file_path: str) -> str:
-        """Extrai texto do PDF mantendo estrutura"""
-        try:
-            full_text = ""
-            with pdfplumber.open(file_path) as pdf:
-                for page in pdf.pages:
-                    text = page.extract_text(
-                        layout=True,
-                        x_tolerance=5,  # Aumentado para melhor captura
-                        y_tolerance=3,
-                        keep_blank_chars=False,
-                    )
-                    if text:
-                        full_text += text + "\n"
-            return full_text
-        except Exception as e:
-            messagebox.showerror("Erro", f"Falha ao ler PDF:\n{str(e)}")
-            return ""
+# Devoluções confirmadas, somadas por dia e produto (CSV regravado a cada
+# minuto, pelo botão "Devoluções por Dia" e ao sair)
+RELATORIO_DEVOLUCOES = os.path.join(os.path.dirname(ARMAZEM_PADRAO), 'devolucoes_por_dia.csv')
 
-    def parse_items(self, text: str) -> List[Dict]:
-        """Processa itens no formato exato da imagem"""
-        items = []
-        lines = [line.strip() for line in text.split('\n') if line.strip()]
-        
-        i = 0
-        while i < len(lines):
-            line = lines[i]
-            
-            # Ignora cabeçalhos e linhas irrelevantes
-            if any(x in line for x in ['ITEM', 'COD.', 'DESC.', 'TOTAL', 'Documento', 'Protocolo']):
-                i += 1
-                continue
-                
-            # Padrão para o formato específico da imagem
-            item_match = re.match(
-                r'^(\d+)\s+(\d{7,13})?\s*(.*?)\s+(\d+\.\d+|\d+\,\d+)\s+(\w+)\.?\s+(\d+\.\d+|\d+\,\d+)\s+(\d+\.\d+|\d+\,\d+)\s*$', 
-                line
-            )
-            
-            if item_match:
-                try:
-                    item_num = int(item_match.group(1))
-                    codigo = item_match.group(2) if item_match.group(2) else ""
-                    descricao = item_match.group(3).strip()
-                    qtd = item_match.group(4).replace(',', '.')
-                    un = item_match.group(5)
-                    vl_unit = item_match.group(6).replace(',', '.')
-                    vl_total = item_match.group(7).replace(',', '.')
-                    
-                    item = {
-                        'item': item_num,
-                        'codigo': codigo,
-                        'descricao': descricao,
-                        'quantidade': float(qtd),
-                        'unidade': un,
-                        'valor_unitario': float(vl_unit),
-                        'valor_total': float(vl_total),
-                        'desconto': 0.0
-                    }
-                    
-                    # Verifica desconto na próxima linha
-                    if i+1 < len(lines):
-                        next_line = lines[i+1]
-                        if f"Seq.: {item_num}" in next_line and "Desconto" in next_line:
-                            desconto_match = re.search(r'Desconto\s+([\d,\.]+)', next_line)
-                            if desconto_match:
-                                item['desconto'] = float(desconto_match.group(1).replace(',', '.'))
-                                i += 1  # Pula a linha do desconto
-                    
-                    items.append(item)
-                except Exception as e:
-                    print(f"Erro processando linha {i+1}: '{line}'\nErro: {str(e)}")
-            
-            i += 1
-        
-        return items
-
-    def _agrupar_itens_repetidos(self, items: List[Dict]) -> List[Dict]:
-        """Agrupa itens idênticos"""
-        grouped = {}
-        for item in items:
-            key = (item['codigo'], item['descricao'], item['valor_unitario'])
-            if key in grouped:
-                grouped[key]['quantidade'] += item['quantidade']
-                grouped[key]['valor_total'] += item['valor_total']
-                grouped[key]['desconto'] += item['desconto']
-            else:
-                grouped[key] = item.copy()
-        return sorted(grouped.values(), key=lambda x: x['item'])
+class PreenchedorTabela:
+    """Preenche uma Treeview em lotes, sem travar a interface.
+
+    O primeiro lote (as linhas visíveis) entra na hora; o restante é inserido
+    em callbacks ``after`` curtos, deixando o Tk redesenhar e tratar eventos
+    entre um lote e outro. ``limpar`` descarta o preenchimento pendente e
+    apaga todas as linhas com uma única chamada a ``delete``.
+    """
+    
+    def __init__(self, tree, tamanho_lote=500):
+        self.tree = tree
+        self.tamanho_lote = tamanho_lote
+        self._pendentes = None
+        self._after_id = None
+        self._ao_concluir = None
+        self._inseridas = 0
+
+    def limpar(self):
+        self._cancelar()
+        filhos = self.tree.get_children()
+        if filhos:
+            self.tree.delete(*filhos)
+
+    def preencher(self, linhas, ao_concluir=None):
+        """Insere as linhas (tuplas ``(values, tags)``) ao final da tabela.
+
+        ``ao_concluir(n)`` é chamado com o número de linhas inseridas quando
+        o último lote entrar na tabela (não é chamado se for cancelado).
+        """
+        self._cancelar()
+        self._pendentes = iter(linhas)
+        self._ao_concluir = ao_concluir
+        self._inseridas = 0
+        self._inserir_lote()
+
+    def concluir(self):
+        """Insere de imediato tudo o que ainda estiver pendente"""
+        pendentes, ao_concluir = self._pendentes, self._ao_concluir
+        self._cancelar()
+        if pendentes is not None:
+            for values, tags in pendentes:
+                self.tree.insert('', 'end', values=values, tags=tags)
+                self._inseridas += 1
+            if ao_concluir:
+                ao_concluir(self._inseridas)
+
+    def _cancelar(self):
+        if self._after_id is not None:
+            self.tree.after_cancel(self._after_id)
+            self._after_id = None
+        self._pendentes = None
+        self._ao_concluir = None
+
+    def _inserir_lote(self):
+        self._after_id = None
+        if self._pendentes is None or not self.tree.winfo_exists():
+            self._pendentes = None
+            return
+        insert = self.tree.insert
+        n = 0
+        for values, tags in self._pendentes:
+            insert('', 'end', values=values, tags=tags)
+            n += 1
+            if n >= self.tamanho_lote:
+                self._inseridas += n
+                self._after_id = self.tree.after(1, self._inserir_lote)
+                return
+        self._inseridas += n
+        ao_concluir = self._ao_concluir
+        self._pendentes = None
+        self._ao_concluir = None
+        if ao_concluir:
+            ao_concluir(self._inseridas)
 
-    def process_cupom(self, file_path: str) -> Optional[Dict]:
-        """Processa o cupom fiscal completo"""
-        try:
-            text = self.extract_text_with_layout(file_path)
-            if not text:
-                return None
-                
-            items = self.parse_items(text)
-            if not items:
-                print("DEBUG - Texto extraído:\n", text[:1000])
-                messagebox.showwarning("Aviso", "Nenhum item encontrado. Verifique o console.")
-                return None
-                
-            if self.agrupar_itens:
-                items = self._agrupar_itens_repetidos(items)
-                
-            return {
-                'total_itens': len(items),
-                'total_geral': round(sum(i['valor_total'] for i in items), 2),
-                'total_descontos': round(sum(i['desconto'] for i in items), 2),
-                'itens': items
-            }
-        except Exception as e:
-            messagebox.showerror("Erro", f"Falha ao processar:\n{str(e)}")
-            return None
 class CupomReaderGUI:
     def __init__(self, root):
         self.root = root
@@ -167,11 +141,72 @@ class CupomReaderGUI:
 class CupomReaderGUI:
     def __init__(self, root):
         self.root = root
-        self.reader = CupomReader()
+        self.metricas = self._abrir_metricas()
+        # PDFs grandes (muitas páginas) podem ser extraídos em paralelo, por
+        # faixas ("Páginas em paralelo"); desligado por padrão, pois conta as
+        # páginas de todo PDF antes de ler, o que não compensa nos cupons comuns
+        self.paralelo = LeitorParalelo()
+        self.reader = CupomReader(cache=self._abrir_cache(), metricas=self.metricas)
+        # O leitor entrega os itens como lidos; o agrupamento é uma visão
+        # (VisaoCupom), alternada sem reprocessar o PDF
+        self.reader.set_agrupar_itens(False)
+        self.visao = None
+        # Só usado quando o PDF não tem itens no texto (ex.: digitalizado)
+        self.ocr = LeitorOCR(cache=self.reader.cache) if ocr_disponivel() else None
+        self.reader.ocr = self.ocr
+        self.armazem = self._abrir_armazem()
+        self.relatorio_devolucoes = self._abrir_relatorio_devolucoes()
         self.results = None
         
+        # Processamento em segundo plano: cada execução tem um id; resultados
+        # de execuções antigas (canceladas ou substituídas) são descartados
+        self._fila_resultados = queue.Queue()
+        self._job_id = 0
+        self._cancelar_evento = None
+        
         self.setup_ui()
         self.setup_devolucao_ui()
+        self.root.after(50, self._verificar_fila)
+
+    def _abrir_cache(self) -> Optional[CupomCache]:
+        """Abre o cache padrão; sem cache o leitor continua funcionando"""
+        try:
+            return CupomCache()
+        except Exception as e:
+            logger.warning("Cache desativado: %s", e)
+            return None
+
+    def _abrir_armazem(self) -> Optional[CupomStore]:
+        """Abre o armazém de cupons processados; sem ele a busca fica indisponível"""
+        try:
+            return CupomStore()
+        except Exception as e:
+            logger.warning("Armazém de cupons desativado: %s", e)
+            return None
+
+    def _abrir_relatorio_devolucoes(self) -> Optional[RelatorioIncremental]:
+        """Totais das devoluções confirmadas por dia e produto, ao lado do armazém"""
+        try:
+            return RelatorioIncremental(RELATORIO_DEVOLUCOES, ('dia', 'produto'))
+        except Exception as e:
+            logger.warning("Relatório de devoluções desativado: %s", e)
+            return None
+
+    def fechar(self):
+        """Grava o que falta do relatório de devoluções (chamado ao sair)"""
+        if self.relatorio_devolucoes is not None:
+            self.relatorio_devolucoes.close()
+            self.relatorio_devolucoes = None
+
+    def _abrir_metricas(self) -> Optional[Metricas]:
+        """Métricas por etapa, ativadas pelas variáveis de ambiente
+        CUPOM_METRICAS (arquivo .jsonl ou '-') e CUPOM_PERFIL (pasta)"""
+        destino = os.environ.get('CUPOM_METRICAS') or None
+        perfil = os.environ.get('CUPOM_PERFIL') or None
+        if not destino and not perfil:
+            return None
+        # Só com o perfil, os registros vão para o console
+        return Metricas(destino or '-', origem='interface', perfil=perfil)
 
     def setup_ui(self):
         """Configura a interface principal"""
@@ -194,7 +229,43 @@ class CupomReaderGUI:
             top_frame, 
             text="Agrupar itens iguais", 
             variable=self.agrupar_var,
-            command=lambda: self.reader.set_agrupar_itens(self.agrupar_var.get())
+            command=self._alternar_agrupamento
+        ).pack(side=tk.LEFT, padx=10)
+        
+        self.usar_cache_var = BooleanVar(value=True)
+        tk.Checkbutton(
+            top_frame,
+            text="Usar cache",
+            variable=self.usar_cache_var
+        ).pack(side=tk.LEFT, padx=10)
+        
+        self.extracao_rapida_var = BooleanVar(value=False)
+        tk.Checkbutton(
+            top_frame,
+            text="Extração rápida",
+            variable=self.extracao_rapida_var,
+            command=lambda: self.reader.set_motor(
+                # PDFium se instalado; senão, os caracteres do pdfplumber
+                'pdfium,palavras' if self.extracao_rapida_var.get() else 'layout'
+            )
+        ).pack(side=tk.LEFT, padx=10)
+        
+        self.ocr_var = BooleanVar(value=self.ocr is not None)
+        tk.Checkbutton(
+            top_frame,
+            text="OCR (PDF sem texto)",
+            variable=self.ocr_var,
+            state=tk.NORMAL if self.ocr is not None else tk.DISABLED,
+            command=lambda: setattr(self.reader, 'ocr', self.ocr if self.ocr_var.get() else None)
+        ).pack(side=tk.LEFT, padx=10)
+        
+        self.paralelo_var = BooleanVar(value=False)
+        tk.Checkbutton(
+            top_frame,
+            text="Páginas em paralelo",
+            variable=self.paralelo_var,
+            command=lambda: setattr(self.reader, 'paralelo',
+                                    self.paralelo if self.paralelo_var.get() else None)
         ).pack(side=tk.LEFT, padx=10)
         
         tk.Button(
@@ -204,6 +275,14 @@ class CupomReaderGUI:
             bg="#4CAF50",
             fg="white"
         ).pack(side=tk.LEFT, padx=10)
+        
+        tk.Button(
+            top_frame,
+            text="Buscar Cupons",
+            command=self.show_busca_window,
+            bg="#9C27B0",
+            fg="white"
+        ).pack(side=tk.LEFT)
 
         # Treeview para exibir os itens
         self.tree = ttk.Treeview(
@@ -226,6 +305,7 @@ class CupomReaderGUI:
         
         self.tree.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
         scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.tree_preenchedor = PreenchedorTabela(self.tree)
         
         # Rodapé
         bottom_frame = tk.Frame(self.root)
@@ -238,6 +318,20 @@ class CupomReaderGUI:
         )
         self.total_label.pack(side=tk.LEFT, padx=10, expand=True)
         
+        self.status_label = tk.Label(bottom_frame, text="")
+        self.status_label.pack(side=tk.LEFT, padx=5)
+        
+        self.progress = ttk.Progressbar(bottom_frame, length=200, mode='determinate')
+        self.progress.pack(side=tk.LEFT, padx=5)
+        
+        self.cancel_button = tk.Button(
+            bottom_frame,
+            text="Cancelar",
+            command=self._cancelar_processamento,
+            state=tk.DISABLED
+        )
+        self.cancel_button.pack(side=tk.LEFT, padx=5)
+        
         tk.Button(
             bottom_frame, 
             text="Salvar CSV", 
@@ -259,6 +353,133 @@ class CupomReaderGUI:
         self.devolucao_window = None
         self.devolucao_text = None
         self.devolucao_result_tree = None
+        self.devolucao_preenchedor = None
+        # Saldo devolvível do cupom atual (vale para várias devoluções)
+        self.devolucao_indice = None
+        self.busca_window = None
+        self.busca_resultados = []
+
+    def show_busca_window(self):
+        """Abre a busca nos cupons já processados (armazém local)"""
+        if self.armazem is None:
+            messagebox.showwarning("Aviso", "Armazém de cupons indisponível.")
+            return
+        if self.busca_window and self.busca_window.winfo_exists():
+            self.busca_window.lift()
+            return
+            
+        self.busca_window = Toplevel(self.root)
+        self.busca_window.title("Buscar Cupons")
+        self.busca_window.geometry("1100x600")
+        
+        filtro_frame = tk.Frame(self.busca_window)
+        filtro_frame.pack(fill=tk.X, padx=10, pady=10)
+        
+        tk.Label(filtro_frame, text="Código (EAN):").pack(side=tk.LEFT)
+        self.busca_codigo = tk.Entry(filtro_frame, width=18)
+        self.busca_codigo.pack(side=tk.LEFT, padx=5)
+        
+        tk.Label(filtro_frame, text="Descrição:").pack(side=tk.LEFT)
+        self.busca_descricao = tk.Entry(filtro_frame, width=30)
+        self.busca_descricao.pack(side=tk.LEFT, padx=5)
+        
+        tk.Label(filtro_frame, text="Últimos dias:").pack(side=tk.LEFT)
+        self.busca_dias = tk.Entry(filtro_frame, width=5)
+        self.busca_dias.insert(0, "30")
+        self.busca_dias.pack(side=tk.LEFT, padx=5)
+        
+        tk.Button(
+            filtro_frame,
+            text="Buscar",
+            command=self.buscar_cupons,
+            bg="#9C27B0",
+            fg="white"
+        ).pack(side=tk.LEFT, padx=10)
+        
+        self.busca_status = tk.Label(filtro_frame, text="Duplo clique abre o cupom")
+        self.busca_status.pack(side=tk.LEFT, padx=10)
+        
+        result_frame = tk.Frame(self.busca_window)
+        result_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
+        
+        self.busca_tree = ttk.Treeview(
+            result_frame,
+            columns=('Data', 'Arquivo', 'Item', 'Código', 'Descrição', 'Qtd', 'V.Total', 'Total Cupom'),
+            show='headings'
+        )
+        for col, width in [
+            ('Data', 130), ('Arquivo', 220), ('Item', 50), ('Código', 120),
+            ('Descrição', 250), ('Qtd', 60), ('V.Total', 90), ('Total Cupom', 100)
+        ]:
+            self.busca_tree.heading(col, text=col)
+            self.busca_tree.column(col, width=width, anchor='center' if width < 100 else 'w')
+        
+        scrollbar = ttk.Scrollbar(result_frame, orient="vertical", command=self.busca_tree.yview)
+        self.busca_tree.configure(yscrollcommand=scrollbar.set)
+        self.busca_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.busca_preenchedor = PreenchedorTabela(self.busca_tree)
+        
+        self.busca_tree.bind('<Double-1>', self._abrir_cupom_da_busca)
+        for campo in (self.busca_codigo, self.busca_descricao, self.busca_dias):
+            campo.bind('<Return>', lambda event: self.buscar_cupons())
+        self.busca_codigo.focus_set()
+
+    def buscar_cupons(self):
+        """Consulta o armazém com os filtros da janela de busca"""
+        codigo = self.busca_codigo.get().strip()
+        descricao = self.busca_descricao.get().strip()
+        dias = self.busca_dias.get().strip()
+        try:
+            desde = date.today() - timedelta(days=int(dias)) if dias else None
+        except ValueError:
+            messagebox.showerror("Erro", "Informe o número de dias.", parent=self.busca_window)
+            return
+        
+        inicio = time.perf_counter()
+        try:
+            self.busca_resultados = self.armazem.buscar(codigo or None, descricao or None, desde)
+        except Exception as e:
+            messagebox.showerror("Erro", f"Falha na busca:\n{str(e)}", parent=self.busca_window)
+            return
+        decorrido = (time.perf_counter() - inicio) * 1000
+        
+        self.busca_preenchedor.limpar()
+        self.busca_preenchedor.preencher(
+            ((
+                r['data'].strftime('%d/%m/%Y %H:%M') if r['emissao_conhecida'] else r['data'].strftime('%d/%m/%Y'),
+                os.path.basename(r['arquivo']),
+                r.get('item', ''),
+                r.get('codigo', ''),
+                r.get('descricao', ''),
+                f"{r['quantidade']:.3f}" if 'quantidade' in r else '',
+                f"R$ {r['valor_total']:.2f}" if 'valor_total' in r else '',
+                f"R$ {r['total_geral']:.2f}"
+            ), ())
+            for r in self.busca_resultados
+        )
+        self.busca_status.config(text=f"{len(self.busca_resultados)} resultado(s) em {decorrido:.0f} ms")
+
+    def _abrir_cupom_da_busca(self, event=None):
+        """Carrega o cupom selecionado na tela principal, sem reprocessar o PDF"""
+        selecao = self.busca_tree.selection()
+        if not selecao:
+            return
+        encontrado = self.busca_resultados[self.busca_tree.index(selecao[0])]
+        resultado = self.armazem.carregar(encontrado['cupom_id'])
+        if resultado is None:
+            messagebox.showerror("Erro", "Cupom não encontrado no armazém.", parent=self.busca_window)
+            return
+        
+        self._cancelar_processamento()
+        self.file_entry.delete(0, tk.END)
+        self.file_entry.insert(0, resultado['arquivo'])
+        self.tree_preenchedor.limpar()
+        self.visao = VisaoCupom(resultado['itens'])
+        self.results = self.visao.aplicar(resultado, self.agrupar_var.get())
+        self._indexar_devolucao()
+        self.status_label.config(text="Carregado do armazém")
+        self._exibir_resultados()
 
     def show_devolucao_window(self):
         """Abre a janela de registro de devolução"""
@@ -280,7 +501,8 @@ class CupomReaderGUI:
         
         tk.Label(
             instr_frame,
-            text="Digite os códigos dos itens para devolução (1 por linha):",
+            text="Digite ou leia os códigos dos itens para devolução (1 por linha; "
+                 "3*CÓDIGO para 3 unidades, #N para o item N):",
             font=('Arial', 10, 'bold')
         ).pack(anchor='w')
         
@@ -308,6 +530,15 @@ class CupomReaderGUI:
             font=('Arial', 10, 'bold')
         ).pack(side=tk.LEFT, padx=5)
         
+        tk.Button(
+            button_frame,
+            text="Confirmar Devolução",
+            command=self.confirmar_devolucao,
+            bg="#FF9800",
+            fg="white",
+            font=('Arial', 10, 'bold')
+        ).pack(side=tk.LEFT, padx=5)
+        
         tk.Button(
             button_frame,
             text="Limpar",
@@ -324,20 +555,28 @@ class CupomReaderGUI:
             fg="white"
         ).pack(side=tk.LEFT, padx=5)
         
+        tk.Button(
+            button_frame,
+            text="Devoluções por Dia",
+            command=self.save_devolucoes_por_dia,
+            bg="#2196F3",
+            fg="white"
+        ).pack(side=tk.LEFT, padx=5)
+        
         # Treeview de resultados
         result_frame = tk.Frame(self.devolucao_window)
         result_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
         
         self.devolucao_result_tree = ttk.Treeview(
             result_frame,
-            columns=('Item', 'Código', 'Descrição', 'Valor Unit', 'Valor Total', 'Status'),
+            columns=('Item', 'Código', 'Descrição', 'Qtd', 'Valor Unit', 'Valor Devolvido', 'Status'),
             show='headings'
         )
         
         # Configuração das colunas
         for col, width in [
-            ('Item', 50), ('Código', 120), ('Descrição', 250),
-            ('Valor Unit', 100), ('Valor Total', 100), ('Status', 150)
+            ('Item', 50), ('Código', 120), ('Descrição', 250), ('Qtd', 80),
+            ('Valor Unit', 100), ('Valor Devolvido', 110), ('Status', 150)
         ]:
             self.devolucao_result_tree.heading(col, text=col)
             self.devolucao_result_tree.column(col, width=width, anchor='center')
@@ -347,78 +586,105 @@ class CupomReaderGUI:
         
         self.devolucao_result_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
         scrollbar_result.pack(side=tk.RIGHT, fill=tk.Y)
+        self.devolucao_preenchedor = PreenchedorTabela(self.devolucao_result_tree)
         
         # Estilos para os resultados
         self.devolucao_result_tree.tag_configure('ok', foreground='green')
+        self.devolucao_result_tree.tag_configure('parcial', foreground='orange')
         self.devolucao_result_tree.tag_configure('erro', foreground='red')
 
+    def _indexar_devolucao(self):
+        """Índice de devolução do cupom atual, sem o que já foi devolvido antes"""
+        devolvidos = None
+        cupom_id = self.results.get('cupom_id')
+        if self.armazem is not None and cupom_id is not None:
+            try:
+                devolvidos = self.armazem.devolvidos(cupom_id)
+            except Exception as e:
+                logger.warning("Falha ao ler as devoluções do cupom %s: %s", cupom_id, e)
+        self.devolucao_indice = IndiceDevolucao(self.results['itens'], devolvidos)
+
     def compare_devolucao(self):
-        """Compara itens devolvidos com o cupom"""
-        if not hasattr(self, 'devolucao_result_tree'):
-            return
+        """Confere os itens digitados com o cupom, sem registrar a devolução"""
+        self._conferir_devolucao(confirmar=False)
+
+    def confirmar_devolucao(self):
+        """Registra a devolução, abatendo as quantidades do saldo do cupom"""
+        if self._conferir_devolucao(confirmar=True):
+            self.devolucao_text.delete('1.0', tk.END)
+
+    def _conferir_devolucao(self, confirmar):
+        if self.devolucao_result_tree is None or self.devolucao_indice is None:
+            return False
             
         # Limpa resultados anteriores
-        for item in self.devolucao_result_tree.get_children():
-            self.devolucao_result_tree.delete(item)
-            
-        # Extrai códigos digitados
-        devolucao_codigos = set()
-        for line in self.devolucao_text.get('1.0', tk.END).split('\n'):
-            codigo = line.strip()
-            if codigo:
-                devolucao_codigos.add(codigo)
-        
-        # Verifica cada código
-        divergencias = 0
-        cupom_itens = {str(item['codigo']): item for item in self.results['itens']}
+        self.devolucao_preenchedor.limpar()
+        
+        entradas = self.devolucao_text.get('1.0', tk.END).split('\n')
+        # Confere sem abater; o saldo só muda depois de a devolução ser gravada,
+        # para continuar igual ao que o armazém mostra ao reabrir o cupom
+        resultados = self.devolucao_indice.registrar(entradas, confirmar=False)
+        cupom_id = self.results.get('cupom_id')
+        if confirmar and self.armazem is not None and cupom_id is not None:
+            try:
+                self.armazem.registrar_devolucao(cupom_id, resultados)
+            except Exception as e:
+                messagebox.showerror("Erro", f"Devolução não registrada (falha ao gravar no armazém):\n{e}")
+                return False
+        if confirmar:
+            self.devolucao_indice.registrar(entradas, confirmar=True)
+        if confirmar and self.relatorio_devolucoes is not None:
+            try:
+                self.relatorio_devolucoes.acumular_devolucao(self.results, resultados, datetime.now())
+            except Exception as e:
+                logger.warning("Falha ao somar a devolução ao relatório diário: %s", e)
         
-        for codigo in devolucao_codigos:
-            if codigo in cupom_itens:
-                item = cupom_itens[codigo]
-                self.devolucao_result_tree.insert('', 'end',
-                    values=(
-                        item['item'],
-                        codigo,
-                        item['descricao'],
-                        f"R$ {item['valor_unitario']:.2f}",
-                        f"R$ {item['valor_total']:.2f}",
-                        "OK"
-                    ),
-                    tags=('ok',)
-                )
-            else:
-                self.devolucao_result_tree.insert('', 'end',
-                    values=(
-                        "",
-                        codigo,
-                        "ITEM NÃO ENCONTRADO",
-                        "",
-                        "",
-                        "DIVERGÊNCIA"
-                    ),
-                    tags=('erro',)
-                )
+        divergencias = 0
+        valor_total = 0
+        linhas = []
+        for r in resultados:
+            if r.status == STATUS_NAO_ENCONTRADO:
+                divergencias += 1
+                linhas.append(((
+                    "", r.entrada, "ITEM NÃO ENCONTRADO", f"{r.quantidade:g}", "", "", r.status
+                ), ('erro',)))
+                continue
+                
+            item = r.item
+            if r.status != STATUS_OK:
                 divergencias += 1
+            valor_total += r.valor_devolvido
+            linhas.append(((
+                item['item'],
+                item['codigo'] or r.entrada,
+                item['descricao'],
+                f"{r.quantidade_devolvida:g}/{r.quantidade:g}",
+                f"R$ {item['valor_unitario']:.2f}",
+                f"R$ {r.valor_devolvido:.2f}",
+                r.status
+            ), ('ok',) if r.status == STATUS_OK else ('parcial',) if r.status == STATUS_PARCIAL else ('erro',)))
+        self.devolucao_preenchedor.preencher(linhas)
         
         # Mostra resumo
         messagebox.showinfo(
             "Resultado",
-            f"Processamento concluído!\n\n"
-            f"Itens verificados: {len(devolucao_codigos)}\n"
-            f"Divergências encontradas: {divergencias}"
+            f"{'Devolução registrada' if confirmar else 'Conferência concluída'}!\n\n"
+            f"Itens verificados: {len(resultados)}\n"
+            f"Divergências encontradas: {divergencias}\n"
+            f"Valor a devolver: R$ {valor_total:.2f}"
         )
+        return True
 
     def clear_devolucao(self):
         """Limpa os campos de devolução"""
         if hasattr(self, 'devolucao_text'):
             self.devolucao_text.delete('1.0', tk.END)
-        if hasattr(self, 'devolucao_result_tree'):
-            for item in self.devolucao_result_tree.get_children():
-                self.devolucao_result_tree.delete(item)
+        if self.devolucao_preenchedor is not None:
+            self.devolucao_preenchedor.limpar()
 
     def save_devolucao_report(self):
         """Salva o relatório de devolução em CSV"""
-        if not hasattr(self, 'devolucao_result_tree'):
+        if self.devolucao_result_tree is None:
             return
             
         filename = filedialog.asksaveasfilename(
@@ -433,8 +699,9 @@ class CupomReaderGUI:
         try:
             with open(filename, 'w', newline='', encoding='utf-8') as f:
                 writer = csv.writer(f, delimiter=';')
-                writer.writerow(['Item', 'Código', 'Descrição', 'Valor Unitário', 'Valor Total', 'Status'])
+                writer.writerow(['Item', 'Código', 'Descrição', 'Qtd', 'Valor Unitário', 'Valor Devolvido', 'Status'])
                 
+                self.devolucao_preenchedor.concluir()
                 for item in self.devolucao_result_tree.get_children():
                     values = self.devolucao_result_tree.item(item, 'values')
                     writer.writerow(values)
@@ -443,11 +710,23 @@ class CupomReaderGUI:
         except Exception as e:
             messagebox.showerror("Erro", f"Falha ao salvar:\n{str(e)}")
 
+    def save_devolucoes_por_dia(self):
+        """Grava agora o relatório diário das devoluções confirmadas (CSV)"""
+        if self.relatorio_devolucoes is None:
+            messagebox.showwarning("Aviso", "Relatório de devoluções indisponível.")
+            return
+        try:
+            self.relatorio_devolucoes.gravar_csv()
+            messagebox.showinfo("Sucesso", f"Relatório salvo em:\n{RELATORIO_DEVOLUCOES}")
+        except Exception as e:
+            messagebox.showerror("Erro", f"Falha ao salvar:\n{str(e)}")
+
     def browse_file(self):
-        """Abre diálogo para selecionar arquivo PDF"""
+        """Abre diálogo para selecionar o cupom (PDF ou XML da NFC-e)"""
         filename = filedialog.askopenfilename(
             title="Selecione o cupom fiscal",
-            filetypes=[("Arquivos PDF", "*.pdf"), ("Todos os arquivos", "*.*")],
+            filetypes=[("Arquivos PDF", "*.pdf"), ("XML da NFC-e", "*.xml *.zip"),
+                       ("Todos os arquivos", "*.*")],
             initialdir=os.getcwd()
         )
         if filename:
@@ -455,52 +734,189 @@ class CupomReaderGUI:
             self.file_entry.insert(0, filename)
 
     def process_file(self):
-        """Processa o cupom e exibe os resultados"""
+        """Inicia o processamento do cupom em segundo plano"""
         filename = self.file_entry.get()
         if not filename:
             messagebox.showerror("Erro", "Selecione um arquivo PDF.")
             return
             
-        try:
-            # Limpa resultados anteriores
-            for i in self.tree.get_children():
-                self.tree.delete(i)
-                
-            # Processa o arquivo
-            self.results = self.reader.process_cupom(filename)
+        # Um novo arquivo substitui o que ainda estiver em processamento
+        self._cancelar_processamento()
+        self._job_id += 1
+        self._cancelar_evento = threading.Event()
+        
+        # Limpa resultados anteriores
+        self.tree_preenchedor.limpar()
+        self.results = None
+        self.visao = None
+        self.devolucao_indice = None
+        
+        self.progress.config(value=0, maximum=1)
+        self.status_label.config(text="Processando...")
+        self.cancel_button.config(state=tk.NORMAL)
+        
+        threading.Thread(
+            target=self._processar_em_segundo_plano,
+            args=(self._job_id, self._leitor_do_trabalho(), filename, self.usar_cache_var.get(),
+                  self.agrupar_var.get(), self._cancelar_evento),
+            daemon=True
+        ).start()
+
+    def _leitor_do_trabalho(self) -> CupomReader:
+        """Cópia do leitor com as opções atuais (motor, OCR, paralelo), só da
+        thread de trabalho: as opções alteradas durante o processamento valem
+        para o próximo arquivo, e dois trabalhos nunca compartilham o leitor"""
+        return copy.copy(self.reader)
+
+    def _processar_em_segundo_plano(self, job_id, leitor, filename, usar_cache, agrupar, cancelar):
+        """Executa na thread de trabalho; nunca toca nos widgets nem em ``self.reader``"""
+        def progresso(pagina, total):
+            self._fila_resultados.put((job_id, 'progresso', (pagina, total, f"Página {pagina}/{total}")))
+
+        def progresso_xml(lidos, total):
+            texto = f"Lendo XML... {lidos * 100 // max(total, 1)}%"
+            self._fila_resultados.put((job_id, 'progresso', (lidos, total, texto)))
             
-            if not self.results or not self.results.get('itens'):
-                messagebox.showwarning(
-                    "Aviso", 
-                    "Nenhum item encontrado. Verifique:\n"
-                    "1. Se o PDF contém texto selecionável\n"
-                    "2. O formato do cupom\n"
-                    "3. Consulte o console para detalhes"
+        try:
+            demais = []
+            if filename.lower().endswith(EXTENSOES_XML):
+                # XML não passa pelo PDF; com várias notas, mostra a primeira e
+                # grava as demais no armazém, de onde a busca as abre
+                resultado, *demais = processar_xml(filename, leitor, progresso_xml, cancelar)
+            else:
+                resultado = leitor.process_cupom(
+                    filename, usar_cache=usar_cache, progresso=progresso, cancelar=cancelar
                 )
-                return
-                
-            # Preenche a treeview
-            for item in self.results['itens']:
-                self.tree.insert('', 'end', values=(
-                    item['item'],
-                    item['codigo'],
-                    item['descricao'],
-                    f"{item['quantidade']:.3f}",
-                    item['unidade'],
-                    f"R$ {item['valor_unitario']:.2f}",
-                    f"R$ {item['desconto']:.2f}" if item['desconto'] > 0 else "-",
-                    f"R$ {item['valor_total']:.2f}"
-                ))
+            visao = VisaoCupom(resultado['itens'])
+            resultado = visao.aplicar(resultado, agrupar)
+            if self.armazem is not None:
+                try:
+                    resultado['cupom_id'] = self.armazem.gravar(resultado, filename)
+                except Exception as e:
+                    logger.warning("Falha ao gravar %s no armazém: %s", filename, e)
+                for nota in demais:
+                    try:
+                        self.armazem.gravar(nota, filename)
+                    except Exception as e:
+                        logger.warning("Falha ao gravar a nota %s de %s no armazém: %s",
+                                       nota.get('parte'), filename, e)
+            self._fila_resultados.put((job_id, 'ok', (resultado, visao, len(demais))))
+        except Exception as e:
+            self._fila_resultados.put((job_id, 'erro', e))
+
+    def _alternar_agrupamento(self):
+        """Mostra o cupom atual agrupado ou não, sem reprocessar o PDF"""
+        if self.visao is None or self.results is None:
+            return
+        # A conferência de devolução continua sobre os itens já indexados
+        self.results = self.visao.aplicar(self.results, self.agrupar_var.get())
+        self.tree_preenchedor.limpar()
+        self._exibir_resultados()
+
+    def _cancelar_processamento(self):
+        """Pede o cancelamento do processamento em andamento (se houver)"""
+        if self._cancelar_evento is not None:
+            self._cancelar_evento.set()
+            self._cancelar_evento = None
+            self.status_label.config(text="Cancelado")
+            self.cancel_button.config(state=tk.DISABLED)
+
+    def _verificar_fila(self):
+        """Aplica na interface as mensagens da thread de trabalho"""
+        try:
+            while True:
+                job_id, tipo, dados = self._fila_resultados.get_nowait()
+                if job_id != self._job_id or self._cancelar_evento is None:
+                    continue  # Execução antiga ou cancelada
+                if tipo == 'progresso':
+                    feito, total, texto = dados
+                    self.progress.config(value=feito, maximum=max(total, 1))
+                    self.status_label.config(text=texto)
+                else:
+                    self._cancelar_evento = None
+                    self.cancel_button.config(state=tk.DISABLED)
+                    self._finalizar_processamento(tipo, dados)
+        except queue.Empty:
+            pass
+        self.root.after(50, self._verificar_fila)
+
+    def _finalizar_processamento(self, tipo, dados):
+        """Exibe o resultado ou o erro de uma execução concluída"""
+        if tipo == 'ok':
+            self.status_label.config(text="Concluído")
+            self.progress.config(value=self.progress['maximum'])
+            resultado, self.visao, demais = dados
+            # "Agrupar itens iguais" pode ter mudado durante o processamento
+            self.results = self.visao.aplicar(resultado, self.agrupar_var.get())
+            self._indexar_devolucao()
+            try:
+                self._exibir_resultados()
+            except Exception as e:
+                messagebox.showerror("Erro", f"Falha ao processar:\n{str(e)}")
+            if demais:
+                onde = ("As demais foram gravadas no armazém e podem ser abertas em "
+                        "\"Buscar Cupons\"." if self.armazem is not None else
+                        "As demais não são exibidas (armazém desativado).")
+                messagebox.showinfo(
+                    "Várias NFC-e",
+                    f"O XML tem {demais + 1} notas; exibindo a primeira"
+                    f"{' (chave ' + resultado['chave'] + ')' if resultado.get('chave') else ''}.\n\n{onde}"
+                )
+            return
             
-            # Atualiza totais
-            self.total_label.config(
-                text=f"Total: R$ {self.results['total_geral']:.2f} | "
-                     f"Itens: {self.results['total_itens']} | "
-                     f"Descontos: R$ {self.results['total_descontos']:.2f}"
+        self.status_label.config(text="")
+        if isinstance(dados, ProcessingCancelled):
+            self.status_label.config(text="Cancelado")
+        elif isinstance(dados, NoItemsError):
+            logger.info("Texto extraído:\n%s", dados.texto[:1000])
+            messagebox.showwarning(
+                "Aviso", 
+                "Nenhum item encontrado. Verifique:\n"
+                "1. Se o PDF contém texto selecionável (ou ative o OCR;\n"
+                "   requer pytesseract e o Tesseract instalados)\n"
+                "2. O formato do cupom\n"
+                "3. Consulte o console para detalhes"
             )
-            
-        except Exception as e:
-            messagebox.showerror("Erro", f"Falha ao processar:\n{str(e)}")
+        elif isinstance(dados, CupomError):
+            messagebox.showerror("Erro", str(dados))
+        else:
+            messagebox.showerror("Erro", f"Falha ao processar:\n{str(dados)}")
+
+    def _exibir_resultados(self):
+        """Preenche a tabela e os totais com self.results"""
+        ao_concluir = None
+        if self.metricas is not None:
+            arquivo = self.file_entry.get()
+            inicio = time.perf_counter()
+
+            def ao_concluir(linhas):
+                self.metricas.emitir({
+                    'evento': 'interface', 'arquivo': arquivo, 'linhas': linhas,
+                    'segundos': round(time.perf_counter() - inicio, 6),
+                })
+
+        # As linhas são formatadas sob demanda, lote a lote
+        self.tree_preenchedor.preencher(
+            (((
+                item.item,
+                item.codigo,
+                item.descricao,
+                f"{item.quantidade:.3f}",
+                item.unidade,
+                f"R$ {item.valor_unitario:.2f}",
+                f"R$ {item.desconto:.2f}" if item.desconto > 0 else "-",
+                f"R$ {item.valor_total:.2f}"
+            ), ())
+            for item in self.results['itens']),
+            ao_concluir
+        )
+        
+        # Atualiza totais
+        self.total_label.config(
+            text=f"Total: R$ {self.results['total_geral']:.2f} | "
+                 f"Itens: {self.results['total_itens']} | "
+                 f"Descontos: R$ {self.results['total_descontos']:.2f}"
+        )
 
     def save_results(self):
         """Salva os resultados em CSV"""
@@ -554,7 +970,22 @@ class CupomReaderGUI:
         except Exception as e:
             messagebox.showerror("Erro", f"Não foi possível abrir o PDF:\n{str(e)}")
 
-if __name__ == "__main__":
+def main(argv: Optional[List[str]] = None) -> int:
+    """Sem argumentos abre a interface; com argumentos roda o modo lote"""
+    argv = sys.argv[1:] if argv is None else argv
+    if argv:
+        import cupom_lote
+        return cupom_lote.main(argv)
+        
+    logging.basicConfig(level=logging.INFO)
     root = tk.Tk()
     app = CupomReaderGUI(root)
-    root.mainloop()
+    try:
+        root.mainloop()
+    finally:
+        app.fechar()
+    return 0
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -0,0 +1,150 @@
+"""Benchmark por etapa do processamento de cupons.
+
+Uso: python benchmarks/bench_cupom.py [--itens 50 500 5000] [--paginas P]
+     [--descontos 0.15] [--repetidos 0.2] [--repeticoes 3]
+     [--motores layout pdfium ...] [--salvar base.json] [--comparar base.json]
+
+Gera cupons PDF sintéticos (gerar_cupom_pdf.py) e mede separadamente a
+extração do texto (iter_lines), o parse das linhas (parse_items) e o
+agrupamento (_agrupar_itens_repetidos): tempo, itens/s, páginas/s e pico de
+memória (tracemalloc, em uma passada à parte para não distorcer o tempo).
+A extração é medida em cada motor pedido ('extracao' é o motor layout,
+'extracao:<motor>' os demais), conferindo que os itens coincidem; motores
+cujo pacote não está instalado são ignorados.
+Com --salvar/--comparar, grava uma linha de base e mostra a variação em
+relação a ela.
+"""
+import os
+import sys
+import json
+import time
+import tempfile
+import argparse
+import tracemalloc
+from typing import List, Dict, Callable
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cupom_reader import CupomReader, PDFReadError, MOTORES  # noqa: E402
+from gerar_cupom_pdf import gerar_cupom_pdf  # noqa: E402
+
+
+def _medir(func: Callable, repeticoes: int):
+    """Melhor tempo de ``repeticoes`` execuções, e o resultado da última"""
+    melhor = float('inf')
+    resultado = None
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        resultado = func()
+        melhor = min(melhor, time.perf_counter() - inicio)
+    return melhor, resultado
+
+
+def _pico_memoria(func: Callable) -> int:
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def medir_cupom(caminho: str, n_itens: int, repeticoes: int,
+                motores: List[str] = ('layout',)) -> List[Dict]:
+    paginas = [0]
+
+    def progresso(pagina, total):
+        paginas[0] = total
+
+    etapas = []
+    itens = linhas = None
+    for motor in motores:
+        reader = CupomReader(motor=motor)
+        try:
+            t_extracao, linhas_motor = _medir(lambda: list(reader.iter_lines(caminho, progresso)), repeticoes)
+        except PDFReadError as e:
+            print(f"AVISO: motor {motor} ignorado: {e}", file=sys.stderr)  # Ex.: pacote ausente
+            continue
+        itens_motor = reader.parse_items(linhas_motor)
+        if itens is None:
+            itens, linhas = itens_motor, linhas_motor
+        elif [i.to_dict() for i in itens_motor] != [i.to_dict() for i in itens]:
+            print(f"AVISO: {caminho}: motor {motor} difere de {motores[0]}", file=sys.stderr)
+        nome = 'extracao' if motor == 'layout' else f'extracao:{motor}'
+        etapas.append((nome, t_extracao, lambda r=reader: list(r.iter_lines(caminho))))
+
+    if itens is None:
+        return []  # Nenhum motor disponível
+    t_parse, itens = _medir(lambda: reader.parse_items(linhas), repeticoes)
+    t_agrupar, agrupados = _medir(lambda: reader._agrupar_itens_repetidos(itens), repeticoes)
+    if len(itens) != n_itens:
+        print(f"AVISO: {caminho}: {len(itens)} itens reconhecidos de {n_itens}", file=sys.stderr)
+
+    etapas += [
+        ('parse', t_parse, lambda: reader.parse_items(linhas)),
+        ('agrupamento', t_agrupar, lambda: reader._agrupar_itens_repetidos(itens)),
+    ]
+    return [{
+        'itens': n_itens,
+        'paginas': paginas[0],
+        'linhas': len(linhas),
+        'agrupados': len(agrupados),
+        'etapa': nome,
+        'segundos': tempo,
+        'itens_s': len(itens) / tempo if tempo else float('inf'),
+        'paginas_s': paginas[0] / tempo if tempo else float('inf'),
+        'pico_kb': _pico_memoria(func) / 1024,
+    } for nome, tempo, func in etapas]
+
+
+def _chave(m: Dict) -> str:
+    return f"{m['itens']}:{m['etapa']}"
+
+
+def imprimir(medicoes: List[Dict], base: Dict[str, Dict]):
+    print(f"{'itens':>6} {'pág':>4} {'etapa':<18} {'tempo (ms)':>11} {'itens/s':>11} "
+          f"{'pág/s':>9} {'pico KB':>9}  {'vs base':>8}")
+    for m in medicoes:
+        variacao = ""
+        anterior = base.get(_chave(m))
+        if anterior and m['segundos']:
+            variacao = f"{anterior['segundos'] / m['segundos']:.2f}x"
+        print(f"{m['itens']:>6} {m['paginas']:>4} {m['etapa']:<18} {m['segundos'] * 1000:>11.2f} "
+              f"{m['itens_s']:>11.0f} {m['paginas_s']:>9.1f} {m['pico_kb']:>9.0f}  {variacao:>8}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark por etapa do leitor de cupons")
+    parser.add_argument('--itens', type=int, nargs='+', default=[50, 500, 5000])
+    parser.add_argument('--paginas', type=int, default=None,
+                        help="Páginas por cupom (padrão: 70 linhas por página)")
+    parser.add_argument('--descontos', type=float, default=0.15)
+    parser.add_argument('--repetidos', type=float, default=0.2)
+    parser.add_argument('--repeticoes', type=int, default=3)
+    parser.add_argument('--motores', nargs='+', choices=MOTORES, default=list(MOTORES),
+                        help="Motores de extração a comparar (padrão: todos)")
+    parser.add_argument('--salvar', help="Grava as medições em JSON (linha de base)")
+    parser.add_argument('--comparar', help="JSON de uma execução anterior para comparar")
+    args = parser.parse_args(argv)
+
+    base = {}
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as f:
+            base = {_chave(m): m for m in json.load(f)}
+
+    medicoes = []
+    with tempfile.TemporaryDirectory() as pasta:
+        for n_itens in args.itens:
+            caminho = os.path.join(pasta, f"cupom_{n_itens}.pdf")
+            gerar_cupom_pdf(caminho, n_itens, args.paginas, args.descontos, args.repetidos)
+            medicoes += medir_cupom(caminho, n_itens, args.repeticoes, args.motores)
+
+    imprimir(medicoes, base)
+    if args.salvar:
+        with open(args.salvar, 'w', encoding='utf-8') as f:
+            json.dump(medicoes, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
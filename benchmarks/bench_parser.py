@@ -0,0 +1,112 @@
+"""Compara o parser de linhas atual com o padrão regex original.
+
+Uso: python benchmarks/bench_parser.py [--itens N] [--repeticoes R]
+
+Gera um texto extraído sintético (com o preenchimento de espaços do modo
+layout, cabeçalhos, descontos e rodapé), confere que os dois parsers geram
+a mesma saída e mostra o custo por linha de cada um.
+"""
+import os
+import re
+import sys
+import time
+import argparse
+from typing import List, Dict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cupom_reader import CupomReader  # noqa: E402
+from gerar_cupom_pdf import gerar_linhas, chave_acesso, CABECALHO, RODAPE  # noqa: E402
+
+def gerar_texto(n_itens: int, seed: int = 0) -> str:
+    """Texto no formato do cupom Muffato com ``n_itens`` itens"""
+    return "\n".join(gerar_linhas(n_itens, seed=seed))
+
+
+def parse_legado(text: str) -> List[Dict]:
+    """Parser original (uma regex com retrocesso por linha), para comparação"""
+    items = []
+    lines = [line.strip() for line in text.split('\n') if line.strip()]
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        if any(x in line for x in ['ITEM', 'COD.', 'DESC.', 'TOTAL', 'Documento', 'Protocolo']):
+            i += 1
+            continue
+        item_match = re.match(
+            r'^(\d+)\s+(\d{7,13})?\s*(.*?)\s+(\d+\.\d+|\d+\,\d+)\s+(\w+)\.?\s+(\d+\.\d+|\d+\,\d+)\s+(\d+\.\d+|\d+\,\d+)\s*$',
+            line
+        )
+        if item_match:
+            try:
+                item_num = int(item_match.group(1))
+                item = {
+                    'item': item_num,
+                    'codigo': item_match.group(2) if item_match.group(2) else "",
+                    'descricao': item_match.group(3).strip(),
+                    'quantidade': float(item_match.group(4).replace(',', '.')),
+                    'unidade': item_match.group(5),
+                    'valor_unitario': float(item_match.group(6).replace(',', '.')),
+                    'valor_total': float(item_match.group(7).replace(',', '.')),
+                    'desconto': 0.0
+                }
+                if i+1 < len(lines):
+                    next_line = lines[i+1]
+                    if f"Seq.: {item_num}" in next_line and "Desconto" in next_line:
+                        desconto_match = re.search(r'Desconto\s+([\d,\.]+)', next_line)
+                        if desconto_match:
+                            item['desconto'] = float(desconto_match.group(1).replace(',', '.'))
+                            i += 1
+                items.append(item)
+            except Exception:
+                pass
+        i += 1
+    return items
+
+
+def _como_float(item) -> Dict:
+    """Converte os valores Decimal do item para comparar com o parser original"""
+    return {k: float(v) if k in ('valor_unitario', 'valor_total', 'desconto') else v
+            for k, v in dict(item).items()}
+
+
+def cronometrar(func, arg, repeticoes: int) -> float:
+    melhor = float('inf')
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        func(arg)
+        melhor = min(melhor, time.perf_counter() - inicio)
+    return melhor
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--itens', type=int, default=50000)
+    parser.add_argument('--repeticoes', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    reader = CupomReader()
+    cenarios = [
+        ("linhas de item", gerar_texto(args.itens)),
+        # Cabeçalhos e rodapés de muitas páginas/cupons: nenhuma linha é item
+        ("linhas descartadas",
+         "\n".join((CABECALHO + RODAPE) * (args.itens // 10)).format(total="0,00", chave=chave_acesso())),
+    ]
+
+    for nome, texto in cenarios:
+        if [_como_float(i) for i in reader.parse_items(texto)] != parse_legado(texto):
+            print(f"ERRO: saída do parser difere do padrão original ({nome})", file=sys.stderr)
+            return 1
+
+        n_linhas = texto.count('\n') + 1
+        t_legado = cronometrar(parse_legado, texto, args.repeticoes)
+        t_atual = cronometrar(reader.parse_items, texto, args.repeticoes)
+        print(f"{nome}: {n_linhas} linhas (melhor de {args.repeticoes})")
+        print(f"  regex original: {t_legado * 1e6 / n_linhas:7.2f} us/linha  {t_legado:.3f} s")
+        print(f"  parser atual:   {t_atual * 1e6 / n_linhas:7.2f} us/linha  {t_atual:.3f} s")
+        print(f"  ganho: {t_legado / t_atual:.2f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
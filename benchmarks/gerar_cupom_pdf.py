@@ -0,0 +1,260 @@
+"""Gerador de cupons PDF sintéticos (sem dependências).
+
+Uso: python benchmarks/gerar_cupom_pdf.py saida.pdf [--itens N] [--paginas P]
+     [--descontos 0.15] [--repetidos 0.2] [--cupons C] [--formato muffato]
+     [--xml saida.xml]
+
+O layout padrão é o Muffato; ``--formato`` gera as variantes de DANFE NFC-e
+de ``cupom_formatos`` (nfce_item, nfce); ``--xml`` grava também o XML da
+NFC-e com os mesmos itens e a mesma chave de acesso.
+
+O PDF é escrito diretamente (fonte Courier, texto selecionável), então a
+extração do pdfplumber reproduz as colunas como em um cupom real.
+"""
+import math
+import zlib
+import random
+import argparse
+from typing import Optional, List
+
+PRODUTOS = [
+    ("7891000100103", "LEITE CONDENSADO MOCOCA 395G", "UN"),
+    ("7896004000014", "ARROZ TIPO 1 TIO JOAO 5KG", "UN"),
+    ("2000123000000", "PAO FRANCES KG", "KG"),
+    ("7894900011517", "REFRIGERANTE COCA COLA 2L", "UN"),
+    ("", "SACOLA PLASTICA", "UN"),
+    ("7891910000197", "ACUCAR REFINADO UNIAO 1KG", "UN."),
+    ("7891149103102", "CAFE TORRADO MOIDO PILAO 500G", "UN"),
+    ("7891024134702", "CREME DENTAL COLGATE 90G", "UN"),
+]
+
+CABECALHO = [
+    "SUPERMERCADO MUFFATO LTDA",
+    "CNPJ: 00.000.000/0001-00    Av. Brasil, 1000",
+    "Documento Auxiliar da Nota Fiscal de Consumidor Eletronica",
+]
+# Cabeçalho da tabela de itens de cada formato
+CABECALHO_TABELA = {
+    'muffato': "ITEM  COD.           DESC.                           QTD   UN   VL UNIT   VL ITEM",
+    'nfce_item': "ITEM CÓDIGO         DESCRIÇÃO                           QTD UN   VL UNIT   VL TOTAL",
+    'nfce': "Código         Descrição                              Qtde UN    Vl Unit  Vl Total",
+}
+FORMATOS = list(CABECALHO_TABELA)
+
+RODAPE = [
+    "Valor a pagar R$                                          {total}",
+    "FORMA PAGAMENTO                                  VALOR PAGO R$",
+    "Consulte pela Chave de Acesso em www.fazenda.pr.gov.br/nfce/consulta",
+    "{chave}",
+    "CONSUMIDOR NAO IDENTIFICADO",
+    "NFC-e n. 000123456   Serie 001   01/05/2023 10:00:00",
+    "Protocolo de Autorizacao: 141230000000000 01/05/2023 10:00:00",
+]
+
+
+def _br(valor: float, casas: int = 2) -> str:
+    return f"{valor:.{casas}f}".replace('.', ',')
+
+
+def _codigo_interno(descricao: str) -> str:
+    """Código interno do produto (cProd), fixo por descrição"""
+    return f"{zlib.crc32(descricao.encode()) % 10 ** 6:06d}"
+
+
+def _linha_item(formato: str, i: int, codigo: str, descricao: str, un: str,
+                qtd: float, unit: float, valor: float) -> str:
+    if formato == 'nfce_item':
+        return (f"{i:03d} {codigo or _codigo_interno(descricao):<14} {descricao:<35} {_br(qtd, 3)}{un} X "
+                f"{_br(unit):>8}  {_br(valor):>8}")
+    if formato == 'nfce':
+        return (f"{codigo or _codigo_interno(descricao):<14} {descricao:<35} {_br(qtd, 3):>7} {un:<4} "
+                f"{_br(unit):>8}  {_br(valor):>8}")
+    return (f"{i:<5} {codigo:<14} {descricao:<35} {_br(qtd, 3):>7}  {un:<4} "
+            f"{_br(unit):>8}  {_br(valor):>8}")
+
+
+def _linha_desconto(formato: str, i: int, desconto: float) -> str:
+    if formato == 'nfce_item':
+        return f"    Desconto sobre item -{_br(desconto)}"
+    return f"      Seq.: {i}   Desconto      {_br(desconto)}"
+
+
+def gerar_itens(n_itens: int, descontos: float = 0.15, repetidos: float = 0.2,
+                seed: int = 0, com_descontos: bool = True) -> List[tuple]:
+    """Itens de um cupom: (item, código, descrição, un, qtd, unitário, total, desconto).
+
+    ``descontos`` é a fração de itens com desconto; ``repetidos`` é a fração
+    que repete exatamente um item anterior (para o agrupamento de itens iguais).
+    """
+    rnd = random.Random(seed)
+    itens = []
+    anteriores = []
+    for i in range(1, n_itens + 1):
+        if anteriores and rnd.random() < repetidos:
+            codigo, descricao, un, qtd, unit = rnd.choice(anteriores)
+        else:
+            codigo, descricao, un = rnd.choice(PRODUTOS)
+            qtd = rnd.choice([1, 1, 1, 2, 3]) if un != "KG" else rnd.randint(100, 2500) / 1000
+            unit = rnd.randint(99, 9999) / 100
+            anteriores.append((codigo, descricao, un, qtd, unit))
+        desconto = 0.0
+        if com_descontos and rnd.random() < descontos:
+            desconto = rnd.randint(10, 200) / 100
+        itens.append((i, codigo, descricao, un, qtd, unit, round(qtd * unit, 2), desconto))
+    return itens
+
+
+def chave_acesso(seed: int = 0) -> str:
+    """Chave de acesso de 44 dígitos (com dígito verificador válido) para o cupom"""
+    # UF, AAMM, CNPJ, modelo 65, série, número, tipo de emissão e código numérico
+    base = f"41{2305}{100:014d}65001{seed + 1:09d}1{seed * 7919 % 10 ** 8:08d}"
+    pesos = [2, 3, 4, 5, 6, 7, 8, 9] * 6
+    dv = 11 - sum(int(d) * p for d, p in zip(reversed(base), pesos)) % 11
+    return base + str(0 if dv >= 10 else dv)
+
+
+def gerar_linhas(n_itens: int, descontos: float = 0.15, repetidos: float = 0.2,
+                 seed: int = 0, formato: str = 'muffato') -> List[str]:
+    """Linhas de um cupom com ``n_itens`` itens (veja ``gerar_itens``).
+
+    Cada desconto vira uma linha 'Seq.: N ... Desconto' após o item; o
+    formato nfce não tem desconto por item.
+    """
+    linhas = CABECALHO + [CABECALHO_TABELA[formato]]
+    total = 0.0
+    for i, codigo, descricao, un, qtd, unit, valor, desconto in gerar_itens(
+            n_itens, descontos, repetidos, seed, formato != 'nfce'):
+        total += valor - desconto
+        linhas.append(_linha_item(formato, i, codigo, descricao, un, qtd, unit, valor))
+        if desconto:
+            linhas.append(_linha_desconto(formato, i, desconto))
+    chave = chave_acesso(seed)
+    linhas.append(f"Qtde. total de itens                                      {n_itens}")
+    linhas += [linha.format(total=_br(total), chave=' '.join(chave[i:i + 4] for i in range(0, 44, 4)))
+               for linha in RODAPE]
+    return linhas
+
+
+def escrever_xml(caminho: str, cupons: List[tuple]):
+    """Escreve as NFC-e (itens, chave) em um XML; com mais de uma, em um lote"""
+    notas = []
+    for itens, chave in cupons:
+        dets = []
+        total = 0.0
+        for i, codigo, descricao, un, qtd, unit, valor, desconto in itens:
+            total += valor - desconto
+            dets.append(
+                f'<det nItem="{i}"><prod><cProd>{_codigo_interno(descricao)}</cProd>'
+                f'<cEAN>{codigo or "SEM GTIN"}</cEAN>'
+                f'<xProd>{descricao}</xProd><uCom>{un.rstrip(".")}</uCom><qCom>{qtd:.4f}</qCom>'
+                f'<vUnCom>{unit:.10f}</vUnCom><vProd>{valor:.2f}</vProd>'
+                + (f'<vDesc>{desconto:.2f}</vDesc>' if desconto else '')
+                + '</prod><imposto><vTotTrib>0.00</vTotTrib></imposto></det>'
+            )
+        notas.append(
+            f'<nfeProc versao="4.00" xmlns="http://www.portalfiscal.inf.br/nfe"><NFe>'
+            f'<infNFe Id="NFe{chave}" versao="4.00"><ide><mod>65</mod>'
+            f'<dhEmi>2023-05-01T10:00:00-03:00</dhEmi></ide>' + ''.join(dets)
+            + f'<total><ICMSTot><vNF>{total:.2f}</vNF></ICMSTot></total></infNFe></NFe>'
+            f'<protNFe><infProt><chNFe>{chave}</chNFe></infProt></protNFe></nfeProc>'
+        )
+    conteudo = notas[0] if len(notas) == 1 else '<lote>' + ''.join(notas) + '</lote>'
+    with open(caminho, 'w', encoding='utf-8') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>' + conteudo)
+
+
+def _escapar(texto: str) -> bytes:
+    texto = texto.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+    return texto.encode('cp1252', errors='replace')
+
+
+def escrever_pdf(caminho: str, linhas: List[str], linhas_por_pagina: int = 70,
+                 tamanho_fonte: float = 7.0):
+    """Escreve as linhas em um PDF (Courier, uma linha de texto por linha)"""
+    largura, altura = 420, 80 + linhas_por_pagina * tamanho_fonte * 1.3
+    paginas = [linhas[i:i + linhas_por_pagina] for i in range(0, len(linhas), linhas_por_pagina)] or [[]]
+
+    objetos = []  # Conteúdo de cada objeto, numerados a partir de 1
+
+    def novo_objeto(conteudo: bytes) -> int:
+        objetos.append(conteudo)
+        return len(objetos)
+
+    catalogo = novo_objeto(b"")  # Preenchido no final
+    raiz_paginas = novo_objeto(b"")
+    fonte = novo_objeto(b"<< /Type /Font /Subtype /Type1 /BaseFont /Courier "
+                        b"/Encoding /WinAnsiEncoding >>")
+    ids_paginas = []
+    for linhas_pagina in paginas:
+        partes = [b"BT", b"/F1 %.1f Tf" % tamanho_fonte, b"%.1f TL" % (tamanho_fonte * 1.3),
+                  b"20 %.1f Td" % (altura - 40)]
+        for linha in linhas_pagina:
+            partes.append(b"(" + _escapar(linha) + b") Tj T*")
+        partes.append(b"ET")
+        stream = b"\n".join(partes)
+        conteudo = novo_objeto(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        ids_paginas.append(novo_objeto(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %d %d] "
+            b"/Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>"
+            % (raiz_paginas, largura, altura, fonte, conteudo)
+        ))
+    objetos[catalogo - 1] = b"<< /Type /Catalog /Pages %d 0 R >>" % raiz_paginas
+    objetos[raiz_paginas - 1] = (b"<< /Type /Pages /Kids [" + b" ".join(b"%d 0 R" % p for p in ids_paginas)
+                                 + b"] /Count %d >>" % len(ids_paginas))
+
+    saida = bytearray(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    offsets = []
+    for n, conteudo in enumerate(objetos, 1):
+        offsets.append(len(saida))
+        saida += b"%d 0 obj\n" % n + conteudo + b"\nendobj\n"
+    xref = len(saida)
+    saida += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objetos) + 1)
+    for offset in offsets:
+        saida += b"%010d 00000 n \n" % offset
+    saida += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (
+        len(objetos) + 1, catalogo, xref)
+
+    with open(caminho, 'wb') as f:
+        f.write(saida)
+
+
+def gerar_cupom_pdf(caminho: str, n_itens: int, paginas: Optional[int] = None,
+                    descontos: float = 0.15, repetidos: float = 0.2, cupons: int = 1,
+                    seed: int = 0, formato: str = 'muffato',
+                    xml: Optional[str] = None) -> List[str]:
+    """Gera o PDF (e, com ``xml``, o XML das NFC-e) e retorna as linhas escritas.
+
+    Com ``cupons`` > 1 gera um PDF mesclado, com vários cupons em sequência
+    (cada um com seu cabeçalho e rodapé). ``paginas`` fixa o número de
+    páginas; sem ele, usa 70 linhas por página.
+    """
+    linhas = []
+    for c in range(cupons):
+        linhas += gerar_linhas(n_itens, descontos, repetidos, seed + c, formato)
+    por_pagina = math.ceil(len(linhas) / paginas) if paginas else 70
+    escrever_pdf(caminho, linhas, por_pagina)
+    if xml:
+        escrever_xml(xml, [(gerar_itens(n_itens, descontos, repetidos, seed + c, formato != 'nfce'),
+                            chave_acesso(seed + c)) for c in range(cupons)])
+    return linhas
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Gera cupons PDF sintéticos")
+    parser.add_argument('saida')
+    parser.add_argument('--itens', type=int, default=100)
+    parser.add_argument('--paginas', type=int, default=None)
+    parser.add_argument('--descontos', type=float, default=0.15)
+    parser.add_argument('--repetidos', type=float, default=0.2)
+    parser.add_argument('--cupons', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--formato', choices=FORMATOS, default='muffato')
+    parser.add_argument('--xml', help="Grava também o XML das NFC-e neste arquivo")
+    args = parser.parse_args(argv)
+    linhas = gerar_cupom_pdf(args.saida, args.itens, args.paginas, args.descontos,
+                             args.repetidos, args.cupons, args.seed, args.formato, args.xml)
+    print(f"{args.saida}: {len(linhas)} linhas")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,443 @@
+"""Agregação de itens: as duas visões de um cupom e totais entre cupons.
+
+``VisaoCupom`` guarda os itens como lidos e calcula uma única vez a versão
+agrupada (itens iguais somados), então alternar "Agrupar itens iguais" não
+reprocessa o PDF. ``Agregacao`` soma quantidade, valor e desconto por grupo
+(produto, dia, loja ou combinações deles) à medida que os cupons chegam:
+cada cupom custa O(itens), e agregações parciais (de outro processo, de
+outra execução) se combinam com ``mesclar``. ``RelatorioIncremental`` mantém
+os totais em SQLite, somando cada cupom só aos seus grupos. Valores em
+centavos inteiros, sem erro de arredondamento nas somas. Os itens chegam em
+colunas (``ItensColunares``) e são somados aos grupos em lotes, coluna a
+coluna (NumPy, se instalado), em vez de item a item.
+"""
+import os
+import csv
+import time
+import sqlite3
+from array import array
+from decimal import Decimal
+from datetime import datetime
+from operator import attrgetter
+from typing import Optional, List, Dict, Iterable, Iterator, Tuple, Callable
+
+from cupom_itens import (CupomItem, ItensColunares, de_centavos, somar_centavos,
+                         somar_por_grupo)
+from cupom_devolucao import (ResultadoDevolucao, STATUS_OK, STATUS_PARCIAL,
+                             normalizar_codigo, normalizar_descricao)
+
+
+def agrupar_itens(items: Iterable[CupomItem]) -> List[CupomItem]:
+    """Soma os itens idênticos (código, descrição e unitário), na ordem do número do item"""
+    grouped = {}
+    for item in items:
+        key = (item.codigo, item.descricao, item.valor_unitario)
+        agrupado = grouped.get(key)
+        if agrupado is None:
+            grouped[key] = item.copy()
+        else:
+            agrupado.quantidade += item.quantidade
+            agrupado.valor_total += item.valor_total
+            agrupado.desconto += item.desconto
+    return sorted(grouped.values(), key=attrgetter('item'))
+
+
+class VisaoCupom:
+    """Itens de um cupom como lidos e agrupados; o agrupamento é calculado uma vez"""
+
+    def __init__(self, itens: Iterable[CupomItem]):
+        self.brutos = list(itens)
+        self._agrupados: Optional[List[CupomItem]] = None
+
+    @property
+    def agrupados(self) -> List[CupomItem]:
+        if self._agrupados is None:
+            self._agrupados = agrupar_itens(self.brutos)
+        return self._agrupados
+
+    def itens(self, agrupar: bool) -> List[CupomItem]:
+        return self.agrupados if agrupar else self.brutos
+
+    def aplicar(self, resultado: Dict, agrupar: bool) -> Dict:
+        """Cópia do resultado de ``process_cupom`` com os itens da visão pedida.
+
+        Os totais de valor e desconto são os mesmos nas duas visões; só
+        ``total_itens`` muda.
+        """
+        itens = self.itens(agrupar)
+        return {**resultado, 'itens': itens, 'total_itens': len(itens)}
+
+
+def _produto(item: CupomItem) -> str:
+    """O mesmo produto em cupons diferentes: pelo EAN ou, sem ele, pela descrição"""
+    return normalizar_codigo(item.codigo) or normalizar_descricao(item.descricao)
+
+
+def _dia(cupom: Dict) -> str:
+    emissao = cupom.get('emissao')
+    return emissao.date().isoformat() if emissao else ""
+
+
+def _loja(cupom: Dict) -> str:
+    """CNPJ do emitente, lido da chave de acesso (posições 7 a 20)"""
+    chave = cupom.get('chave')
+    return chave[6:20] if chave else ""
+
+
+# Dimensões de agrupamento: as de item mudam a cada item, as de cupom são
+# calculadas uma vez por cupom
+DIMENSOES_ITEM: Dict[str, Callable[[CupomItem], str]] = {'produto': _produto}
+DIMENSOES_CUPOM: Dict[str, Callable[[Dict], str]] = {'dia': _dia, 'loja': _loja}
+DIMENSOES = list(DIMENSOES_ITEM) + list(DIMENSOES_CUPOM)
+TITULOS = {'dia': 'Dia', 'loja': 'Loja (CNPJ)'}
+
+
+# Itens acumulados antes de somar as colunas de totais de uma vez
+LOTE_SOMA = 4096
+
+
+class Agregacao:
+    def __init__(self, por: Iterable[str] = ('produto',)):
+        """``por``: dimensões do agrupamento, em ordem (de ``DIMENSOES``)"""
+        por = tuple(por)
+        if not por:
+            raise ValueError("Nenhuma dimensão de agrupamento informada")
+        for nome in por:
+            if nome not in DIMENSOES:
+                raise ValueError(f"Dimensão desconhecida: {nome} (use {', '.join(DIMENSOES)})")
+        self.por = por
+        # Posição de cada grupo (chave) nas colunas de totais
+        self.indices: Dict[tuple, int] = {}
+        self.quantidades = array('d')
+        self.valores = array('q')  # Centavos
+        self.descontos = array('q')  # Centavos
+        self.contagens = array('q')  # Linhas de item somadas
+        # Código e descrição de cada produto (os primeiros vistos), para o relatório
+        self.produtos: Dict[str, Tuple[str, str]] = {}
+        self.cupons = 0
+        self.devolucoes = 0
+        # Itens ainda não somados, em colunas, e o grupo de cada um
+        self._pendentes = ItensColunares()
+        self._grupos_pendentes = array('q')
+        self._sinal = 1
+
+    def __len__(self) -> int:
+        """Número de grupos"""
+        return len(self.indices)
+
+    def _chave(self, fixos: Dict[str, str], item: CupomItem) -> tuple:
+        return tuple(fixos[nome] if nome in fixos else DIMENSOES_ITEM[nome](item) for nome in self.por)
+
+    def _fixos(self, cupom: Dict) -> Dict[str, str]:
+        return {nome: DIMENSOES_CUPOM[nome](cupom) for nome in self.por if nome in DIMENSOES_CUPOM}
+
+    def _indice(self, chave: tuple, item: Optional[CupomItem] = None) -> int:
+        """Posição do grupo nas colunas, criando-o (zerado) se for novo"""
+        indice = self.indices.get(chave)
+        if indice is None:
+            indice = self.indices[chave] = len(self.valores)
+            self.quantidades.append(0.0)
+            self.valores.append(0)
+            self.descontos.append(0)
+            self.contagens.append(0)
+            if item is not None and 'produto' in self.por:
+                self.produtos.setdefault(chave[self.por.index('produto')], (item.codigo, item.descricao))
+        return indice
+
+    def _adicionar(self, fixos: Dict[str, str], itens: List[CupomItem], sinal: int):
+        """Guarda os itens (e seus grupos) para somar em lote"""
+        if sinal != self._sinal:
+            self._consolidar()
+            self._sinal = sinal
+        for item in itens:
+            self._grupos_pendentes.append(self._indice(self._chave(fixos, item), item))
+        self._pendentes.extend(itens)
+        if len(self._pendentes) >= LOTE_SOMA:
+            self._consolidar()
+
+    def _consolidar(self):
+        """Soma os itens pendentes às colunas de totais, uma coluna por vez"""
+        if not len(self._pendentes):
+            return
+        grupos, pendentes = self._grupos_pendentes, self._pendentes
+        somar_por_grupo(self.quantidades, grupos, pendentes.quantidade, self._sinal)
+        somar_por_grupo(self.valores, grupos, pendentes.valor_total, self._sinal)
+        somar_por_grupo(self.descontos, grupos, pendentes.desconto, self._sinal)
+        somar_por_grupo(self.contagens, grupos, array('q', [1]) * len(grupos), self._sinal)
+        self._pendentes = ItensColunares()
+        self._grupos_pendentes = array('q')
+
+    def acumular(self, cupom: Dict, sinal: int = 1):
+        """Soma os itens de um resultado de ``process_cupom``; ``sinal=-1`` retira o cupom"""
+        self._adicionar(self._fixos(cupom), cupom['itens'], sinal)
+        self.cupons += sinal
+
+    def acumular_devolucao(self, cupom: Dict, resultados: Iterable[ResultadoDevolucao],
+                           data: Optional[datetime] = None):
+        """Soma o que foi devolvido (quantidade e valor líquido) de cada produto do
+        cupom; ``data``: a da devolução, que define o dia (padrão: a emissão do cupom)"""
+        devolvidos = [
+            CupomItem(r.item.item, r.item.codigo, r.item.descricao, r.quantidade_devolvida,
+                      r.item.unidade, r.item.valor_unitario, r.valor_devolvido)
+            for r in resultados if r.status in (STATUS_OK, STATUS_PARCIAL)
+        ]
+        if data is not None:
+            cupom = {**cupom, 'emissao': data}
+        self._adicionar(self._fixos(cupom), devolvidos, 1)
+        self.devolucoes += 1
+
+    def mesclar(self, outra: 'Agregacao'):
+        """Soma outra agregação com as mesmas dimensões a esta (O(grupos da outra))"""
+        if outra.por != self.por:
+            raise ValueError(f"Dimensões diferentes: {outra.por} e {self.por}")
+        self._consolidar()
+        outra._consolidar()
+        # As posições da outra seguem a ordem de inserção de ``indices``
+        grupos = array('q', map(self._indice, outra.indices))
+        somar_por_grupo(self.quantidades, grupos, outra.quantidades)
+        somar_por_grupo(self.valores, grupos, outra.valores)
+        somar_por_grupo(self.descontos, grupos, outra.descontos)
+        somar_por_grupo(self.contagens, grupos, outra.contagens)
+        for produto, rotulo in outra.produtos.items():
+            self.produtos.setdefault(produto, rotulo)
+        self.cupons += outra.cupons
+        self.devolucoes += outra.devolucoes
+
+    def total(self) -> Decimal:
+        """Soma dos valores de todos os grupos"""
+        self._consolidar()
+        return de_centavos(somar_centavos(self.valores))
+
+    def totais(self) -> Iterator[Tuple[tuple, float, int, int, int]]:
+        """(chave, quantidade, valor, desconto, linhas) de cada grupo, com os valores em centavos"""
+        self._consolidar()
+        for chave, i in self.indices.items():
+            yield chave, self.quantidades[i], self.valores[i], self.descontos[i], self.contagens[i]
+
+    def linhas(self) -> List[Dict]:
+        """Um dicionário por grupo, ordenado pelas dimensões"""
+        return [_linha(self.por, chave, self.produtos.get, *valores)
+                for chave, *valores in sorted(self.totais())]
+
+    def gravar_csv(self, caminho: str):
+        """Grava o relatório (um grupo por linha) em CSV, como o do lote"""
+        _gravar_csv(caminho, self.por, self.linhas())
+
+
+def _linha(por: Tuple[str, ...], chave: tuple, rotulo: Callable, quantidade: float, valor: int,
+           desconto: int, linhas: int) -> Dict:
+    """Linha do relatório de um grupo; ``rotulo(produto)`` dá (código, descrição)"""
+    linha = dict(zip(por, chave))
+    if 'produto' in linha:
+        linha['codigo'], linha['descricao'] = rotulo(linha['produto']) or ("", "")
+    linha.update(
+        quantidade=round(quantidade, 3),
+        valor=de_centavos(valor),
+        desconto=de_centavos(desconto),
+        liquido=de_centavos(valor - desconto),
+        linhas=linhas,
+    )
+    return linha
+
+
+def _gravar_csv(caminho: str, por: Tuple[str, ...], linhas: Iterable[Dict]):
+    """Grava as linhas do relatório em CSV; quem lê o arquivo nunca o vê pela metade"""
+    titulos = []
+    for nome in por:
+        titulos += ['Código', 'Descrição'] if nome == 'produto' else [TITULOS[nome]]
+    temporario = caminho + '.tmp'
+    with open(temporario, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f, delimiter=';')
+        writer.writerow(titulos + ['Qtd', 'Valor', 'Desconto', 'Líquido', 'Linhas'])
+        for linha in linhas:
+            colunas = []
+            for nome in por:
+                colunas += [linha['codigo'], linha['descricao']] if nome == 'produto' else [linha[nome]]
+            writer.writerow(colunas + [f"{linha['quantidade']:g}", linha['valor'], linha['desconto'],
+                                       linha['liquido'], linha['linhas']])
+    os.replace(temporario, caminho)
+
+
+def _origem(cupom: Dict) -> Optional[str]:
+    """Identifica o cupom entre leituras: a chave de acesso ou, sem ela, o
+    arquivo e a posição nele (``'parte'``); None se não há nenhum dos dois"""
+    if cupom.get('chave'):
+        return cupom['chave']
+    if cupom.get('arquivo'):
+        return f"{os.path.abspath(cupom['arquivo'])}#{cupom.get('parte') or 1}"
+    return None
+
+
+# Segundos entre duas gravações do CSV do relatório incremental
+INTERVALO_CSV = 60.0
+
+
+class RelatorioIncremental:
+    def __init__(self, caminho: str, por: Iterable[str] = ('produto',),
+                 intervalo_csv: Optional[float] = INTERVALO_CSV):
+        """Relatório CSV em ``caminho`` com os totais em SQLite ao lado
+        (``caminho``.sqlite3), para continuar após reiniciar.
+
+        Cada cupom soma só os seus grupos no banco (upsert), em O(itens); o
+        CSV, O(grupos), é regravado no máximo a cada ``intervalo_csv``
+        segundos (None: só por ``gravar_csv`` e ``close``). A parte de cada
+        cupom fica gravada (``contribuicoes``): o mesmo cupom lido de novo
+        (ex.: o PDF alterado) substitui a anterior em vez de somar duas vezes.
+        """
+        self.caminho = caminho
+        self.por = Agregacao(por).por  # Valida as dimensões
+        self.intervalo_csv = intervalo_csv
+        self._csv_em = time.monotonic()
+        self._pendente = False  # Totais mudaram desde o último CSV
+        pasta = os.path.dirname(caminho)
+        if pasta:
+            os.makedirs(pasta, exist_ok=True)
+        self._conn = sqlite3.connect(caminho + '.sqlite3', timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        # Uma coluna por dimensão (nomes de DIMENSOES, já validados)
+        dimensoes = ', '.join(f"{nome} TEXT NOT NULL" for nome in self.por)
+        self._conn.executescript(f"""
+            CREATE TABLE IF NOT EXISTS relatorio (nome TEXT PRIMARY KEY, valor);
+            CREATE TABLE IF NOT EXISTS grupos (
+                id INTEGER PRIMARY KEY,
+                {dimensoes},
+                codigo TEXT,
+                descricao TEXT,
+                quantidade REAL NOT NULL,
+                valor_centavos INTEGER NOT NULL,
+                desconto_centavos INTEGER NOT NULL,
+                linhas INTEGER NOT NULL,
+                UNIQUE ({', '.join(self.por)})
+            );
+            -- Cupons somados: pela chave de acesso ou pelo arquivo e a posição nele
+            CREATE TABLE IF NOT EXISTS origens (origem TEXT PRIMARY KEY);
+            -- O que cada cupom somou a cada grupo, para retirá-lo
+            CREATE TABLE IF NOT EXISTS contribuicoes (
+                origem TEXT NOT NULL REFERENCES origens(origem),
+                grupo INTEGER NOT NULL REFERENCES grupos(id),
+                quantidade REAL NOT NULL,
+                valor_centavos INTEGER NOT NULL,
+                desconto_centavos INTEGER NOT NULL,
+                linhas INTEGER NOT NULL,
+                PRIMARY KEY (origem, grupo)
+            );
+        """)
+        gravado = self._conn.execute("SELECT valor FROM relatorio WHERE nome = 'por'").fetchone()
+        if gravado is None:
+            self._conn.execute("INSERT INTO relatorio VALUES ('por', ?)", (','.join(self.por),))
+            self._conn.execute("INSERT INTO relatorio VALUES ('cupons', 0)")
+            self._conn.execute("INSERT INTO relatorio VALUES ('devolucoes', 0)")
+        elif gravado[0] != ','.join(self.por):
+            self._conn.close()
+            raise ValueError(f"{caminho}.sqlite3 agrupa por {gravado[0]}, não por {','.join(self.por)}")
+        self._conn.commit()
+
+        colunas = ', '.join(self.por)
+        marcadores = ', '.join('?' * len(self.por))
+        self._sql_somar = (
+            f"INSERT INTO grupos ({colunas}, codigo, descricao, quantidade, valor_centavos, "
+            f"desconto_centavos, linhas) VALUES ({marcadores}, ?, ?, ?, ?, ?, ?) "
+            f"ON CONFLICT ({colunas}) DO UPDATE SET quantidade = quantidade + excluded.quantidade, "
+            f"valor_centavos = valor_centavos + excluded.valor_centavos, "
+            f"desconto_centavos = desconto_centavos + excluded.desconto_centavos, "
+            f"linhas = linhas + excluded.linhas"
+        )
+        self._sql_grupo = f"SELECT id FROM grupos WHERE {' AND '.join(f'{nome} = ?' for nome in self.por)}"
+
+    def acumular(self, cupom: Dict):
+        """Soma o cupom (O(itens)), no lugar do que ele já tinha somado; o CSV
+        é regravado se o intervalo passou"""
+        parcial = Agregacao(self.por)
+        parcial.acumular(cupom)
+        origem = _origem(cupom)
+        with self._conn:  # Uma transação por cupom
+            repetido = origem is not None and self._retirar(origem)
+            grupos = self._somar(parcial)
+            if origem is not None:
+                self._conn.execute("INSERT INTO origens VALUES (?)", (origem,))
+                self._conn.executemany(
+                    "INSERT INTO contribuicoes VALUES (?, ?, ?, ?, ?, ?)",
+                    [(origem, grupo, *totais) for grupo, totais in grupos]
+                )
+            if not repetido:
+                self._conn.execute("UPDATE relatorio SET valor = valor + 1 WHERE nome = 'cupons'")
+        self._alterado()
+
+    def acumular_devolucao(self, cupom: Dict, resultados: Iterable[ResultadoDevolucao],
+                           data: Optional[datetime] = None):
+        """Soma uma devolução confirmada do cupom (veja ``Agregacao.acumular_devolucao``);
+        devoluções são contadas à parte dos cupons"""
+        parcial = Agregacao(self.por)
+        parcial.acumular_devolucao(cupom, resultados, data)
+        with self._conn:
+            self._somar(parcial)
+            self._conn.execute("UPDATE relatorio SET valor = valor + 1 WHERE nome = 'devolucoes'")
+        self._alterado()
+
+    def _alterado(self):
+        self._pendente = True
+        if self.intervalo_csv is not None and time.monotonic() - self._csv_em >= self.intervalo_csv:
+            self.gravar_csv()
+
+    def _somar(self, parcial: 'Agregacao') -> List[Tuple[int, tuple]]:
+        """Upsert dos grupos de uma agregação parcial nos totais gravados;
+        retorna o id e os totais somados de cada grupo"""
+        rotulo = parcial.produtos.get
+        produto = self.por.index('produto') if 'produto' in self.por else None
+        grupos = []
+        for chave, *totais in parcial.totais():
+            self._conn.execute(self._sql_somar, (
+                *chave, *(rotulo(chave[produto]) if produto is not None else (None, None)), *totais
+            ))
+            grupos.append((self._conn.execute(self._sql_grupo, chave).fetchone()[0], tuple(totais)))
+        return grupos
+
+    def _retirar(self, origem: str) -> bool:
+        """Desfaz o que o cupom ``origem`` somou, se já somado; grupos que ficam
+        sem linhas saem do relatório"""
+        contribuicoes = self._conn.execute(
+            "SELECT quantidade, valor_centavos, desconto_centavos, linhas, grupo FROM contribuicoes "
+            "WHERE origem = ?", (origem,)
+        ).fetchall()
+        self._conn.executemany(
+            "UPDATE grupos SET quantidade = quantidade - ?, valor_centavos = valor_centavos - ?, "
+            "desconto_centavos = desconto_centavos - ?, linhas = linhas - ? WHERE id = ?",
+            contribuicoes
+        )
+        self._conn.execute("DELETE FROM contribuicoes WHERE origem = ?", (origem,))
+        self._conn.executemany("DELETE FROM grupos WHERE id = ? AND linhas = 0",
+                               [(row[-1],) for row in contribuicoes])
+        return self._conn.execute("DELETE FROM origens WHERE origem = ?", (origem,)).rowcount > 0
+
+    @property
+    def cupons(self) -> int:
+        return self._conn.execute("SELECT valor FROM relatorio WHERE nome = 'cupons'").fetchone()[0]
+
+    @property
+    def devolucoes(self) -> int:
+        return self._conn.execute("SELECT valor FROM relatorio WHERE nome = 'devolucoes'").fetchone()[0]
+
+    def linhas(self) -> Iterator[Dict]:
+        """Linhas do relatório, ordenadas pelas dimensões, lidas do banco"""
+        n = len(self.por)
+        cursor = self._conn.execute(
+            f"SELECT {', '.join(self.por)}, codigo, descricao, quantidade, valor_centavos, "
+            f"desconto_centavos, linhas FROM grupos ORDER BY {', '.join(self.por)}"
+        )
+        for row in cursor:
+            rotulo = (row[n], row[n + 1])
+            yield _linha(self.por, row[:n], lambda _: rotulo, *row[n + 2:])
+
+    def gravar_csv(self, caminho: Optional[str] = None):
+        """Regrava o CSV (``caminho`` ou o do relatório) com os totais atuais"""
+        _gravar_csv(caminho or self.caminho, self.por, self.linhas())
+        if caminho is None:
+            self._csv_em = time.monotonic()
+            self._pendente = False
+
+    def close(self):
+        """Grava o CSV, se houver cupons desde a última gravação, e fecha o banco"""
+        if self._pendente:
+            self.gravar_csv()
+        self._conn.close()
@@ -0,0 +1,111 @@
+"""Cache persistente (SQLite) de cupons já processados.
+
+A chave é o hash SHA-256 do conteúdo do PDF mais a versão do parser, então
+renomear ou copiar o arquivo não invalida o cache, e uma mudança no parser
+invalida tudo automaticamente.
+"""
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Optional, List, Dict
+
+CACHE_PADRAO = os.path.join(os.path.expanduser('~'), '.leitor_cupom', 'cache.sqlite3')
+TAMANHO_MAXIMO_PADRAO = 256 * 1024 * 1024  # bytes
+
+
+def hash_arquivo(file_path: str, bloco: int = 1024 * 1024) -> str:
+    """Calcula o SHA-256 do conteúdo do arquivo"""
+    h = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for parte in iter(lambda: f.read(bloco), b''):
+            h.update(parte)
+    return h.hexdigest()
+
+
+class CupomCache:
+    def __init__(self, caminho: str = CACHE_PADRAO, tamanho_maximo: int = TAMANHO_MAXIMO_PADRAO):
+        self.caminho = caminho
+        self.tamanho_maximo = tamanho_maximo
+        self._lock = threading.Lock()
+
+        pasta = os.path.dirname(caminho)
+        if pasta:
+            os.makedirs(pasta, exist_ok=True)
+        # Várias conexões (processos do lote) podem escrever ao mesmo tempo
+        self._conn = sqlite3.connect(caminho, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS cupons_cache (
+                hash TEXT NOT NULL,
+                versao TEXT NOT NULL,
+                texto TEXT NOT NULL,
+                itens TEXT NOT NULL,
+                tamanho INTEGER NOT NULL,
+                ultimo_acesso REAL NOT NULL,
+                PRIMARY KEY (hash, versao)
+            );
+            CREATE INDEX IF NOT EXISTS idx_cupons_cache_acesso ON cupons_cache (ultimo_acesso);
+        """)
+        self._conn.commit()
+
+    def obter(self, hash_pdf: str, versao: str) -> Optional[Dict]:
+        """Retorna {'texto', 'itens'} do cache ou None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT texto, itens FROM cupons_cache WHERE hash = ? AND versao = ?",
+                (hash_pdf, versao)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE cupons_cache SET ultimo_acesso = ? WHERE hash = ? AND versao = ?",
+                (time.time(), hash_pdf, versao)
+            )
+            self._conn.commit()
+        return {'texto': row[0], 'itens': json.loads(row[1])}
+
+    def gravar(self, hash_pdf: str, versao: str, texto: str, itens: List[Dict]):
+        """Grava o resultado e aplica o limite de tamanho (LRU)"""
+        # Valores Decimal são gravados como texto, sem perda de precisão
+        itens_json = json.dumps(itens, ensure_ascii=False, default=str)
+        tamanho = len(texto.encode('utf-8')) + len(itens_json.encode('utf-8'))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cupons_cache VALUES (?, ?, ?, ?, ?, ?)",
+                (hash_pdf, versao, texto, itens_json, tamanho, time.time())
+            )
+            self._remover_excedente()
+            self._conn.commit()
+
+    def _remover_excedente(self):
+        """Remove as entradas menos usadas até caber no tamanho máximo"""
+        total = self._conn.execute("SELECT COALESCE(SUM(tamanho), 0) FROM cupons_cache").fetchone()[0]
+        if total <= self.tamanho_maximo:
+            return
+        cursor = self._conn.execute(
+            "SELECT hash, versao, tamanho FROM cupons_cache ORDER BY ultimo_acesso"
+        )
+        remover = []
+        for hash_pdf, versao, tamanho in cursor:
+            if total <= self.tamanho_maximo:
+                break
+            remover.append((hash_pdf, versao))
+            total -= tamanho
+        self._conn.executemany("DELETE FROM cupons_cache WHERE hash = ? AND versao = ?", remover)
+
+    def invalidar(self, hash_pdf: Optional[str] = None):
+        """Remove uma entrada (todas as versões) ou, sem argumento, limpa o cache"""
+        with self._lock:
+            if hash_pdf is None:
+                self._conn.execute("DELETE FROM cupons_cache")
+            else:
+                self._conn.execute("DELETE FROM cupons_cache WHERE hash = ?", (hash_pdf,))
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,179 @@
+"""Conferência de devoluções contra os itens de um cupom.
+
+``IndiceDevolucao`` indexa os itens por código (EAN), descrição normalizada e
+número do item, e controla quanto ainda pode ser devolvido de cada linha do
+cupom ao longo de várias devoluções. Cada entrada é resolvida em O(1), então
+milhares de leituras do leitor de código de barras são conferidas em O(n).
+O saldo pode partir das devoluções já registradas (``CupomStore.devolvidos``),
+por linha do cupom (``chave_linha``), com os itens agrupados ou não.
+
+Formato das entradas (uma por linha):
+    7891000100103      uma unidade do código
+    3*7891000100103    três unidades
+    0,350*2000123000000  350 g de um item pesado (sem fração, cada unidade
+                       pedida devolve a linha pesada inteira)
+    #5                 o item 5 do cupom
+    LEITE CONDENSADO   pela descrição (sem diferenciar acentos/maiúsculas)
+"""
+import re
+import unicodedata
+from decimal import Decimal
+from dataclasses import dataclass, field
+from typing import Optional, List, Dict, Iterable, Tuple
+
+from cupom_itens import CupomItem, CENTAVO, ZERO
+
+STATUS_OK = "OK"
+STATUS_PARCIAL = "PARCIAL"
+STATUS_JA_DEVOLVIDO = "JÁ DEVOLVIDO"
+STATUS_NAO_ENCONTRADO = "DIVERGÊNCIA"
+
+_RE_QUANTIDADE = re.compile(r'(\d+(?:[.,]\d+)?)\s*\*\s*(.+)')
+
+
+def normalizar_descricao(texto: str) -> str:
+    """Maiúsculas, sem acentos e com espaços simples"""
+    texto = unicodedata.normalize('NFKD', texto)
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    return ' '.join(texto.upper().split())
+
+
+def normalizar_codigo(codigo: str) -> str:
+    """EAN/GTIN sem zeros à esquerda (GTIN-14 e EAN-13 do mesmo produto coincidem)"""
+    return codigo.strip().lstrip('0')
+
+
+def chave_linha(item: CupomItem) -> Tuple[str, str, str]:
+    """Identifica uma linha do cupom (código, descrição e unitário), agrupada ou não"""
+    return item.codigo, item.descricao, str(item.valor_unitario)
+
+
+def interpretar_entrada(linha: str) -> Tuple[str, float]:
+    """Separa 'qtd*entrada' em (entrada, quantidade); sem prefixo, quantidade 1"""
+    linha = linha.strip()
+    match = _RE_QUANTIDADE.fullmatch(linha)
+    if match:
+        return match.group(2).strip(), float(match.group(1).replace(',', '.'))
+    return linha, 1.0
+
+
+@dataclass
+class ResultadoDevolucao:
+    entrada: str
+    quantidade: float  # Solicitada
+    quantidade_devolvida: float = 0.0
+    valor_devolvido: Decimal = ZERO
+    itens: List[CupomItem] = field(default_factory=list)  # Linhas do cupom usadas
+    # Quantidade e valor devolvidos de cada linha de ``itens``
+    quantidades: List[float] = field(default_factory=list)
+    valores: List[Decimal] = field(default_factory=list)
+    status: str = STATUS_NAO_ENCONTRADO
+
+    @property
+    def item(self) -> Optional[CupomItem]:
+        return self.itens[0] if self.itens else None
+
+
+class IndiceDevolucao:
+    def __init__(self, itens: Iterable[CupomItem], devolvidos: Optional[Dict[tuple, float]] = None):
+        """``devolvidos``: quantidade já devolvida por ``chave_linha``, abatida
+        do saldo das linhas correspondentes, na ordem do cupom"""
+        self.itens = list(itens)
+        # Quantidade ainda devolvível de cada linha do cupom
+        self.restante = [item.quantidade for item in self.itens]
+        if devolvidos:
+            falta = dict(devolvidos)
+            for i, item in enumerate(self.itens):
+                chave = chave_linha(item)
+                if falta.get(chave, 0) > 0:
+                    abatida = min(falta[chave], self.restante[i])
+                    self.restante[i] -= abatida
+                    falta[chave] -= abatida
+
+        self._por_codigo: Dict[str, List[int]] = {}
+        self._por_descricao: Dict[str, List[int]] = {}
+        self._por_numero: Dict[int, List[int]] = {}
+        for i, item in enumerate(self.itens):
+            if item.codigo:
+                self._por_codigo.setdefault(normalizar_codigo(item.codigo), []).append(i)
+            self._por_descricao.setdefault(normalizar_descricao(item.descricao), []).append(i)
+            self._por_numero.setdefault(item.item, []).append(i)
+
+    def localizar(self, entrada: str) -> List[int]:
+        """Índices das linhas do cupom que correspondem à entrada"""
+        entrada = entrada.strip()
+        if entrada.startswith('#') and entrada[1:].isdigit():
+            return self._por_numero.get(int(entrada[1:]), [])
+        if entrada.isdigit():
+            linhas = self._por_codigo.get(normalizar_codigo(entrada))
+            if linhas:
+                return linhas
+        return self._por_descricao.get(normalizar_descricao(entrada), [])
+
+    def registrar(self, entradas: Iterable[str], confirmar: bool = True) -> List[ResultadoDevolucao]:
+        """Confere as entradas e abate as quantidades devolvidas.
+
+        Entradas repetidas são somadas (cada leitura do código vale uma
+        unidade) e geram um único resultado, na ordem da primeira leitura.
+        Com ``confirmar`` falso apenas simula, sem alterar o saldo.
+        """
+        pedidos: Dict[str, float] = {}
+        for linha in entradas:
+            entrada, quantidade = interpretar_entrada(linha)
+            if entrada:
+                pedidos[entrada] = pedidos.get(entrada, 0.0) + quantidade
+
+        restante = self.restante if confirmar else list(self.restante)
+        return [self._devolver(entrada, quantidade, restante)
+                for entrada, quantidade in pedidos.items()]
+
+    def _devolver(self, entrada: str, quantidade: float, restante: List[float]) -> ResultadoDevolucao:
+        resultado = ResultadoDevolucao(entrada, quantidade)
+        linhas = self.localizar(entrada)
+        if not linhas:
+            return resultado
+
+        falta = quantidade
+        # Pedido fracionado (ex.: 0,350) é um peso; inteiro, conta unidades
+        por_peso = quantidade != int(quantidade)
+        valor = ZERO
+        for i in linhas:
+            if falta <= 0:
+                break
+            if restante[i] <= 0:  # Já devolvida, ou linha com quantidade zero
+                continue
+            item = self.itens[i]
+            # Itens pesados (quantidade fracionada) pedidos por unidade: cada
+            # unidade devolve o que resta da linha
+            if item.quantidade != int(item.quantidade) and not por_peso:
+                devolvida = restante[i]
+                falta -= 1
+            else:
+                devolvida = min(falta, restante[i])
+                falta -= devolvida
+            restante[i] -= devolvida
+            resultado.quantidade_devolvida += devolvida
+            resultado.itens.append(item)
+            resultado.quantidades.append(devolvida)
+            # Valor líquido (total menos desconto) proporcional à quantidade
+            liquido = item.valor_total - item.desconto
+            if devolvida >= item.quantidade:
+                valor_linha = liquido
+            else:
+                proporcao = Decimal(str(devolvida)) / Decimal(str(item.quantidade))
+                valor_linha = (liquido * proporcao).quantize(CENTAVO)
+            resultado.valores.append(valor_linha)
+            # O total é a soma das linhas exibidas, centavo a centavo
+            valor += valor_linha
+
+        resultado.valor_devolvido = valor.quantize(CENTAVO)
+        if not resultado.itens:
+            resultado.itens.append(self.itens[linhas[0]])
+            resultado.quantidades.append(0.0)
+            resultado.valores.append(ZERO)
+            resultado.status = STATUS_JA_DEVOLVIDO
+        elif falta > 1e-9:
+            resultado.status = STATUS_PARCIAL
+        else:
+            resultado.status = STATUS_OK
+        return resultado
@@ -0,0 +1,259 @@
+"""Formatos de cupom reconhecidos pelo parser, cada um com sua gramática de linha.
+
+Cada formato compila suas próprias expressões e é escolhido uma única vez
+por cupom, pelo cabeçalho da tabela de itens nas primeiras linhas
+(``detectar_formato``), então nenhuma linha passa por mais de uma
+gramática. Sem cabeçalho reconhecido, vale o formato Muffato, o original.
+
+Para incluir um formato, derive de ``FormatoCupom`` (``cabecalho``,
+``tokenizar`` e, se houver, ``desconto``) e registre em ``FORMATOS``; a
+ordem do registro é a ordem da detecção.
+"""
+import re
+import logging
+from decimal import Decimal, InvalidOperation
+from itertools import chain
+from typing import Optional, List, Dict, Iterable, Iterator, Tuple
+
+from cupom_itens import CupomItem
+
+logger = logging.getLogger(__name__)
+
+# Linhas examinadas, no máximo, à procura do cabeçalho da tabela de itens
+LINHAS_DETECCAO = 60
+
+# Muffato: quatro colunas finais da linha de item (qtd, un, unitário,
+# total), já separadas por um único espaço
+_RE_CAUDA_ITEM = re.compile(
+    r'(\d+\.\d+|\d+\,\d+) (\w+)\.? (\d+\.\d+|\d+\,\d+) (\d+\.\d+|\d+\,\d+)'
+)
+# Resto da linha: número do item, código opcional e descrição
+_RE_CABECA_ITEM = re.compile(r'(\d+)\s+(\d{7,13})?\s*(.*)')
+_RE_DESCONTO = re.compile(r'Desconto\s+([\d,\.]+)')
+
+# Totais e rodapé do DANFE NFC-e que poderiam lembrar uma linha de item
+_RE_RODAPE_NFCE = re.compile(r'(?i)^(?:qtde\.?\s+total|valor\s+(?:total|a\s+pagar|pago)|total\b|desconto)')
+# Valor no padrão brasileiro, com separador de milhar opcional (1.234,56)
+_VALOR_BR = r'\d{1,3}(?:\.\d{3})*,\d+|\d+,\d+'
+
+
+def _tokenizar_item(line: str) -> Optional[tuple]:
+    """Separa uma linha de item Muffato (já sem espaços nas pontas) em suas colunas.
+
+    Equivale ao padrão ``^(\\d+)\\s+(\\d{7,13})?\\s*(.*?)\\s+qtd\\s+un\\.?\\s+unit\\s+total$``,
+    mas corta as quatro colunas finais da direita para a esquerda, sem
+    retrocesso na descrição. Retorna (item, código, descrição, qtd, un,
+    unitário, total) como texto, ou None se a linha não for um item.
+    """
+    partes = line.rsplit(None, 4)
+    if len(partes) != 5:
+        return None
+    cauda = _RE_CAUDA_ITEM.fullmatch(' '.join(partes[1:]))
+    if cauda is None:
+        return None
+    cabeca = _RE_CABECA_ITEM.fullmatch(partes[0])
+    if cabeca is not None:
+        return (cabeca.group(1), cabeca.group(2) or "", cabeca.group(3).strip()) + cauda.groups()
+
+    # Só o número do item: a regex original ainda casa (com descrição vazia)
+    # se houver ao menos dois espaços até a quantidade
+    item_num = partes[0]
+    separador = line[len(item_num):]
+    if item_num.isdecimal() and len(separador) - len(separador.lstrip()) >= 2:
+        return (item_num, "", "") + cauda.groups()
+    return None
+
+
+class FormatoCupom:
+    """Gramática de um layout de cupom; ``parse`` é comum a todos"""
+
+    nome = ""
+    descricao = ""
+    cabecalho: re.Pattern  # Cabeçalho da tabela de itens (detecção)
+    ignoradas: re.Pattern  # Linhas que nunca são itens
+    inicio_item = staticmethod(str.isdecimal)  # Teste barato do primeiro caractere de um item
+
+    def tokenizar(self, line: str) -> Optional[tuple]:
+        """(item, código, descrição, qtd, un, unitário, total) como texto, ou None.
+        Sem número de item impresso, ``item`` é None (usa a sequência)."""
+        raise NotImplementedError
+
+    def desconto(self, line: str, item: CupomItem) -> Optional[str]:
+        """Valor do desconto, se ``line`` for o desconto do item anterior"""
+        return None
+
+    @staticmethod
+    def numero(texto: str) -> str:
+        """Número impresso no formato aceito por Decimal/float"""
+        return texto.replace(',', '.')
+
+    def parse(self, linhas: Iterable[str], estatisticas: Optional[Dict] = None) -> List[CupomItem]:
+        """Reconhece os itens (e seus descontos) nas linhas do cupom"""
+        items = []
+        # Item aguardando a próxima linha, que pode ser o seu desconto
+        pendente = None
+        i = -1
+        sequencia = descontos = descartadas = ignoradas = rejeitadas = 0
+        inicio_item, ignorar = self.inicio_item, self.ignoradas.search
+        tokenizar, desconto, numero = self.tokenizar, self.desconto, self.numero
+
+        for i, line in enumerate(l for l in map(str.strip, linhas) if l):
+            if pendente is not None:
+                item, pendente = pendente, None
+                valor = desconto(line, item)
+                if valor is not None:
+                    try:
+                        item.desconto = Decimal(numero(valor))
+                        items.append(item)
+                        descontos += 1
+                        continue  # Pula a linha do desconto
+                    except InvalidOperation as e:
+                        # Item descartado; a linha segue como uma linha comum
+                        logger.warning("Erro processando linha %d: '%s' - %s", i, line, e)
+                        item = None
+                if item is not None:
+                    items.append(item)
+
+            # Linhas de item começam por um dígito (ou letra, em códigos
+            # internos): descarta o resto sem rodar nenhuma regex
+            if not inicio_item(line[0]):
+                descartadas += 1
+                continue
+
+            # Ignora cabeçalhos e linhas irrelevantes
+            if ignorar(line):
+                ignoradas += 1
+                continue
+
+            colunas = tokenizar(line)
+            if colunas is None:
+                rejeitadas += 1
+                continue
+
+            sequencia += 1
+            try:
+                item_num, codigo, descricao, qtd, un, vl_unit, vl_total = colunas
+                # Só entra na lista depois de verificar o desconto na próxima linha
+                pendente = CupomItem(
+                    int(item_num) if item_num is not None else sequencia,
+                    codigo,
+                    descricao,
+                    float(numero(qtd)),
+                    un,
+                    Decimal(numero(vl_unit)),
+                    Decimal(numero(vl_total)),
+                )
+            except Exception as e:
+                rejeitadas += 1
+                logger.warning("Erro processando linha %d: '%s' - %s", i + 1, line, e)
+
+        if pendente is not None:
+            items.append(pendente)
+        if estatisticas is not None:
+            estatisticas.update(linhas=i + 1, itens=len(items), descontos=descontos,
+                                descartadas=descartadas, ignoradas=ignoradas,
+                                rejeitadas=rejeitadas, formato=self.nome)
+        return items
+
+
+class FormatoMuffato(FormatoCupom):
+    """ITEM COD. DESC. QTD UN VL UNIT VL ITEM, com 'Seq.: N ... Desconto' após o item"""
+
+    nome = 'muffato'
+    descricao = "Muffato (formato original)"
+    cabecalho = re.compile(r'ITEM\b.*\bCOD\.')
+    ignoradas = re.compile(r'ITEM|COD\.|DESC\.|TOTAL|Documento|Protocolo')
+
+    tokenizar = staticmethod(_tokenizar_item)
+
+    def desconto(self, line: str, item: CupomItem) -> Optional[str]:
+        if "Desconto" in line and f"Seq.: {item.item}" in line:
+            m = _RE_DESCONTO.search(line)
+            if m:
+                return m.group(1)
+        return None
+
+
+class FormatoNFCeItem(FormatoCupom):
+    """DANFE NFC-e numerado: '001 CÓDIGO DESCRIÇÃO 2 UN X 7,62 15,24'.
+
+    O desconto do item vem na linha seguinte ('Desconto sobre item -0,50'
+    ou 'Desc. item 0,50').
+    """
+
+    nome = 'nfce_item'
+    descricao = "DANFE NFC-e com número do item e 'X' entre quantidade e unitário"
+    cabecalho = re.compile(r'(?i:\bITEM\s+C[OÓ]D(?:IGO|\.)?\s+DESCRI[CÇ][AÃ]O\b)')
+    ignoradas = _RE_RODAPE_NFCE
+    _linha = re.compile(
+        rf'(\d{{1,4}})\s+(\S+)\s+(.+?)\s+(\d+(?:,\d+)?)\s*([A-Za-z]{{1,6}})\.?\s+[xX]\s+'
+        rf'({_VALOR_BR})\s+({_VALOR_BR})'
+    )
+    _desconto = re.compile(rf'(?i:desconto\s+sobre\s+item|desc\.\s+item)\s+-?({_VALOR_BR})')
+
+    def tokenizar(self, line: str) -> Optional[tuple]:
+        # Itens terminam no valor total: evita a regex nas demais linhas
+        m = self._linha.fullmatch(line) if line[-1].isdecimal() else None
+        return m.groups() if m else None
+
+    def desconto(self, line: str, item: CupomItem) -> Optional[str]:
+        m = self._desconto.match(line)
+        return m.group(1) if m else None
+
+    @staticmethod
+    def numero(texto: str) -> str:
+        return texto.replace('.', '').replace(',', '.')
+
+
+class FormatoNFCe(FormatoCupom):
+    """DANFE NFC-e padrão, sem número do item: 'CÓDIGO DESCRIÇÃO QTDE UN VL UNIT VL TOTAL'.
+
+    O código pode ser interno (com letras); o número do item é a sequência.
+    """
+
+    nome = 'nfce'
+    descricao = "DANFE NFC-e padrão (Código, Descrição, Qtde, UN, Vl Unit, Vl Total)"
+    cabecalho = re.compile(r'(?i:\bC[OÓ]DIGO\s+DESCRI[CÇ][AÃ]O\s+QTDE?\b)')
+    ignoradas = _RE_RODAPE_NFCE
+    inicio_item = staticmethod(str.isalnum)
+    _linha = re.compile(
+        rf'(\S+)\s+(.+?)\s+(\d+(?:,\d+)?)\s+([A-Za-z]{{1,6}})\.?\s+({_VALOR_BR})\s+({_VALOR_BR})'
+    )
+
+    def tokenizar(self, line: str) -> Optional[tuple]:
+        m = self._linha.fullmatch(line) if line[-1].isdecimal() else None
+        return (None,) + m.groups() if m else None
+
+    @staticmethod
+    def numero(texto: str) -> str:
+        return texto.replace('.', '').replace(',', '.')
+
+
+FORMATO_PADRAO = 'muffato'
+# Ordem da detecção: o primeiro formato cujo cabeçalho aparecer é o escolhido
+FORMATOS: Dict[str, FormatoCupom] = {
+    f.nome: f for f in (FormatoMuffato(), FormatoNFCeItem(), FormatoNFCe())
+}
+# Qualquer cabeçalho de tabela conhecido (usado pelos motores posicionais)
+RE_CABECALHO = re.compile('|'.join(f.cabecalho.pattern for f in FORMATOS.values()))
+
+
+def detectar_formato(linhas: Iterable[str],
+                     limite: int = LINHAS_DETECCAO) -> Tuple[FormatoCupom, Iterator[str]]:
+    """Escolhe o formato pelo cabeçalho nas primeiras ``limite`` linhas.
+
+    Retorna o formato e um iterador com todas as linhas (as já lidas na
+    detecção e o restante), para o parse consumir de forma incremental.
+    """
+    linhas = iter(linhas)
+    lidas = []
+    escolhido = None
+    for line in linhas:
+        lidas.append(line)
+        for formato in FORMATOS.values():
+            if formato.cabecalho.search(line):
+                escolhido = formato
+                break
+        if escolhido is not None or len(lidas) >= limite:
+            break
+    return escolhido or FORMATOS[FORMATO_PADRAO], chain(lidas, linhas)
@@ -0,0 +1,178 @@
+"""Representação compacta dos itens de cupom.
+
+``CupomItem`` usa ``__slots__`` (sem ``__dict__`` por instância) e continua
+aceitando o acesso por chave (``item['descricao']``) do formato antigo em
+dicionário. Para conjuntos grandes (vários cupons de um mês), ``ItensColunares``
+guarda cada campo em uma coluna, com os números em ``array``.
+
+Valores monetários são exatos: ``Decimal`` nos itens (como impressos no
+cupom) e centavos inteiros nas colunas, onde as somas são feitas com NumPy
+quando disponível.
+"""
+import sys
+import functools
+from array import array
+from operator import attrgetter
+from decimal import Decimal, ROUND_HALF_UP
+from dataclasses import dataclass
+from typing import Optional, List, Dict, Iterable, Iterator
+
+CAMPOS = ('item', 'codigo', 'descricao', 'quantidade', 'unidade',
+          'valor_unitario', 'valor_total', 'desconto')
+CAMPOS_MONETARIOS = ('valor_unitario', 'valor_total', 'desconto')
+
+CENTAVO = Decimal('0.01')
+ZERO = Decimal('0.00')
+
+
+def para_centavos(valor: Decimal) -> int:
+    """Converte um valor em reais para centavos (arredonda meio para cima)"""
+    return int(valor.quantize(CENTAVO, rounding=ROUND_HALF_UP).scaleb(2))
+
+
+def de_centavos(centavos: int) -> Decimal:
+    return Decimal(centavos).scaleb(-2)
+
+
+@functools.lru_cache(maxsize=None)
+def _numpy():
+    """Importa o NumPy só quando necessário (None se não estiver instalado)"""
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+def somar_centavos(valores: array) -> int:
+    """Soma uma coluna de centavos (array 'q'); usa NumPy se instalado"""
+    np = _numpy()
+    if np is None or not len(valores):
+        return sum(valores)
+    return int(np.frombuffer(valores, dtype=np.int64).sum())
+
+
+def somar_por_grupo(totais: array, grupos: array, valores: array, sinal: int = 1):
+    """Soma cada ``valores[i]`` (vezes ``sinal``) em ``totais[grupos[i]]``.
+
+    ``totais`` e ``valores`` são arrays do mesmo tipo ('q' para centavos,
+    'd' para quantidades) e ``grupos`` um array 'q' de posições em ``totais``;
+    com NumPy, a coluna inteira é somada de uma vez (``numpy.add.at``).
+    """
+    np = _numpy()
+    if np is None or not len(valores):
+        for grupo, valor in zip(grupos, valores):
+            totais[grupo] += valor * sinal
+        return
+    tipo = np.int64 if totais.typecode == 'q' else np.float64
+    parcelas = np.frombuffer(valores, dtype=tipo)
+    np.add.at(np.frombuffer(totais, dtype=tipo), np.frombuffer(grupos, dtype=np.int64),
+              parcelas if sinal == 1 else parcelas * sinal)
+
+
+@dataclass(slots=True)
+class CupomItem:
+    item: int
+    codigo: str
+    descricao: str
+    quantidade: float
+    unidade: str
+    valor_unitario: Decimal
+    valor_total: Decimal
+    desconto: Decimal = ZERO
+
+    # Visão de dicionário, para o código que usa item['campo']
+    def __getitem__(self, chave: str):
+        if chave not in CAMPOS:
+            raise KeyError(chave)
+        return getattr(self, chave)
+
+    def __setitem__(self, chave: str, valor):
+        if chave not in CAMPOS:
+            raise KeyError(chave)
+        setattr(self, chave, valor)
+
+    def __contains__(self, chave) -> bool:
+        return chave in CAMPOS
+
+    def keys(self):
+        return CAMPOS
+
+    def get(self, chave: str, padrao=None):
+        return getattr(self, chave) if chave in CAMPOS else padrao
+
+    def to_dict(self) -> Dict:
+        return {campo: getattr(self, campo) for campo in CAMPOS}
+
+    @classmethod
+    def from_dict(cls, dados: Dict) -> 'CupomItem':
+        """Cria o item a partir de um dicionário (valores monetários podem vir como texto)"""
+        valores = {campo: dados[campo] for campo in CAMPOS}
+        for campo in CAMPOS_MONETARIOS:
+            valores[campo] = Decimal(str(valores[campo]))
+        return cls(**valores)
+
+    def copy(self) -> 'CupomItem':
+        return CupomItem(self.item, self.codigo, self.descricao, self.quantidade,
+                         self.unidade, self.valor_unitario, self.valor_total, self.desconto)
+
+
+class ItensColunares:
+    """Itens guardados por coluna: strings em listas, números em ``array``.
+
+    Ocupa uma fração da memória de uma lista de objetos e permite somar
+    colunas inteiras sem percorrer objetos Python. Valores monetários ficam
+    em centavos (int64).
+    """
+
+    def __init__(self, itens: Optional[Iterable[CupomItem]] = None):
+        self.item = array('l')
+        self.codigo: List[str] = []
+        self.descricao: List[str] = []
+        self.quantidade = array('d')
+        self.unidade: List[str] = []
+        self.valor_unitario: List[Decimal] = []
+        self.valor_total = array('q')
+        self.desconto = array('q')
+        if itens is not None:
+            self.extend(itens)
+
+    def append(self, item: CupomItem):
+        self.item.append(item.item)
+        # Códigos e unidades se repetem muito entre cupons
+        self.codigo.append(sys.intern(item.codigo))
+        self.descricao.append(item.descricao)
+        self.quantidade.append(item.quantidade)
+        self.unidade.append(sys.intern(item.unidade))
+        self.valor_unitario.append(item.valor_unitario)
+        self.valor_total.append(para_centavos(item.valor_total))
+        self.desconto.append(para_centavos(item.desconto))
+
+    def extend(self, itens: Iterable[CupomItem]):
+        """Acrescenta vários itens, uma coluna de cada vez"""
+        itens = itens if isinstance(itens, list) else list(itens)
+        self.item.extend(map(attrgetter('item'), itens))
+        self.codigo.extend(map(sys.intern, map(attrgetter('codigo'), itens)))
+        self.descricao.extend(map(attrgetter('descricao'), itens))
+        self.quantidade.extend(map(attrgetter('quantidade'), itens))
+        self.unidade.extend(map(sys.intern, map(attrgetter('unidade'), itens)))
+        self.valor_unitario.extend(map(attrgetter('valor_unitario'), itens))
+        self.valor_total.extend(map(para_centavos, map(attrgetter('valor_total'), itens)))
+        self.desconto.extend(map(para_centavos, map(attrgetter('desconto'), itens)))
+
+    def __len__(self) -> int:
+        return len(self.item)
+
+    def __getitem__(self, i: int) -> CupomItem:
+        return CupomItem(self.item[i], self.codigo[i], self.descricao[i], self.quantidade[i],
+                         self.unidade[i], self.valor_unitario[i], de_centavos(self.valor_total[i]),
+                         de_centavos(self.desconto[i]))
+
+    def __iter__(self) -> Iterator[CupomItem]:
+        return map(self.__getitem__, range(len(self)))
+
+    def total_geral(self) -> Decimal:
+        return de_centavos(somar_centavos(self.valor_total))
+
+    def total_descontos(self) -> Decimal:
+        return de_centavos(somar_centavos(self.desconto))
@@ -0,0 +1,365 @@
+"""Processamento em lote de cupons fiscais, sem interface gráfica.
+
+Aceita PDFs e XMLs de NFC-e (ou .zip de XMLs). Um PDF com um XML de mesmo
+nome ao lado é lido pelo XML, bem mais barato; se o XML falhar, pelo PDF.
+Com --dividir, um PDF com vários cupons mesclados gera um cupom para cada.
+Com --relatorio, grava também os totais por produto (ou --por produto,dia,loja).
+Com -P N (e -j 1, ou um só arquivo), cada PDF grande é extraído em N
+processos, por faixas de páginas.
+
+Uso: python cupom_lote.py PASTA_OU_PDFS... -o saida.csv [-j N]
+     [--metricas metricas.jsonl] [--perfil PASTA] [--motor pdfium,layout] [--ocr] [--dividir]
+     [--relatorio totais.csv] [--por produto,dia] [-P N]
+     python cupom_lote.py PASTA_OU_PDFS... --validar-motores [layout pdfium ...]
+"""
+import os
+import sys
+import csv
+import glob
+import time
+import logging
+import argparse
+import multiprocessing
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Optional, List, Dict
+
+from cupom_reader import CupomReader, CupomError, MOTORES
+from cupom_cache import CupomCache, CACHE_PADRAO
+from cupom_itens import para_centavos, de_centavos, somar_centavos
+from cupom_metricas import Metricas
+from cupom_store import CupomStore, ARMAZEM_PADRAO
+from cupom_ocr import LeitorOCR, ocr_disponivel
+from cupom_xml import processar_xml, arquivo_correspondente, EXTENSOES_XML
+from cupom_agregacao import Agregacao, DIMENSOES
+from cupom_paralelo import LeitorParalelo
+
+logger = logging.getLogger(__name__)
+
+# Um leitor (e uma conexão de cache) por processo de trabalho
+_readers: Dict[tuple, CupomReader] = {}
+
+
+def _reader_do_processo(agrupar: bool, cache_path: Optional[str], medir: bool = False,
+                        perfil: Optional[str] = None, motor: str = 'layout',
+                        ocr: bool = False, paginas: int = 0) -> CupomReader:
+    chave = (agrupar, cache_path, medir, perfil, motor, ocr, paginas)
+    reader = _readers.get(chave)
+    if reader is None:
+        # As métricas ficam em memória e voltam ao processo principal com o
+        # resultado, que grava tudo em um único arquivo
+        metricas = Metricas(origem='lote', perfil=perfil) if medir else None
+        cache = CupomCache(cache_path) if cache_path else None
+        # O lote já usa um processo por arquivo: o OCR roda página a página
+        # no próprio processo de trabalho
+        # Com ``paginas``, os PDFs grandes são extraídos por faixas em um
+        # pool do próprio processo de trabalho (só com um arquivo por vez)
+        reader = CupomReader(cache=cache, metricas=metricas, motor=motor,
+                             ocr=LeitorOCR(cache=cache, workers=1) if ocr else None,
+                             paralelo=LeitorParalelo(paginas) if paginas else None)
+        reader.set_agrupar_itens(agrupar)
+        _readers[chave] = reader
+    return reader
+
+
+def _processar_arquivo_lote(file_path: str, agrupar: bool, cache_path: Optional[str] = None,
+                            usar_cache: bool = True, medir: bool = False,
+                            perfil: Optional[str] = None, motor: str = 'layout',
+                            ocr: bool = False, dividir: bool = False, paginas: int = 0) -> Dict:
+    """Processa um PDF dentro do processo de trabalho"""
+    reader = None
+    try:
+        reader = _reader_do_processo(agrupar, cache_path, medir, perfil, motor, ocr, paginas)
+        resultado = _ler_cupom(reader, file_path, usar_cache, dividir)
+    except CupomError as e:
+        resultado = {'arquivo': file_path, 'erro': str(e)}
+    except Exception as e:
+        resultado = {'arquivo': file_path, 'erro': f"Falha inesperada: {e}"}
+    if reader is not None and reader.metricas is not None:
+        resultado['metricas'] = reader.metricas.drenar()
+    return resultado
+
+
+def _ler_cupom(reader: CupomReader, file_path: str, usar_cache: bool,
+               dividir: bool = False) -> Dict:
+    """Lê um PDF ou XML, preferindo o XML e caindo para o PDF de mesmo nome.
+
+    Um XML com várias notas (ou, com ``dividir``, um PDF com vários cupons)
+    retorna {'arquivo', 'cupons': [resultados]}.
+    """
+    if file_path.lower().endswith(EXTENSOES_XML):
+        xml, pdf = file_path, arquivo_correspondente(file_path, '.pdf')
+    else:
+        xml, pdf = arquivo_correspondente(file_path, '.xml'), file_path
+    if xml is not None:
+        try:
+            cupons = processar_xml(xml, reader)
+            return cupons[0] if len(cupons) == 1 else {'arquivo': xml, 'cupons': cupons}
+        except CupomError as e:
+            if pdf is None:
+                raise
+            logger.warning("%s: %s; usando o PDF", xml, e)
+    if dividir:
+        cupons = reader.process_cupons(pdf, usar_cache=usar_cache)
+        for cupom in cupons:
+            cupom['arquivo'] = pdf
+        return cupons[0] if len(cupons) == 1 else {'arquivo': pdf, 'cupons': cupons}
+    resultado = reader.process_cupom(pdf, usar_cache=usar_cache)
+    resultado['arquivo'] = pdf
+    return resultado
+
+
+def listar_pdfs(entradas: List[str], extensoes: tuple = ('.pdf',)) -> List[str]:
+    """Expande diretórios e padrões glob em uma lista ordenada de PDFs (ou ``extensoes``).
+
+    Um XML com um PDF de mesmo nome na lista só aparece como o PDF, que é
+    lido pelo XML (veja ``_ler_cupom``).
+    """
+    arquivos = []
+    for entrada in entradas:
+        if os.path.isdir(entrada):
+            encontrados = [
+                os.path.join(entrada, nome) for nome in os.listdir(entrada)
+                if nome.lower().endswith(extensoes)
+            ]
+        else:
+            encontrados = glob.glob(entrada)
+        arquivos.extend(sorted(encontrados))
+    # Remove duplicados mantendo a ordem
+    arquivos = list(dict.fromkeys(arquivos))
+    pdfs = {os.path.splitext(a)[0] for a in arquivos if a.lower().endswith('.pdf')}
+    return [a for a in arquivos
+            if not (a.lower().endswith('.xml') and os.path.splitext(a)[0] in pdfs)]
+
+
+def _gravar_cupom(writer, resultado: Dict):
+    """Acrescenta os itens de um cupom ao CSV combinado"""
+    for item in resultado['itens']:
+        writer.writerow([
+            resultado['arquivo'],
+            item['item'],
+            item['codigo'],
+            item['descricao'],
+            item['quantidade'],
+            item['unidade'],
+            item['valor_unitario'],
+            item['desconto'],
+            item['valor_total']
+        ])
+
+
+def processar_lote(arquivos: List[str], saida: str, workers: Optional[int] = None,
+                   agrupar: bool = True, cache_path: Optional[str] = None,
+                   usar_cache: bool = True, metricas: Optional[str] = None,
+                   perfil: Optional[str] = None, motor: str = 'layout',
+                   armazem: Optional[str] = None, ocr: bool = False, dividir: bool = False,
+                   relatorio: Optional[str] = None, por: tuple = ('produto',),
+                   paginas: int = 0) -> int:
+    """Processa vários cupons em paralelo e grava um único CSV combinado.
+
+    Retorna o número de arquivos com falha; falhas não interrompem o lote.
+    Sem ``cache_path`` nada é lido nem gravado no cache. ``metricas`` é um
+    arquivo JSON lines que recebe um registro por cupom e um resumo do lote;
+    ``perfil`` é uma pasta para os cProfile de cada cupom. ``motor`` escolhe
+    a extração (um de ``cupom_reader.MOTORES`` ou uma cadeia 'a,b').
+    Com ``armazem``, cada cupom lido é gravado no armazém de busca. Com
+    ``ocr``, PDFs sem itens no texto passam pelo OCR (``cupom_ocr``). Com
+    ``dividir``, PDFs mesclados são separados em um cupom por recibo.
+    ``relatorio`` é um CSV com os totais de todos os cupons agrupados ``por``
+    (dimensões de ``cupom_agregacao``), somados à medida que chegam.
+    Com ``paginas``, cada PDF grande é extraído em ``paginas`` processos, por
+    faixas de páginas (``cupom_paralelo``); só com ``workers=1`` ou um único
+    arquivo, para os dois níveis de processos não disputarem os núcleos.
+    """
+    saida_metricas = Metricas(metricas, origem='lote') if metricas else None
+    store = CupomStore(armazem) if armazem else None
+    agregacao = Agregacao(por) if relatorio else None
+    medir = saida_metricas is not None or perfil is not None
+    inicio = time.perf_counter()
+    falhas = 0
+    total = len(arquivos)
+    totais = array('q')  # Total de cada cupom, em centavos; somados de uma vez no fim
+    if paginas and workers != 1 and total > 1:
+        logger.warning("-P ignorado com vários arquivos em paralelo; use -j 1")
+        paginas = 0
+    chunksize = max(1, total // ((workers or os.cpu_count() or 1) * 4))
+
+    with open(saida, 'w', newline='', encoding='utf-8') as f, \
+            ProcessPoolExecutor(max_workers=workers) as executor:
+        writer = csv.writer(f, delimiter=';')
+        writer.writerow(['Arquivo', 'Item', 'Código', 'Descrição', 'Qtd', 'Un', 'V.Unit', 'Desconto', 'V.Total'])
+
+        resultados = executor.map(
+            _processar_arquivo_lote, arquivos, [agrupar] * total, [cache_path] * total,
+            [usar_cache] * total, [medir] * total, [perfil] * total, [motor] * total,
+            [ocr] * total, [dividir] * total, [paginas] * total, chunksize=chunksize
+        )
+        for n, resultado in enumerate(resultados, 1):
+            arquivo = resultado['arquivo']
+            if saida_metricas is not None:
+                for registro in resultado.get('metricas', ()):
+                    saida_metricas.emitir(registro)
+            if 'erro' in resultado:
+                falhas += 1
+                print(f"[{n}/{total}] ERRO {arquivo}: {resultado['erro']}", file=sys.stderr)
+                continue
+
+            # Um XML pode trazer várias notas; cada uma é um cupom
+            cupons = resultado.get('cupons') or [resultado]
+            primeiro = len(totais)
+            for cupom in cupons:
+                _gravar_cupom(writer, cupom)
+                if store is not None:
+                    store.gravar(cupom)
+                if agregacao is not None:
+                    agregacao.acumular(cupom)
+                totais.append(para_centavos(cupom['total_geral']))
+            centavos = somar_centavos(totais[primeiro:])
+            notas = f"{len(cupons)} cupons, " if len(cupons) > 1 else ""
+            print(f"[{n}/{total}] OK {arquivo}: {notas}{sum(c['total_itens'] for c in cupons)} itens, "
+                  f"R$ {de_centavos(centavos):.2f}")
+
+    segundos = time.perf_counter() - inicio
+    if store is not None:
+        store.close()
+    if agregacao is not None:
+        agregacao.gravar_csv(relatorio)
+        print(f"Relatório por {', '.join(por)}: {len(agregacao)} linhas, "
+              f"R$ {agregacao.total():.2f}, em {relatorio}")
+    print(f"Concluído: {total - falhas} processados, {falhas} com falha, "
+          f"total R$ {de_centavos(somar_centavos(totais)):.2f}. Saída: {saida}")
+    if saida_metricas is not None:
+        saida_metricas.emitir({
+            'evento': 'lote', 'arquivos': total, 'falhas': falhas,
+            'workers': workers or os.cpu_count(), 'segundos': round(segundos, 6),
+            'cupons_s': round(total / segundos, 3) if segundos else None,
+        })
+    return falhas
+
+
+def validar_motores(arquivos: List[str], motores: Optional[List[str]] = None) -> int:
+    """Compara os motores de extração em cada arquivo contra o primeiro da lista.
+
+    Imprime tempo e concordância por arquivo e, no final, o motor mais rápido
+    que reproduziu exatamente os itens da referência em todos os arquivos
+    que a referência conseguiu ler.
+    Retorna 0 se algum motor além da referência passou em todos.
+    """
+    motores = list(motores or MOTORES)
+    reader = CupomReader()
+    tempos = dict.fromkeys(motores, 0.0)
+    acertos = dict.fromkeys(motores, 0)
+    for arquivo in arquivos:
+        print(arquivo)
+        for r in reader.comparar_motores(arquivo, motores):
+            tempos[r['motor']] += r['segundos']
+            acertos[r['motor']] += r['igual']
+            situacao = r['erro'] or ("igual" if r['igual'] else "DIFERENTE")
+            print(f"  {r['motor']:<10} {r['segundos'] * 1000:>9.1f} ms {r['itens']:>6} itens  {situacao}")
+
+    # Arquivos em que a própria referência não achou itens não contam
+    base = acertos[motores[0]]
+    print(f"Resumo ({base} de {len(arquivos)} arquivos lidos pela referência, {motores[0]}):")
+    for motor in motores:
+        print(f"  {motor:<10} {tempos[motor]:>9.2f} s  {acertos[motor]}/{base} iguais")
+    validos = [m for m in motores[1:] if base and acertos[m] == base]
+    if not validos:
+        print(f"Nenhum motor reproduziu {motores[0]} em todos os arquivos.")
+        return 1
+    melhor = min(validos, key=tempos.get)
+    print(f"Mais rápido com o mesmo resultado: {melhor} (use --motor {melhor},{motores[0]})")
+    return 0
+
+
+def _motor_arg(valor: str) -> str:
+    """Valida --motor: um motor ou uma cadeia separada por vírgulas"""
+    for motor in valor.split(','):
+        if motor.strip() not in MOTORES:
+            raise argparse.ArgumentTypeError(
+                f"motor desconhecido: {motor} (use {', '.join(MOTORES)})")
+    return valor
+
+
+def _por_arg(valor: str) -> tuple:
+    """Valida --por: dimensões separadas por vírgulas"""
+    por = tuple(nome.strip() for nome in valor.split(',') if nome.strip())
+    for nome in por:
+        if nome not in DIMENSOES:
+            raise argparse.ArgumentTypeError(
+                f"dimensão desconhecida: {nome} (use {', '.join(DIMENSOES)})")
+    if not por:
+        raise argparse.ArgumentTypeError("informe ao menos uma dimensão")
+    return por
+
+
+def criar_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Processamento em lote de cupons Muffato")
+    parser.add_argument('entradas', nargs='+',
+                        help="Diretórios, arquivos PDF/XML (ou .zip de XMLs) ou padrões glob")
+    parser.add_argument('-o', '--saida', default=f"cupons_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+                        help="CSV combinado de saída")
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help="Número de processos (padrão: todos os núcleos)")
+    parser.add_argument('--sem-agrupar', action='store_true', help="Não agrupa itens iguais")
+    parser.add_argument('--cache', default=CACHE_PADRAO, help=f"Arquivo do cache (padrão: {CACHE_PADRAO})")
+    parser.add_argument('--sem-cache', action='store_true', help="Não usa nem grava o cache")
+    parser.add_argument('--reprocessar', action='store_true',
+                        help="Ignora o cache na leitura, mas atualiza com os novos resultados")
+    parser.add_argument('--limpar-cache', action='store_true', help="Esvazia o cache antes de processar")
+    parser.add_argument('--armazem', default=ARMAZEM_PADRAO,
+                        help=f"Armazém de busca dos cupons (padrão: {ARMAZEM_PADRAO})")
+    parser.add_argument('--sem-armazem', action='store_true', help="Não grava os cupons no armazém")
+    parser.add_argument('--metricas', help="Anexa métricas por etapa (JSON lines) a este arquivo")
+    parser.add_argument('--perfil', help="Pasta para salvar um cProfile (.prof) de cada cupom")
+    parser.add_argument('--motor', type=_motor_arg, default='layout',
+                        help=f"Motor de extração ({', '.join(MOTORES)}) ou cadeia de fallback, "
+                             f"ex.: pdfium,layout (padrão: layout)")
+    parser.add_argument('--validar-motores', nargs='*', choices=list(MOTORES), metavar='MOTOR',
+                        help="Só compara os motores nos arquivos (o primeiro é a referência; "
+                             "padrão: todos) e indica o mais rápido com o mesmo resultado")
+    parser.add_argument('--ocr', action='store_true',
+                        help="OCR (Tesseract) dos PDFs sem itens no texto, ex.: digitalizados")
+    parser.add_argument('--dividir', action='store_true',
+                        help="Separa PDFs com vários cupons mesclados (um cupom por recibo)")
+    parser.add_argument('--relatorio', help="CSV com os totais de todos os cupons (veja --por)")
+    parser.add_argument('--por', type=_por_arg, default=('produto',),
+                        help=f"Agrupamento do relatório: {', '.join(DIMENSOES)} ou combinações, "
+                             f"ex.: produto,dia (padrão: produto)")
+    parser.add_argument('-P', '--paginas-paralelas', type=int, default=0, metavar='N',
+                        help="Extrai cada PDF grande em N processos, por faixas de páginas "
+                             "(com -j 1 ou um só arquivo)")
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = criar_parser().parse_args(argv)
+
+    arquivos = listar_pdfs(args.entradas, ('.pdf',) + EXTENSOES_XML)
+    if not arquivos:
+        print("Nenhum PDF ou XML encontrado nas entradas informadas.", file=sys.stderr)
+        return 2
+
+    if args.validar_motores is not None:
+        return validar_motores([a for a in arquivos if a.lower().endswith('.pdf')], args.validar_motores)
+
+    if args.ocr and not ocr_disponivel():
+        print("OCR indisponível: instale pytesseract, pypdfium2 e o Tesseract.", file=sys.stderr)
+        return 2
+
+    cache_path = None if args.sem_cache else args.cache
+    if cache_path and args.limpar_cache:
+        cache = CupomCache(cache_path)
+        cache.invalidar()
+        cache.close()
+
+    falhas = processar_lote(arquivos, args.saida, args.workers, not args.sem_agrupar,
+                            cache_path, not args.reprocessar, args.metricas, args.perfil, args.motor,
+                            None if args.sem_armazem else args.armazem, args.ocr, args.dividir,
+                            args.relatorio, args.por, args.paginas_paralelas)
+    return 1 if falhas else 0
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
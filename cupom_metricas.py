@@ -0,0 +1,119 @@
+"""Métricas por etapa do processamento de cupons, em JSON lines.
+
+Cada cupom processado gera um registro como:
+
+    {"evento": "cupom", "arquivo": "...", "status": "ok", "cache": "miss",
+     "segundos": 1.93, "etapas": {"extracao": {"segundos": 1.9, "paginas": 2,
+     "linhas": 80}, "parse": {"segundos": 0.001, "linhas": 80, "itens": 60,
+     "descontos": 9, "rejeitadas": 2}, "agrupamento": {...}}}
+
+O lote e a interface gravam no mesmo formato. Sem destino, os registros
+ficam em memória até ``drenar`` (usado nos processos de trabalho, que
+devolvem as métricas ao processo principal junto com o resultado).
+"""
+import os
+import sys
+import json
+import time
+import cProfile
+import threading
+from contextlib import contextmanager
+from typing import Optional, List, Dict, Iterator
+
+
+class Metricas:
+    def __init__(self, destino: Optional[str] = None, origem: str = "", perfil: Optional[str] = None):
+        """``destino``: arquivo .jsonl (anexado) ou '-' para stderr.
+        ``perfil``: pasta onde salvar um cProfile (.prof) de cada cupom."""
+        self.destino = destino
+        self.origem = origem
+        self.perfil = perfil
+        self._pendentes: List[Dict] = []
+        self._lock = threading.Lock()
+        if perfil:
+            os.makedirs(perfil, exist_ok=True)
+
+    def emitir(self, registro: Dict):
+        """Grava um registro (acrescenta data/hora, pid e origem)"""
+        registro.setdefault('ts', round(time.time(), 3))
+        registro.setdefault('pid', os.getpid())
+        if self.origem:
+            registro.setdefault('origem', self.origem)
+        with self._lock:
+            if self.destino is None:
+                self._pendentes.append(registro)
+                return
+            linha = json.dumps(registro, ensure_ascii=False, default=str) + "\n"
+            if self.destino == '-':
+                sys.stderr.write(linha)
+            else:
+                with open(self.destino, 'a', encoding='utf-8') as f:
+                    f.write(linha)
+
+    def drenar(self) -> List[Dict]:
+        """Retorna e esvazia os registros guardados em memória"""
+        with self._lock:
+            pendentes, self._pendentes = self._pendentes, []
+        return pendentes
+
+    @contextmanager
+    def cupom(self, arquivo: str) -> Iterator[Dict]:
+        """Mede o processamento de um cupom e emite o registro ao final.
+
+        O dicionário entregue recebe as etapas (``registro['etapas']``) e
+        campos extras; exceções marcam ``status`` como erro e são repassadas.
+        """
+        registro = {'evento': 'cupom', 'arquivo': arquivo, 'etapas': {}}
+        perfil = cProfile.Profile() if self.perfil else None
+        inicio = time.perf_counter()
+        if perfil:
+            perfil.enable()
+        try:
+            yield registro
+            registro['status'] = 'ok'
+        except Exception as e:
+            registro['status'] = 'erro'
+            registro['erro'] = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            if perfil:
+                perfil.disable()
+                nome = f"{os.path.basename(arquivo)}.{os.getpid()}.{int(time.time() * 1000)}.prof"
+                registro['perfil'] = os.path.join(self.perfil, nome)
+                perfil.dump_stats(registro['perfil'])
+            registro['segundos'] = round(time.perf_counter() - inicio, 6)
+            self.emitir(registro)
+
+
+@contextmanager
+def medir_etapa(registro: Optional[Dict], nome: str) -> Iterator[Dict]:
+    """Mede o tempo de uma etapa; o dicionário entregue recebe contadores.
+
+    Sem ``registro`` (métricas desativadas) a medição é descartada.
+    """
+    dados: Dict = {}
+    inicio = time.perf_counter()
+    try:
+        yield dados
+    finally:
+        dados['segundos'] = round(time.perf_counter() - inicio, 6)
+        if registro is not None:
+            registro['etapas'][nome] = dados
+
+
+class Cronometro:
+    """Acumula o tempo gasto dentro de um gerador (ex.: extração página a página)"""
+
+    def __init__(self, gerador: Iterator):
+        self._gerador = gerador
+        self.segundos = 0.0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        inicio = time.perf_counter()
+        try:
+            return next(self._gerador)
+        finally:
+            self.segundos += time.perf_counter() - inicio
@@ -0,0 +1,372 @@
+"""Monitoramento de pasta: processa cada cupom PDF assim que ele aparece.
+
+Uso: python cupom_monitor.py PASTA [-o cupons.csv] [-j N] [--intervalo 2]
+     [--recursivo] [--uma-vez] [--motor pdfium,layout] [--metricas m.jsonl] [--ocr]
+     [--relatorio totais.csv --por produto,dia]
+
+A pasta é varrida a cada ``intervalo`` segundos. Arquivos novos ou
+alterados entram em uma fila e são processados em paralelo (no máximo
+``workers`` de cada vez, como no lote). Um registro persistente (SQLite)
+guarda caminho, tamanho, data de modificação e hash de cada arquivo já
+processado, então reiniciar o monitor não reprocessa o que já foi lido, e
+o mesmo cupom copiado com outro nome é reconhecido pelo hash.
+"""
+import os
+import sys
+import csv
+import time
+import sqlite3
+import logging
+import argparse
+import threading
+import multiprocessing
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from typing import Optional, List, Dict, Tuple, Callable
+
+from cupom_cache import CACHE_PADRAO, hash_arquivo
+from cupom_itens import para_centavos, de_centavos, somar_centavos
+from cupom_lote import _processar_arquivo_lote, _motor_arg, _por_arg
+from cupom_metricas import Metricas
+from cupom_store import CupomStore, ARMAZEM_PADRAO
+from cupom_ocr import ocr_disponivel
+from cupom_agregacao import RelatorioIncremental, DIMENSOES
+
+logger = logging.getLogger(__name__)
+
+REGISTRO_PADRAO = os.path.join(os.path.dirname(CACHE_PADRAO), 'monitor.sqlite3')
+
+STATUS_OK = 'ok'
+STATUS_ERRO = 'erro'
+STATUS_DUPLICADO = 'duplicado'
+
+# (tamanho, mtime em ns) identifica uma versão do arquivo sem lê-lo
+Assinatura = Tuple[int, int]
+
+
+class RegistroArquivos:
+    """Registro persistente dos arquivos já processados (caminho, tamanho, mtime, hash)"""
+
+    def __init__(self, caminho: str = REGISTRO_PADRAO):
+        self.caminho = caminho
+        pasta = os.path.dirname(caminho)
+        if pasta:
+            os.makedirs(pasta, exist_ok=True)
+        self._conn = sqlite3.connect(caminho, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS arquivos_processados (
+                caminho TEXT PRIMARY KEY,
+                tamanho INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                hash TEXT,
+                status TEXT NOT NULL,
+                erro TEXT,
+                total_itens INTEGER,
+                total_geral TEXT,
+                processado_em REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_arquivos_processados_hash ON arquivos_processados (hash);
+        """)
+        self._conn.commit()
+
+    def assinaturas(self) -> Dict[str, Assinatura]:
+        """Assinatura registrada de cada arquivo (carregada de uma vez na partida)"""
+        return {
+            caminho: (tamanho, mtime_ns)
+            for caminho, tamanho, mtime_ns in self._conn.execute(
+                "SELECT caminho, tamanho, mtime_ns FROM arquivos_processados")
+        }
+
+    def hash_processado(self, hash_pdf: str, exceto: str) -> Optional[str]:
+        """Outro arquivo já processado com o mesmo conteúdo, se houver"""
+        row = self._conn.execute(
+            "SELECT caminho FROM arquivos_processados WHERE hash = ? AND status = ? AND caminho != ?",
+            (hash_pdf, STATUS_OK, exceto)
+        ).fetchone()
+        return row[0] if row else None
+
+    def registrar(self, caminho: str, assinatura: Assinatura, hash_pdf: Optional[str], status: str,
+                  erro: Optional[str] = None, total_itens: Optional[int] = None,
+                  total_geral=None):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO arquivos_processados VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (caminho, assinatura[0], assinatura[1], hash_pdf, status, erro, total_itens,
+             None if total_geral is None else str(total_geral), time.time())
+        )
+        self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+
+
+def _processar_arquivo_monitor(file_path: str, agrupar: bool, cache_path: Optional[str],
+                               medir: bool, motor: str, ocr: bool = False) -> Dict:
+    """Calcula o hash e processa o PDF dentro do processo de trabalho"""
+    try:
+        hash_pdf = hash_arquivo(file_path)
+    except OSError as e:
+        return {'arquivo': file_path, 'erro': f"Falha ao ler PDF: {e}"}
+    resultado = _processar_arquivo_lote(file_path, agrupar, cache_path, True, medir, None, motor, ocr)
+    resultado['hash'] = hash_pdf
+    return resultado
+
+
+class MonitorPasta:
+    def __init__(self, pasta: str, registro: RegistroArquivos, saida: Optional[str] = None,
+                 workers: Optional[int] = None, intervalo: float = 2.0, agrupar: bool = True,
+                 cache_path: Optional[str] = CACHE_PADRAO, motor: str = 'layout',
+                 metricas: Optional[str] = None, recursivo: bool = False,
+                 ao_processar: Optional[Callable[[Dict], None]] = None, ocr: bool = False):
+        """``saida``: CSV ao qual cada cupom processado é acrescentado.
+        ``ao_processar(resultado)`` é chamado no processo principal para cada
+        cupom lido com sucesso (ex.: para indexar o resultado). Com ``ocr``,
+        PDFs sem itens no texto passam pelo OCR."""
+        self.pasta = os.path.abspath(pasta)
+        self.registro = registro
+        self.saida = saida
+        self.workers = workers or os.cpu_count() or 1
+        self.intervalo = intervalo
+        self.agrupar = agrupar
+        self.cache_path = cache_path
+        self.motor = motor
+        self.metricas = Metricas(metricas, origem='monitor') if metricas else None
+        self.recursivo = recursivo
+        self.ao_processar = ao_processar
+        self.ocr = ocr
+
+        self._registrados = registro.assinaturas()
+        # Visto na última varredura mas ainda possivelmente em cópia
+        self._em_observacao: Dict[str, Assinatura] = {}
+        self._fila: deque = deque()
+        self._na_fila: Dict[str, Assinatura] = {}  # Na fila ou em processamento
+
+    def _listar_pdfs(self, pasta: str):
+        """(caminho, stat) de cada PDF da pasta, sem um stat extra por arquivo no Windows"""
+        try:
+            with os.scandir(pasta) as entradas:
+                for entrada in entradas:
+                    try:
+                        if entrada.is_dir(follow_symlinks=False):
+                            if self.recursivo:
+                                yield from self._listar_pdfs(entrada.path)
+                        elif entrada.name.lower().endswith('.pdf'):
+                            yield entrada.path, entrada.stat()
+                    except OSError:
+                        continue  # Removido durante a varredura
+        except OSError as e:
+            logger.warning("Falha ao varrer %s: %s", pasta, e)
+
+    def varrer(self) -> int:
+        """Enfileira os PDFs novos ou alterados; retorna quantos entraram na fila.
+
+        Um arquivo só entra quando sua assinatura se repete em duas
+        varreduras seguidas (ou quando já está parado há um intervalo), para
+        não ler um PDF que ainda está sendo copiado para a pasta.
+        """
+        agora = time.time()
+        em_observacao = {}
+        novos = 0
+        for caminho, st in self._listar_pdfs(self.pasta):
+            assinatura = (st.st_size, st.st_mtime_ns)
+            if self._registrados.get(caminho) == assinatura or self._na_fila.get(caminho) == assinatura:
+                continue
+            parado = agora - st.st_mtime >= self.intervalo
+            if parado or self._em_observacao.get(caminho) == assinatura:
+                self._fila.append((caminho, assinatura))
+                self._na_fila[caminho] = assinatura
+                novos += 1
+            else:
+                em_observacao[caminho] = assinatura
+        self._em_observacao = em_observacao
+        return novos
+
+    def executar(self, parar: Optional[threading.Event] = None, uma_vez: bool = False) -> int:
+        """Varre e processa até ``parar`` ser acionado (ou Ctrl+C).
+
+        Com ``uma_vez``, processa o que já estiver na pasta e retorna.
+        Retorna o número de arquivos com falha.
+        """
+        parar = parar or threading.Event()
+        falhas = 0
+        em_andamento = {}
+        proxima_varredura = 0.0
+        medir = self.metricas is not None
+
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            try:
+                while True:
+                    if time.monotonic() >= proxima_varredura and not parar.is_set():
+                        novos = self.varrer()
+                        if novos:
+                            logger.info("%d arquivo(s) novo(s) na fila", novos)
+                        proxima_varredura = time.monotonic() + self.intervalo
+
+                    # No máximo dois arquivos por processo em andamento; o
+                    # resto espera na fila (memória limitada)
+                    while self._fila and len(em_andamento) < self.workers * 2 and not parar.is_set():
+                        caminho, assinatura = self._fila.popleft()
+                        futuro = executor.submit(_processar_arquivo_monitor, caminho, self.agrupar,
+                                                 self.cache_path, medir, self.motor, self.ocr)
+                        em_andamento[futuro] = (caminho, assinatura)
+
+                    if not em_andamento:
+                        if parar.is_set() or (uma_vez and not self._fila and not self._em_observacao):
+                            break
+                        parar.wait(max(0.0, proxima_varredura - time.monotonic()))
+                        continue
+
+                    prontos, _ = wait(em_andamento, timeout=max(0.05, proxima_varredura - time.monotonic()),
+                                      return_when=FIRST_COMPLETED)
+                    for futuro in prontos:
+                        caminho, assinatura = em_andamento.pop(futuro)
+                        self._na_fila.pop(caminho, None)
+                        falhas += not self._concluir(caminho, assinatura, futuro.result())
+            except KeyboardInterrupt:
+                logger.info("Interrompido; aguardando os arquivos em andamento")
+                for futuro in list(em_andamento):
+                    futuro.cancel()
+        return falhas
+
+    def _concluir(self, caminho: str, assinatura: Assinatura, resultado: Dict) -> bool:
+        """Registra o resultado de um arquivo; retorna False em caso de falha"""
+        if self.metricas is not None:
+            for registro in resultado.get('metricas', ()):
+                self.metricas.emitir(registro)
+        hash_pdf = resultado.get('hash')
+
+        if 'erro' in resultado:
+            # Fica registrado com a assinatura atual: só é tentado de novo se mudar
+            logger.error("ERRO %s: %s", caminho, resultado['erro'])
+            self.registro.registrar(caminho, assinatura, hash_pdf, STATUS_ERRO, resultado['erro'])
+            self._registrados[caminho] = assinatura
+            return False
+
+        original = self.registro.hash_processado(hash_pdf, caminho) if hash_pdf else None
+        if original:
+            logger.info("Ignorado %s: mesmo conteúdo de %s", caminho, original)
+            self.registro.registrar(caminho, assinatura, hash_pdf, STATUS_DUPLICADO)
+            self._registrados[caminho] = assinatura
+            return True
+
+        # Um PDF com um XML de várias notas ao lado traz um resultado por nota
+        cupons = resultado.get('cupons') or [resultado]
+        total_itens = 0
+        totais = array('q')  # Centavos de cada cupom
+        for cupom in cupons:
+            if self.saida:
+                self._gravar_csv(cupom)
+            if self.ao_processar:
+                self.ao_processar(cupom)
+            total_itens += cupom['total_itens']
+            totais.append(para_centavos(cupom['total_geral']))
+        total_geral = de_centavos(somar_centavos(totais))
+        self.registro.registrar(caminho, assinatura, hash_pdf, STATUS_OK,
+                                total_itens=total_itens, total_geral=total_geral)
+        self._registrados[caminho] = assinatura
+        notas = f"{len(cupons)} cupons, " if len(cupons) > 1 else ""
+        logger.info("OK %s: %s%d itens, R$ %.2f", caminho, notas, total_itens, total_geral)
+        return True
+
+    def _gravar_csv(self, resultado: Dict):
+        """Acrescenta os itens ao CSV de saída (cabeçalho só no arquivo novo)"""
+        novo = not os.path.exists(self.saida) or os.path.getsize(self.saida) == 0
+        with open(self.saida, 'a', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f, delimiter=';')
+            if novo:
+                writer.writerow(['Arquivo', 'Item', 'Código', 'Descrição', 'Qtd', 'Un', 'V.Unit', 'Desconto', 'V.Total'])
+            for item in resultado['itens']:
+                writer.writerow([
+                    resultado['arquivo'],
+                    item['item'],
+                    item['codigo'],
+                    item['descricao'],
+                    item['quantidade'],
+                    item['unidade'],
+                    item['valor_unitario'],
+                    item['desconto'],
+                    item['valor_total']
+                ])
+
+
+def criar_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Monitora uma pasta e processa os cupons que chegarem")
+    parser.add_argument('pasta', help="Pasta onde os PDFs são depositados")
+    parser.add_argument('-o', '--saida', help="CSV ao qual os itens de cada cupom são acrescentados")
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help="Número de processos (padrão: todos os núcleos)")
+    parser.add_argument('--intervalo', type=float, default=2.0, help="Segundos entre varreduras (padrão: 2)")
+    parser.add_argument('--recursivo', action='store_true', help="Inclui as subpastas")
+    parser.add_argument('--uma-vez', action='store_true',
+                        help="Processa o que estiver na pasta e termina")
+    parser.add_argument('--registro', default=REGISTRO_PADRAO,
+                        help=f"Registro dos arquivos processados (padrão: {REGISTRO_PADRAO})")
+    parser.add_argument('--sem-agrupar', action='store_true', help="Não agrupa itens iguais")
+    parser.add_argument('--cache', default=CACHE_PADRAO, help=f"Arquivo do cache (padrão: {CACHE_PADRAO})")
+    parser.add_argument('--sem-cache', action='store_true', help="Não usa nem grava o cache")
+    parser.add_argument('--motor', type=_motor_arg, default='layout',
+                        help="Motor de extração ou cadeia de fallback (veja cupom_lote.py)")
+    parser.add_argument('--armazem', default=ARMAZEM_PADRAO,
+                        help=f"Armazém de busca dos cupons (padrão: {ARMAZEM_PADRAO})")
+    parser.add_argument('--sem-armazem', action='store_true', help="Não grava os cupons no armazém")
+    parser.add_argument('--metricas', help="Anexa métricas por etapa (JSON lines) a este arquivo")
+    parser.add_argument('--ocr', action='store_true',
+                        help="OCR (Tesseract) dos PDFs sem itens no texto, ex.: digitalizados")
+    parser.add_argument('--relatorio',
+                        help="CSV com os totais dos cupons, regravado a cada minuto e ao sair (veja --por)")
+    parser.add_argument('--por', type=_por_arg, default=('produto',),
+                        help=f"Agrupamento do relatório: {', '.join(DIMENSOES)} ou combinações, "
+                             f"ex.: produto,dia (padrão: produto)")
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = criar_parser().parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    if not os.path.isdir(args.pasta):
+        print(f"Pasta não encontrada: {args.pasta}", file=sys.stderr)
+        return 2
+    if args.ocr and not ocr_disponivel():
+        print("OCR indisponível: instale pytesseract, pypdfium2 e o Tesseract.", file=sys.stderr)
+        return 2
+
+    relatorio = None
+    if args.relatorio:
+        try:
+            relatorio = RelatorioIncremental(args.relatorio, args.por)
+        except (OSError, ValueError, sqlite3.Error) as e:
+            print(f"Relatório: {e}", file=sys.stderr)
+            return 2
+
+    registro = RegistroArquivos(args.registro)
+    # Cada cupom fica disponível para busca (e no relatório) assim que é processado
+    store = None if args.sem_armazem else CupomStore(args.armazem)
+
+    def ao_processar(resultado: Dict):
+        if store is not None:
+            store.gravar(resultado)
+        if relatorio is not None:
+            relatorio.acumular(resultado)
+
+    monitor = MonitorPasta(
+        args.pasta, registro, args.saida, args.workers, args.intervalo, not args.sem_agrupar,
+        None if args.sem_cache else args.cache, args.motor, args.metricas, args.recursivo,
+        ao_processar if store or relatorio else None, args.ocr
+    )
+    logger.info("Monitorando %s (Ctrl+C para sair)", os.path.abspath(args.pasta))
+    try:
+        falhas = monitor.executar(uma_vez=args.uma_vez)
+    finally:
+        registro.close()
+        if store is not None:
+            store.close()
+        if relatorio is not None:
+            relatorio.close()
+    return 1 if falhas and args.uma_vez else 0
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -0,0 +1,153 @@
+"""OCR de cupons sem texto selecionável (PDF só com imagem, ex.: digitalizado).
+
+Só entra em ação quando a extração de texto não reconhece nenhum item
+(``CupomReader(ocr=LeitorOCR(...))``): as páginas são renderizadas pelo
+pypdfium2 e reconhecidas pelo Tesseract (pytesseract), em paralelo por
+página, e as linhas seguem para o mesmo ``parse_items``. O texto
+reconhecido é guardado no cache pelo hash do PDF, então o OCR de um
+arquivo só roda uma vez. Os pacotes são opcionais e importados só quando
+o OCR é usado.
+"""
+import shutil
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, List, Iterator
+
+from cupom_reader import PDFReadError, Progresso, _percorrer_paginas
+
+OCR_VERSION = "1"
+DPI_PADRAO = 300
+IDIOMA_PADRAO = 'por'
+# Bloco único de texto (mantém a ordem das linhas do cupom) e os vãos
+# entre colunas, que o parse usa para separar item e descrição
+CONFIG_TESSERACT = '--psm 6 -c preserve_interword_spaces=1'
+
+
+def _importar():
+    """Importa pypdfium2 e pytesseract; levanta PDFReadError se faltarem"""
+    try:
+        import pypdfium2
+        import pytesseract
+    except ImportError as e:
+        raise PDFReadError(f"OCR indisponível: {e.name} não está instalado") from e
+    return pypdfium2, pytesseract
+
+
+def ocr_disponivel() -> bool:
+    """Indica se os pacotes e o executável do Tesseract estão presentes"""
+    try:
+        _, pytesseract = _importar()
+    except PDFReadError:
+        return False
+    return shutil.which(pytesseract.pytesseract.tesseract_cmd) is not None
+
+
+def _ocr_pagina(file_path: str, indice: int, dpi: int, idioma: str) -> str:
+    """Renderiza e reconhece uma página (executa no processo de trabalho)"""
+    pypdfium2, pytesseract = _importar()
+    try:
+        pdf = pypdfium2.PdfDocument(file_path)
+        try:
+            page = pdf[indice]
+            imagem = page.render(scale=dpi / 72, grayscale=True).to_pil()
+            page.close()
+        finally:
+            pdf.close()
+    except Exception as e:
+        raise PDFReadError(f"Falha ao renderizar a página {indice + 1}: {e}") from e
+    try:
+        return pytesseract.image_to_string(imagem, lang=idioma, config=CONFIG_TESSERACT)
+    except pytesseract.TesseractNotFoundError as e:
+        raise PDFReadError("OCR indisponível: executável do Tesseract não encontrado") from e
+    except pytesseract.TesseractError as e:
+        raise PDFReadError(f"Falha no OCR: {e}") from e
+
+
+class LeitorOCR:
+    def __init__(self, cache=None, workers: Optional[int] = None,
+                 dpi: int = DPI_PADRAO, idioma: str = IDIOMA_PADRAO):
+        """``cache``: CupomCache opcional para o texto reconhecido.
+        ``workers``: processos de OCR (padrão: todos os núcleos; 1 reconhece
+        no próprio processo, como nos processos de trabalho do lote)."""
+        self.cache = cache
+        self.workers = workers
+        self.dpi = dpi
+        self.idioma = idioma
+        self._executor: Optional[ProcessPoolExecutor] = None
+        # Trabalhos da interface em threads diferentes compartilham o leitor
+        self._lock = threading.Lock()
+
+    @property
+    def versao_cache(self) -> str:
+        """O texto depende só do OCR, não do parser: mudanças no parser não refazem o OCR"""
+        return f"ocr-{OCR_VERSION}-{self.idioma}-{self.dpi}"
+
+    def iter_lines(self, file_path: str, progresso: Optional[Progresso] = None,
+                   cancelar=None) -> Iterator[str]:
+        """Gera as linhas reconhecidas (do cache, se o PDF já passou pelo OCR)"""
+        hash_pdf = None
+        if self.cache is not None:
+            from cupom_cache import hash_arquivo
+            try:
+                hash_pdf = hash_arquivo(file_path)
+            except OSError as e:
+                raise PDFReadError(f"Falha ao ler PDF: {e}") from e
+            cached = self.cache.obter(hash_pdf, self.versao_cache)
+            if cached is not None:
+                yield from cached['texto'].split('\n')
+                return
+
+        texto = '\n'.join(self._reconhecer(file_path, progresso, cancelar))
+        if hash_pdf is not None:
+            self.cache.gravar(hash_pdf, self.versao_cache, texto, [])
+        yield from texto.split('\n')
+
+    def _reconhecer(self, file_path: str, progresso: Optional[Progresso],
+                    cancelar) -> List[str]:
+        """OCR de todas as páginas, em paralelo, com as linhas na ordem das páginas"""
+        pypdfium2, _ = _importar()
+        try:
+            pdf = pypdfium2.PdfDocument(file_path)
+        except Exception as e:
+            raise PDFReadError(f"Falha ao ler PDF: {e}") from e
+        total = len(pdf)
+        pdf.close()
+
+        if self.workers == 1 or total == 1:
+            paginas = (_ocr_pagina(file_path, n, self.dpi, self.idioma)
+                       for n in _percorrer_paginas(total, progresso, cancelar))
+        else:
+            futuras = [self._pool().submit(_ocr_pagina, file_path, n, self.dpi, self.idioma)
+                       for n in range(total)]
+            paginas = self._em_ordem(futuras, progresso, cancelar)
+
+        linhas = []
+        for texto in paginas:
+            linhas += [linha.rstrip() for linha in texto.splitlines() if linha.strip()]
+        return linhas
+
+    @staticmethod
+    def _em_ordem(futuras: list, progresso: Optional[Progresso], cancelar) -> Iterator[str]:
+        """Resultados na ordem das páginas; cancela as pendentes se interrompido"""
+        try:
+            for n in _percorrer_paginas(len(futuras), progresso, cancelar):
+                yield futuras[n].result()
+        finally:
+            for futura in futuras:
+                futura.cancel()
+
+    def _pool(self) -> ProcessPoolExecutor:
+        # Criado no primeiro OCR: PDFs com texto nunca iniciam processos
+        with self._lock:
+            if self._executor is None:
+                # 'spawn' também no POSIX: o OCR roda na thread de trabalho da
+                # interface e um fork copiaria o processo com as outras threads
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+        return self._executor
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
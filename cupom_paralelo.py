@@ -0,0 +1,122 @@
+"""Extração paralela de um PDF grande, por faixas de páginas.
+
+Um documento grande (nota mensal de atacado, ou um PDF com centenas de
+cupons mesclados) é dividido em faixas de páginas contíguas; cada processo
+abre o arquivo e extrai só a sua faixa (``cupom_reader.linhas_das_paginas``)
+e as faixas são juntadas na ordem das páginas antes do parse. Assim o
+desconto 'Seq.: N' no topo de uma página continua ligado ao item do fim da
+anterior, e o recorte da tabela dos motores posicionais vê o documento
+inteiro, como na leitura serial. PDFs pequenos são lidos no próprio
+processo, sem iniciar o pool.
+
+Uso: ``CupomReader(paralelo=LeitorParalelo())``; com ``process_cupons`` um
+PDF mesclado também é separado em um resultado por cupom.
+"""
+import os
+import threading
+import multiprocessing
+from multiprocessing.util import Finalize
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, List, Iterator
+
+from cupom_reader import (MOTORES, PDFReadError, ProcessingCancelled, Progresso,
+                          linhas_das_paginas, juntar_paginas)
+
+# Abaixo disso a leitura é serial: abrir o PDF em cada processo custaria
+# mais que o ganho
+PAGINAS_MINIMAS = 16
+# Faixas por processo: faixas menores equilibram melhor a carga, mas cada
+# uma abre o PDF de novo
+FAIXAS_POR_PROCESSO = 2
+
+
+def contar_paginas(file_path: str) -> int:
+    """Número de páginas do PDF (pelo pypdfium2, se instalado, que não lê as páginas)"""
+    try:
+        try:
+            import pypdfium2
+        except ImportError:
+            import pdfplumber
+            with pdfplumber.open(file_path) as pdf:
+                return len(pdf.pages)
+        pdf = pypdfium2.PdfDocument(file_path)
+        try:
+            return len(pdf)
+        finally:
+            pdf.close()
+    except ImportError as e:
+        raise PDFReadError("pdfplumber não está instalado") from e
+    except Exception as e:
+        raise PDFReadError(f"Falha ao ler PDF: {e}") from e
+
+
+def dividir_faixas(total: int, faixas: int) -> List[range]:
+    """Até ``faixas`` faixas contíguas de tamanhos próximos cobrindo as ``total`` páginas"""
+    faixas = max(1, min(faixas, total))
+    tamanho, sobra = divmod(total, faixas)
+    resultado = []
+    inicio = 0
+    for n in range(faixas):
+        fim = inicio + tamanho + (n < sobra)
+        resultado.append(range(inicio, fim))
+        inicio = fim
+    return resultado
+
+
+class LeitorParalelo:
+    def __init__(self, workers: Optional[int] = None, paginas_minimas: int = PAGINAS_MINIMAS):
+        """``workers``: processos de extração (padrão: todos os núcleos).
+        ``paginas_minimas``: PDFs com menos páginas são lidos no próprio processo."""
+        self.workers = workers or os.cpu_count() or 1
+        self.paginas_minimas = paginas_minimas
+        self._executor: Optional[ProcessPoolExecutor] = None
+        # Trabalhos da interface em threads diferentes compartilham o leitor
+        self._lock = threading.Lock()
+
+    def iter_lines(self, file_path: str, motor: str = 'layout', progresso: Optional[Progresso] = None,
+                   cancelar=None) -> Iterator[str]:
+        """Gera as mesmas linhas de ``MOTORES[motor]``, com as faixas lidas em paralelo"""
+        total = contar_paginas(file_path)
+        if self.workers == 1 or total < self.paginas_minimas:
+            yield from MOTORES[motor](file_path, progresso, cancelar)
+            return
+        faixas = dividir_faixas(total, self.workers * FAIXAS_POR_PROCESSO)
+        futuras = [self._pool().submit(linhas_das_paginas, file_path, motor, faixa) for faixa in faixas]
+        yield from juntar_paginas(motor, self._em_ordem(futuras, faixas, total, progresso, cancelar))
+
+    @staticmethod
+    def _em_ordem(futuras: list, faixas: List[range], total: int, progresso: Optional[Progresso],
+                  cancelar) -> Iterator[List[str]]:
+        """Linhas de cada página, na ordem; cancela as faixas pendentes se interrompido"""
+        try:
+            if progresso:
+                progresso(0, total)
+            for faixa, futura in zip(faixas, futuras):
+                if cancelar is not None and cancelar.is_set():
+                    raise ProcessingCancelled("Processamento cancelado")
+                yield from futura.result()
+                if progresso:
+                    progresso(faixa.stop, total)
+        finally:
+            for futura in futuras:
+                futura.cancel()
+
+    def _pool(self) -> ProcessPoolExecutor:
+        # Criado no primeiro PDF grande: os pequenos nunca iniciam processos
+        with self._lock:
+            if self._executor is None:
+                # 'spawn' também no POSIX: o pool pode nascer numa thread de
+                # trabalho (interface, servidor) e um fork copiaria o processo
+                # com as outras threads (e os locks delas) paradas no meio
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+                # Dentro de um processo de trabalho (lote, servidor), encerra o
+                # pool antes de o processo esperar os filhos ao sair, e antes de
+                # as filas do pool (prioridade 10) fecharem
+                Finalize(self, self._executor.shutdown, exitpriority=20)
+        return self._executor
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
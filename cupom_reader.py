@@ -0,0 +1,711 @@
+"""Motor de leitura de cupons fiscais, sem dependência de interface gráfica.
+
+Erros são sinalizados por exceções (``CupomError`` e derivadas); o pdfplumber
+só é importado na primeira extração.
+"""
+import re
+import time
+import logging
+from itertools import chain, cycle
+from contextlib import nullcontext
+from datetime import datetime
+from operator import itemgetter
+from typing import Optional, List, Dict, Iterable, Iterator, Union, Callable
+
+from cupom_itens import CupomItem, ItensColunares
+from cupom_metricas import medir_etapa, Cronometro
+from cupom_formatos import FORMATOS, RE_CABECALHO, detectar_formato
+from cupom_agregacao import agrupar_itens
+
+logger = logging.getLogger(__name__)
+
+# Recebe (páginas lidas, total de páginas)
+Progresso = Callable[[int, int], None]
+
+# Limites da tabela de itens, usados pelos motores posicionais (o início é
+# o cabeçalho de qualquer formato de ``cupom_formatos``)
+_RE_INICIO_TABELA = RE_CABECALHO
+_RE_FIM_TABELA = re.compile(r'Qtde\. total de itens|Valor a pagar', re.IGNORECASE)
+# Data e hora de emissão, de preferência na linha da NFC-e / série
+_RE_DATA_HORA = re.compile(r'(\d{2})/(\d{2})/(\d{4})\s+(\d{2}):(\d{2})(?::(\d{2}))?')
+_RE_LINHA_EMISSAO = re.compile(r'Emiss|NFC-?e|S[ée]rie', re.IGNORECASE)
+# Chave de acesso da NFC-e: 44 dígitos, em geral impressos em grupos de quatro
+_RE_CHAVE = re.compile(r'(?<![0-9])[0-9]{4}(?: ?[0-9]{4}){10}(?![0-9])')
+# Limites de cada cupom em um PDF mesclado: o DANFE (ou a tabela de itens)
+# abre o cupom e o protocolo de autorização, no rodapé, o encerra
+_RE_INICIO_CUPOM = re.compile(r'Documento\s+Auxiliar|' + RE_CABECALHO.pattern)
+_RE_FIM_CUPOM = re.compile(r'Protocolo\s+de\s+autoriza', re.IGNORECASE)
+
+# Incrementar sempre que a extração ou o parser mudarem de comportamento;
+# entradas de cache de versões anteriores deixam de ser usadas.
+PARSER_VERSION = "4"
+
+
+class CupomError(Exception):
+    """Erro base do leitor de cupons"""
+
+
+class PDFReadError(CupomError):
+    """Falha ao abrir ou extrair texto do PDF"""
+
+
+class NoItemsError(CupomError):
+    """Nenhum item reconhecido no texto extraído"""
+
+    def __init__(self, message: str, texto: str = ""):
+        super().__init__(message)
+        self.texto = texto
+
+
+class ProcessingCancelled(CupomError):
+    """Processamento interrompido a pedido (evento de cancelamento)"""
+
+
+def _paginas_layout(file_path: str, progresso: Optional[Progresso] = None,
+                    cancelar=None, paginas: Optional[range] = None) -> Iterator[List[str]]:
+    """Linhas não vazias de cada página (ou só das ``paginas``) pelo modo layout do pdfplumber"""
+    try:
+        import pdfplumber
+    except ImportError as e:
+        raise PDFReadError("pdfplumber não está instalado") from e
+
+    try:
+        with pdfplumber.open(file_path) as pdf:
+            for n in _percorrer_paginas(len(pdf.pages), progresso, cancelar, paginas):
+                page = pdf.pages[n]
+                text = page.extract_text(
+                    layout=True,
+                    x_tolerance=5,  # Aumentado para melhor captura
+                    y_tolerance=3,
+                    keep_blank_chars=False,
+                )
+                if hasattr(page, 'close'):
+                    page.close()  # Descarta o cache de objetos da página
+                yield [line for line in map(str.strip, (text or "").split('\n')) if line]
+    except CupomError:
+        raise
+    except Exception as e:
+        raise PDFReadError(f"Falha ao ler PDF: {e}") from e
+
+
+def _iter_linhas_pdf(file_path: str, progresso: Optional[Progresso] = None,
+                     cancelar=None) -> Iterator[str]:
+    """Gera as linhas não vazias do PDF, uma página por vez.
+
+    Cada página é liberada antes da próxima ser lida, então a memória fica
+    limitada ao tamanho de uma página (erros sobem como ``PDFReadError``).
+    ``progresso`` é chamado a cada página; se ``cancelar`` (ex.:
+    ``threading.Event``) for acionado, levanta ``ProcessingCancelled``
+    antes da próxima página.
+    """
+    return chain.from_iterable(_paginas_layout(file_path, progresso, cancelar))
+
+
+def extrair_emissao(linhas: Iterable[str]) -> Optional[datetime]:
+    """Data/hora de emissão do cupom (a da linha da NFC-e, senão a primeira data)"""
+    primeira = None
+    for line in linhas:
+        for m in _RE_DATA_HORA.finditer(line):
+            dia, mes, ano, hora, minuto, segundo = m.groups()
+            try:
+                data = datetime(int(ano), int(mes), int(dia), int(hora), int(minuto), int(segundo or 0))
+            except ValueError:
+                continue
+            if _RE_LINHA_EMISSAO.search(line):
+                return data
+            if primeira is None:
+                primeira = data
+    return primeira
+
+
+def chave_valida(chave: str) -> bool:
+    """Confere os 44 dígitos e o dígito verificador (módulo 11) da chave de acesso"""
+    if len(chave) != 44 or not (chave.isascii() and chave.isdigit()):
+        return False
+    soma = sum(int(d) * peso for d, peso in zip(reversed(chave[:43]), cycle(range(2, 10))))
+    dv = 11 - soma % 11
+    return int(chave[43]) == (0 if dv >= 10 else dv)
+
+
+def extrair_chave(linhas: Iterable[str]) -> Optional[str]:
+    """Chave de acesso da NFC-e impressa no cupom (a primeira com dígito verificador válido)"""
+    for line in linhas:
+        for m in _RE_CHAVE.finditer(line):
+            chave = m.group().replace(' ', '')
+            if chave_valida(chave):
+                return chave
+    return None
+
+
+def _linha_de_rodape(line: str) -> bool:
+    """Linha que pode ter a data de emissão ou a chave de acesso"""
+    return '/' in line or _RE_CHAVE.search(line) is not None
+
+
+def dividir_cupons(linhas: Iterable[str]) -> Iterator[List[str]]:
+    """Separa as linhas de um PDF com vários cupons mesclados, um bloco por cupom.
+
+    Um cupom termina na linha do protocolo de autorização ('Protocolo de
+    autorização') ou, sem ela, onde o próximo DANFE ('Documento Auxiliar')
+    ou cabeçalho de tabela começa depois do fim da tabela ou da chave de
+    acesso. Um PDF com um só cupom gera um único bloco.
+    """
+    atual: List[str] = []
+    tabela = fim = False
+    for line in linhas:
+        if fim and _RE_INICIO_CUPOM.search(line):
+            yield atual
+            atual, tabela, fim = [], False, False
+        atual.append(line)
+        if _RE_INICIO_TABELA.search(line):
+            tabela = True
+        elif tabela and _RE_FIM_CUPOM.search(line):
+            yield atual
+            atual, tabela, fim = [], False, False
+        elif tabela and not fim:
+            fim = _RE_FIM_TABELA.search(line) is not None or _RE_CHAVE.search(line) is not None
+    if atual:
+        yield atual
+
+
+def _percorrer_paginas(total: int, progresso: Optional[Progresso] = None,
+                       cancelar=None, paginas: Optional[range] = None) -> Iterator[int]:
+    """Gera os índices das páginas (todas ou as de ``paginas``), reportando
+    progresso e atendendo ao cancelamento"""
+    indices = range(total) if paginas is None else range(max(paginas.start, 0), min(paginas.stop, total))
+    if progresso:
+        progresso(0, len(indices))
+    for lidas, n in enumerate(indices, 1):
+        if cancelar is not None and cancelar.is_set():
+            raise ProcessingCancelled("Processamento cancelado")
+        yield n
+        if progresso:
+            progresso(lidas, len(indices))
+
+
+def _caracteres_pdfplumber(file_path: str, progresso: Optional[Progresso] = None,
+                           cancelar=None, paginas: Optional[range] = None) -> Iterator[List[tuple]]:
+    """(topo, x0, x1, texto) dos caracteres de cada página, lidos do layout do pdfminer.
+
+    Evita ``page.chars``, que monta um dicionário com todos os atributos
+    (fonte, cores, matriz...) de cada caractere: é ali que o pdfplumber
+    gasta a maior parte do tempo, e só a posição e o texto importam aqui.
+    """
+    try:
+        import pdfplumber
+        from pdfminer.layout import LTChar, LTContainer  # Dependência do pdfplumber
+    except ImportError as e:
+        raise PDFReadError("pdfplumber não está instalado") from e
+
+    with pdfplumber.open(file_path) as pdf:
+        for n in _percorrer_paginas(len(pdf.pages), progresso, cancelar, paginas):
+            page = pdf.pages[n]
+            layout = page.layout
+            altura = layout.height
+            caracteres = []
+            pendentes = list(layout)
+            while pendentes:
+                obj = pendentes.pop()
+                if isinstance(obj, LTChar):
+                    caracteres.append((altura - obj.y1, obj.x0, obj.x1, obj.get_text()))
+                elif isinstance(obj, LTContainer):  # LTFigure e afins
+                    pendentes.extend(obj)
+            if hasattr(page, 'close'):
+                page.close()
+            yield caracteres
+
+
+def _caracteres_pdfium(file_path: str, progresso: Optional[Progresso] = None,
+                       cancelar=None, paginas: Optional[range] = None) -> Iterator[List[tuple]]:
+    """Caracteres de cada página pelo pypdfium2 (PDFium, em C)"""
+    try:
+        import pypdfium2
+    except ImportError as e:
+        raise PDFReadError("pypdfium2 não está instalado") from e
+
+    pdf = pypdfium2.PdfDocument(file_path)
+    try:
+        for n in _percorrer_paginas(len(pdf), progresso, cancelar, paginas):
+            page = pdf[n]
+            textpage = page.get_textpage()
+            try:
+                altura = page.get_height()
+                texto = textpage.get_text_range()
+                caracteres = []
+                for i, c in enumerate(texto):
+                    if not c.isspace():
+                        # Caixa "loose": largura do avanço do caractere, não da tinta
+                        x0, _, x1, topo = textpage.get_charbox(i, loose=True)
+                        caracteres.append((altura - topo, x0, x1, c))
+            finally:
+                textpage.close()
+                page.close()
+            yield caracteres
+    finally:
+        pdf.close()
+
+
+def _caracteres_mupdf(file_path: str, progresso: Optional[Progresso] = None,
+                      cancelar=None, paginas: Optional[range] = None) -> Iterator[List[tuple]]:
+    """Caracteres de cada página pelo PyMuPDF (MuPDF, em C)"""
+    try:
+        import pymupdf
+    except ImportError:
+        try:
+            import fitz as pymupdf  # Nome antigo do pacote
+        except ImportError as e:
+            raise PDFReadError("PyMuPDF não está instalado") from e
+
+    # Os erros chegam como exceções; sem repeti-los no stderr
+    pymupdf.TOOLS.mupdf_display_errors(False)
+    with pymupdf.open(file_path) as doc:
+        if doc.is_repaired:
+            # O MuPDF reconstrói PDFs danificados (ex.: truncados) e leria só
+            # parte dos itens; os outros motores recusam o arquivo
+            raise PDFReadError("PDF danificado (o MuPDF precisou reconstruí-lo)")
+        for n in _percorrer_paginas(len(doc), progresso, cancelar, paginas):
+            caracteres = []
+            for bloco in doc[n].get_text("rawdict")["blocks"]:
+                for linha in bloco.get("lines", ()):
+                    for span in linha["spans"]:
+                        for c in span["chars"]:
+                            x0, topo, x1, _ = c["bbox"]
+                            caracteres.append((topo, x0, x1, c["c"]))
+            yield caracteres
+
+
+def _linhas_da_pagina(caracteres: Iterable[tuple], y_tolerance: float = 3) -> List[str]:
+    """Monta as linhas de uma página a partir de (topo, x0, x1, texto).
+
+    Agrupa por posição vertical e ordena por x; um vão de até ~1,5 caractere
+    vira um espaço e vãos maiores (colunas) viram dois, o que basta para o
+    parse (as gramáticas de ``cupom_formatos`` só distinguem um espaço de vários).
+    """
+    linhas = []
+    atual: List[tuple] = []
+    topo = None
+    for c in sorted(caracteres):
+        if topo is None or c[0] - topo > y_tolerance:
+            if atual:
+                linhas.append(atual)
+            atual = []
+            topo = c[0]
+        atual.append(c)
+    if atual:
+        linhas.append(atual)
+
+    resultado = []
+    for linha in linhas:
+        partes = []
+        fim = None  # x1 do último caractere visível
+        largura = 0.0
+        for _, x0, x1, texto in sorted(linha, key=itemgetter(1)):
+            if texto.isspace():
+                continue
+            if fim is not None:
+                vao = x0 - fim
+                if vao > largura * 1.5:
+                    partes.append('  ')
+                elif vao > largura * 0.3:
+                    partes.append(' ')
+            partes.append(texto)
+            fim = x1
+            largura = x1 - x0
+        if partes:
+            resultado.append(''.join(partes))
+    return resultado
+
+
+def _iter_linhas_tabela(paginas: Iterator[List[str]]) -> Iterator[str]:
+    """Repassa só a tabela de itens das linhas de cada página.
+
+    Antes do cabeçalho (ex.: 'ITEM ... COD.') e depois de 'Qtde. total de
+    itens' / 'Valor a pagar' (até o próximo cabeçalho, em PDFs com vários
+    cupons), só passam as linhas com a data de emissão ('/') ou a chave. O
+    próprio cabeçalho é repassado, para a detecção do formato. Se o documento
+    não tiver cabeçalho reconhecível, todas as linhas são repassadas, página
+    a página.
+    """
+    try:
+        na_tabela = False
+        tabela_vista = False
+        for linhas_pagina in paginas:
+            fora_da_tabela = []
+            for line in linhas_pagina:
+                if _RE_INICIO_TABELA.search(line):
+                    if not tabela_vista:
+                        yield from filter(_linha_de_rodape, fora_da_tabela)
+                        fora_da_tabela.clear()
+                    na_tabela = tabela_vista = True
+                    yield line
+                elif na_tabela and _RE_FIM_TABELA.search(line):
+                    na_tabela = False
+                elif na_tabela:
+                    yield line
+                elif not tabela_vista:
+                    fora_da_tabela.append(line)
+                elif _linha_de_rodape(line):
+                    yield line
+            # Sem cabeçalho até aqui: layout desconhecido, repassa tudo
+            if not tabela_vista:
+                yield from fora_da_tabela
+    except CupomError:
+        raise
+    except Exception as e:
+        raise PDFReadError(f"Falha ao ler PDF: {e}") from e
+
+
+def _iter_linhas_palavras(file_path: str, progresso: Optional[Progresso] = None,
+                          cancelar=None) -> Iterator[str]:
+    """Linhas da tabela de itens montadas dos caracteres do pdfplumber (sem o modo layout)"""
+    return _iter_linhas_tabela(map(_linhas_da_pagina, _caracteres_pdfplumber(file_path, progresso, cancelar)))
+
+
+def _iter_linhas_pdfium(file_path: str, progresso: Optional[Progresso] = None,
+                        cancelar=None) -> Iterator[str]:
+    """Linhas da tabela de itens montadas dos caracteres do PDFium"""
+    return _iter_linhas_tabela(map(_linhas_da_pagina, _caracteres_pdfium(file_path, progresso, cancelar)))
+
+
+def _iter_linhas_mupdf(file_path: str, progresso: Optional[Progresso] = None,
+                       cancelar=None) -> Iterator[str]:
+    """Linhas da tabela de itens montadas dos caracteres do MuPDF"""
+    return _iter_linhas_tabela(map(_linhas_da_pagina, _caracteres_mupdf(file_path, progresso, cancelar)))
+
+
+# Motores de extração: nome -> função (arquivo, progresso, cancelar) que gera
+# as linhas do PDF. 'layout' (extract_text com layout) é o padrão; os demais
+# montam as linhas das posições dos caracteres e só repassam a tabela de
+# itens. pypdfium2 e PyMuPDF são opcionais, importados só quando usados.
+MOTORES: Dict[str, Callable[..., Iterator[str]]] = {
+    'layout': _iter_linhas_pdf,
+    'palavras': _iter_linhas_palavras,
+    'pdfium': _iter_linhas_pdfium,
+    'mupdf': _iter_linhas_mupdf,
+}
+# Motores posicionais: caracteres de cada página
+_CARACTERES = {
+    'palavras': _caracteres_pdfplumber,
+    'pdfium': _caracteres_pdfium,
+    'mupdf': _caracteres_mupdf,
+}
+
+
+def linhas_das_paginas(file_path: str, motor: str, paginas: range) -> List[List[str]]:
+    """Linhas de cada página de ``paginas`` com o motor, ainda sem o recorte da tabela.
+
+    Faixas diferentes podem ser lidas em processos diferentes;
+    ``juntar_paginas`` refaz, na ordem, as linhas que o motor geraria.
+    """
+    try:
+        if motor in _CARACTERES:
+            return [_linhas_da_pagina(c) for c in _CARACTERES[motor](file_path, paginas=paginas)]
+        return list(_paginas_layout(file_path, paginas=paginas))
+    except CupomError:
+        raise
+    except Exception as e:
+        raise PDFReadError(f"Falha ao ler PDF: {e}") from e
+
+
+def juntar_paginas(motor: str, paginas: Iterable[List[str]]) -> Iterator[str]:
+    """Linhas do documento a partir das linhas de cada página, como em ``MOTORES[motor]``"""
+    if motor in _CARACTERES:
+        # O recorte da tabela depende das páginas anteriores: só no documento inteiro
+        return _iter_linhas_tabela(iter(paginas))
+    return chain.from_iterable(paginas)
+
+
+class CupomReader:
+    def __init__(self, cache=None, metricas=None, motor: Union[str, Iterable[str]] = 'layout',
+                 ocr=None, formato: Optional[str] = None, paralelo=None):
+        self.agrupar_itens = True
+        self.cache = cache  # CupomCache opcional
+        self.metricas = metricas  # Metricas opcional (um registro por cupom)
+        self.ocr = ocr  # LeitorOCR opcional, último recurso se nenhum motor achar itens
+        self.paralelo = paralelo  # LeitorParalelo opcional: PDFs grandes lidos em faixas de páginas
+        self.set_motor(motor)
+        self.set_formato(formato)
+
+    def set_agrupar_itens(self, valor: bool):
+        self.agrupar_itens = valor
+
+    def set_motor(self, motor: Union[str, Iterable[str]]):
+        """Escolhe o motor de extração (de ``MOTORES``) ou uma cadeia deles.
+
+        Uma cadeia ('pdfium,layout' ou uma lista) é tentada em ordem por
+        ``process_cupom``: se um motor falhar ou não reconhecer nenhum item,
+        o seguinte é usado. ``iter_lines`` usa sempre o primeiro.
+        """
+        motores = motor.split(',') if isinstance(motor, str) else list(motor)
+        motores = [m.strip() for m in motores if m.strip()]
+        if not motores:
+            raise ValueError("Nenhum motor de extração informado")
+        for m in motores:
+            if m not in MOTORES:
+                raise ValueError(f"Motor de extração desconhecido: {m} (use {', '.join(MOTORES)})")
+        self.motores = motores
+        self.motor = motores[0]
+
+    def set_formato(self, formato: Optional[str]):
+        """Fixa o formato do cupom (de ``cupom_formatos.FORMATOS``); None detecta pelo cabeçalho"""
+        if formato is not None and formato not in FORMATOS:
+            raise ValueError(f"Formato de cupom desconhecido: {formato} (use {', '.join(FORMATOS)})")
+        self.formato = formato
+
+    def extract_text_with_layout(self, file_path: str) -> str:
+        """Extrai texto do PDF mantendo estrutura"""
+        return '\n'.join(self.iter_lines(file_path))
+
+    def iter_lines(self, file_path: str, progresso: Optional[Progresso] = None,
+                   cancelar=None, motor: Optional[str] = None) -> Iterator[str]:
+        """Gera as linhas do PDF página a página (sem montar o texto todo)"""
+        if motor == 'ocr' and self.ocr is not None:
+            return self.ocr.iter_lines(file_path, progresso, cancelar)
+        if self.paralelo is not None:
+            return self.paralelo.iter_lines(file_path, motor or self.motor, progresso, cancelar)
+        return MOTORES[motor or self.motor](file_path, progresso, cancelar)
+
+    @property
+    def versao_cache(self) -> str:
+        """Versão gravada no cache; cada motor (ou cadeia) e formato fixo tem suas próprias entradas"""
+        versao = PARSER_VERSION
+        if self.motores != ['layout']:
+            versao += f"-{'+'.join(self.motores)}"
+        if self.formato is not None:
+            versao += f"@{self.formato}"
+        return versao
+
+    def comparar_motores(self, file_path: str, motores: Optional[Iterable[str]] = None) -> List[Dict]:
+        """Extrai e processa o PDF com cada motor e compara com o primeiro.
+
+        Retorna, por motor, {'motor', 'segundos', 'itens', 'igual', 'erro'};
+        ``igual`` indica se os itens coincidem exatamente com os do primeiro
+        motor da lista (por padrão 'layout', a referência).
+        """
+        resultados = []
+        referencia = None
+        for motor in motores or MOTORES:
+            if motor not in MOTORES:
+                raise ValueError(f"Motor de extração desconhecido: {motor} (use {', '.join(MOTORES)})")
+            inicio = time.perf_counter()
+            try:
+                itens = [i.to_dict() for i in self.parse_items(self.iter_lines(file_path, motor=motor))]
+                erro = None
+            except CupomError as e:
+                itens, erro = [], str(e)
+            segundos = time.perf_counter() - inicio
+            if referencia is None:
+                referencia = itens
+            resultados.append({
+                'motor': motor,
+                'segundos': segundos,
+                'itens': len(itens),
+                'igual': erro is None and bool(itens) and itens == referencia,
+                'erro': erro,
+            })
+        return resultados
+
+    def parse_items(self, text: Union[str, Iterable[str]],
+                    estatisticas: Optional[Dict] = None) -> List[CupomItem]:
+        """Processa os itens com a gramática do formato do cupom.
+
+        O formato é o fixado em ``set_formato`` ou o detectado pelo cabeçalho
+        nas primeiras linhas (``cupom_formatos``). Aceita o texto completo ou
+        qualquer iterável de linhas (por exemplo, ``iter_lines``), consumido
+        de forma incremental. Se ``estatisticas`` for informado, recebe as
+        contagens de linhas (total, itens, descontos, descartadas, ignoradas
+        e rejeitadas) e o nome do formato.
+        """
+        if isinstance(text, str):
+            text = text.split('\n')
+        if self.formato is None:
+            formato, text = detectar_formato(text)
+        else:
+            formato = FORMATOS[self.formato]
+        return formato.parse(text, estatisticas)
+
+    def _agrupar_itens_repetidos(self, items: List[CupomItem]) -> List[CupomItem]:
+        """Agrupa itens idênticos"""
+        return agrupar_itens(items)
+
+    def _montar_resultado(self, items: List[CupomItem], registro: Optional[Dict] = None,
+                          emissao: Optional[datetime] = None, chave: Optional[str] = None) -> Dict:
+        """Agrupa (se configurado) e calcula os totais do cupom"""
+        with medir_etapa(registro, 'agrupamento') as etapa:
+            etapa['itens'] = len(items)
+            if self.agrupar_itens:
+                items = self._agrupar_itens_repetidos(items)
+            etapa['agrupados'] = len(items)
+            # Totais em centavos inteiros, somados coluna a coluna
+            colunas = ItensColunares(items)
+
+            return {
+                'total_itens': len(items),
+                'total_geral': colunas.total_geral(),
+                'total_descontos': colunas.total_descontos(),
+                'emissao': emissao,
+                'chave': chave,
+                'itens': items
+            }
+
+    def process_cupom(self, file_path: str, usar_cache: bool = True,
+                      progresso: Optional[Progresso] = None, cancelar=None) -> Dict:
+        """Processa o cupom fiscal completo.
+
+        Levanta ``PDFReadError`` se o PDF não puder ser lido e
+        ``NoItemsError`` se nenhum item for reconhecido. Com ``usar_cache``
+        falso o cache é ignorado na leitura, mas atualizado com o resultado.
+        ``progresso`` e ``cancelar`` são repassados a ``iter_lines``. Com
+        ``metricas`` configurado, emite o tempo e as contagens de cada etapa.
+        Com ``ocr`` configurado, um PDF sem itens no texto passa pelo OCR.
+        """
+        return self._processar_com_metricas(file_path, usar_cache, progresso, cancelar, False)[0]
+
+    def process_cupons(self, file_path: str, usar_cache: bool = True,
+                       progresso: Optional[Progresso] = None, cancelar=None) -> List[Dict]:
+        """Processa um PDF com vários cupons mesclados: um resultado por cupom.
+
+        Os cupons são separados pelo cabeçalho e pelo rodapé de cada um
+        (``dividir_cupons``); blocos sem itens são descartados. Um PDF com um
+        só cupom retorna uma lista com o mesmo resultado de ``process_cupom``.
+        """
+        return self._processar_com_metricas(file_path, usar_cache, progresso, cancelar, True)
+
+    def _processar_com_metricas(self, file_path: str, usar_cache: bool, progresso: Optional[Progresso],
+                                cancelar, dividir: bool) -> List[Dict]:
+        if self.metricas is not None:
+            contexto = self.metricas.cupom(file_path)
+        else:
+            contexto = nullcontext({'etapas': {}})
+        with contexto as registro:
+            return self._processar(file_path, usar_cache, progresso, cancelar, registro, dividir)
+
+    def _processar(self, file_path: str, usar_cache: bool, progresso: Optional[Progresso],
+                   cancelar, registro: Dict, dividir: bool = False) -> List[Dict]:
+        with medir_etapa(registro, 'hash'):
+            hash_pdf = self._hash_para_cache(file_path)
+        registro['cache'] = 'desativado' if hash_pdf is None else 'miss'
+        # Divididos, os itens são gravados por cupom, com as linhas do rodapé
+        versao = self.versao_cache + ('/cupons' if dividir else '')
+        if hash_pdf and usar_cache:
+            with medir_etapa(registro, 'cache'):
+                cached = self.cache.obter(hash_pdf, versao)
+            if cached is not None:
+                registro['cache'] = 'hit'
+                if dividir:
+                    cupons = [([CupomItem.from_dict(i) for i in c['itens']], c['rodape'])
+                              for c in cached['itens']]
+                else:
+                    cupons = [([CupomItem.from_dict(i) for i in cached['itens']],
+                               list(filter(_linha_de_rodape, cached['texto'].split('\n'))))]
+                return self._montar_resultados(cupons, registro)
+
+        # Cadeia de motores: passa ao seguinte se um falhar ou não achar itens.
+        # O OCR, se configurado, só é tentado quando o PDF foi lido mas não
+        # tinha itens no texto (provavelmente só imagem)
+        motores = self.motores + ['ocr'] if self.ocr is not None else self.motores
+        for n, motor in enumerate(motores, 1):
+            registro['motor'] = motor
+            try:
+                cupons, text = self._extrair_itens(file_path, motor, progresso, cancelar,
+                                                   registro, hash_pdf is not None, dividir)
+                break
+            except (PDFReadError, NoItemsError) as e:
+                if n == len(motores) or (motores[n] == 'ocr' and not isinstance(e, NoItemsError)):
+                    raise
+                logger.info("Motor %s falhou em %s (%s); tentando %s", motor, file_path, e, motores[n])
+                registro.setdefault('tentativas', []).append({
+                    'motor': motor, 'erro': f"{type(e).__name__}: {e}",
+                    'segundos': registro['etapas'].get('extracao', {}).get('segundos'),
+                })
+
+        if hash_pdf:
+            if dividir:
+                itens = [{'itens': [i.to_dict() for i in items], 'rodape': rodape}
+                         for items, rodape in cupons]
+            else:
+                itens = [i.to_dict() for i in cupons[0][0]]
+            with medir_etapa(registro, 'cache_gravar'):
+                self.cache.gravar(hash_pdf, versao, text, itens)
+        return self._montar_resultados(cupons, registro)
+
+    def _montar_resultados(self, cupons: List[tuple], registro: Dict) -> List[Dict]:
+        """Um resultado para cada (itens, linhas do rodapé).
+
+        Com mais de um cupom, cada resultado traz sua posição no arquivo em
+        ``'parte'`` (1, 2, ...), que o identifica quando não há chave de acesso.
+        """
+        resultados = [self._montar_resultado(items, registro, extrair_emissao(rodape), extrair_chave(rodape))
+                      for items, rodape in cupons]
+        if len(resultados) > 1:
+            registro['cupons'] = len(resultados)
+            for parte, resultado in enumerate(resultados, 1):
+                resultado['parte'] = parte
+        return resultados
+
+    def _extrair_itens(self, file_path: str, motor: str, progresso: Optional[Progresso],
+                       cancelar, registro: Dict, guardar_tudo: bool, dividir: bool = False) -> tuple:
+        """Extrai e processa as linhas com um motor.
+
+        Retorna ([(itens, linhas do rodapé)], texto), com um par por cupom
+        se ``dividir`` for verdadeiro e um só par caso contrário.
+        """
+        # As linhas só são guardadas se forem para o cache; sem cache, apenas
+        # o início do texto é mantido para diagnóstico
+        linhas = []
+        rodape = []  # Candidatas à data de emissão e à chave de acesso
+        paginas = [0]
+
+        def contar_paginas(pagina: int, total: int):
+            paginas[0] = pagina
+            if progresso:
+                progresso(pagina, total)
+
+        def capturar(lines: Iterable[str]) -> Iterator[str]:
+            tamanho = 0
+            for line in lines:
+                if guardar_tudo or tamanho < 1000:
+                    linhas.append(line)
+                    tamanho += len(line) + 1
+                if _linha_de_rodape(line):
+                    rodape.append(line)
+                yield line
+
+        # Extração e parse são intercalados (linha a linha): o tempo gasto
+        # dentro do gerador de linhas é contado como extração
+        extracao = Cronometro(self.iter_lines(file_path, contar_paginas, cancelar, motor))
+        try:
+            with medir_etapa(registro, 'parse') as parse:
+                if dividir:
+                    cupons = []
+                    for bloco in dividir_cupons(capturar(extracao)):
+                        estatisticas = {}
+                        items = self.parse_items(bloco, estatisticas)
+                        for chave, valor in estatisticas.items():
+                            parse[chave] = valor if chave == 'formato' else parse.get(chave, 0) + valor
+                        if items:
+                            cupons.append((items, list(filter(_linha_de_rodape, bloco))))
+                else:
+                    items = self.parse_items(capturar(extracao), parse)
+                    cupons = [(items, rodape)] if items else []
+        finally:
+            parse['segundos'] = round(max(0.0, parse['segundos'] - extracao.segundos), 6)
+            registro['etapas']['extracao'] = {
+                'segundos': round(extracao.segundos, 6),
+                'paginas': paginas[0],
+                'linhas': parse.get('linhas', 0),
+            }
+        text = '\n'.join(linhas)
+        if not cupons:
+            logger.debug("Texto extraído:\n%s", text[:1000])
+            raise NoItemsError("Nenhum item encontrado", texto=text)
+        return cupons, text
+
+    def _hash_para_cache(self, file_path: str) -> Optional[str]:
+        if self.cache is None:
+            return None
+        from cupom_cache import hash_arquivo
+        try:
+            return hash_arquivo(file_path)
+        except OSError as e:
+            raise PDFReadError(f"Falha ao ler PDF: {e}") from e
@@ -0,0 +1,472 @@
+"""Serviço HTTP local que processa cupons para vários caixas de uma vez.
+
+Uso: python cupom_servidor.py [--host 127.0.0.1] [--porta 8765] [-j N] [--fila N]
+     [--motor pdfium,layout] [--metricas m.jsonl] [--ocr] [-P N]
+
+Rotas (respostas em JSON; valores monetários como texto, sem perda de precisão):
+
+    POST /processar   corpo = o PDF (ou XML/.zip da NFC-e) enviado, ou JSON
+                      {"caminho": "..."} de um arquivo visível ao servidor.
+                      Parâmetros opcionais na URL: nome, agrupar=0, reprocessar=1.
+    POST /devolucao   JSON {"hash" (de /processar) ou "caminho", "entradas":
+                      [...]}; confere como "Comparar" da interface, sem registrar.
+    GET  /saude       situação do servidor e ocupação do pool
+    GET  /metricas    contadores, acertos do cache e tempo por etapa
+
+Os cupons são lidos em um pool de processos (o mesmo trabalho do lote). No
+máximo ``fila`` cupons ficam em processamento; além disso o servidor
+responde 503 com Retry-After em vez de acumular requisições. Os resultados
+ficam em memória pelo hash do conteúdo, e envios simultâneos do mesmo
+arquivo esperam um único processamento; o cache em disco (``CupomCache``)
+é compartilhado pelos processos e sobrevive a reinícios.
+
+Sem autenticação: por padrão só escuta em 127.0.0.1, e ``caminho`` é lido
+com as permissões do usuário do servidor.
+"""
+import os
+import sys
+import json
+import asyncio
+import hashlib
+import logging
+import argparse
+import tempfile
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from decimal import Decimal
+from http import HTTPStatus
+from typing import Optional, List, Dict, Tuple
+from urllib.parse import urlsplit, parse_qs
+
+from cupom_cache import CACHE_PADRAO, hash_arquivo
+from cupom_devolucao import IndiceDevolucao, STATUS_OK, STATUS_NAO_ENCONTRADO
+from cupom_itens import CupomItem
+from cupom_lote import _processar_arquivo_lote, _motor_arg
+from cupom_metricas import Metricas
+from cupom_ocr import ocr_disponivel
+
+logger = logging.getLogger(__name__)
+
+PORTA_PADRAO = 8765
+LIMITE_UPLOAD_PADRAO = 20 * 1024 * 1024  # bytes
+RESULTADOS_EM_MEMORIA = 1024
+TEMPO_LEITURA = 30  # segundos para o cliente enviar a requisição
+
+
+class ErroHTTP(Exception):
+    def __init__(self, status: int, mensagem: str, cabecalhos: Optional[Dict[str, str]] = None):
+        super().__init__(mensagem)
+        self.status = status
+        self.cabecalhos = cabecalhos or {}
+
+
+def _json_padrao(valor):
+    """Serializa os tipos do resultado que o json não conhece"""
+    if isinstance(valor, Decimal):
+        return str(valor)
+    if isinstance(valor, datetime):
+        return valor.isoformat()
+    if isinstance(valor, CupomItem):
+        return valor.to_dict()
+    raise TypeError(f"{type(valor).__name__} não é serializável")
+
+
+def _extensao_enviada(corpo: bytes) -> str:
+    """Extensão do arquivo enviado, pelo conteúdo (o reader escolhe o caminho por ela)"""
+    if corpo.startswith(b'%PDF'):
+        return '.pdf'
+    if corpo.startswith(b'PK'):
+        return '.zip'
+    if corpo.lstrip()[:1] == b'<':
+        return '.xml'
+    raise ErroHTTP(415, "Envie um PDF, um XML da NFC-e ou um .zip de XMLs")
+
+
+def _gravar_temporario(corpo: bytes, extensao: str) -> str:
+    fd, caminho = tempfile.mkstemp(prefix='cupom_', suffix=extensao)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(corpo)
+    return caminho
+
+
+def _opcao(consulta: Dict, nome: str, padrao: bool) -> bool:
+    valores = consulta.get(nome)
+    if not valores:
+        return padrao
+    return valores[-1].lower() not in ('0', 'false', 'nao', 'não')
+
+
+class ServidorCupons:
+    def __init__(self, workers: Optional[int] = None, fila: Optional[int] = None,
+                 agrupar: bool = True, cache_path: Optional[str] = CACHE_PADRAO,
+                 motor: str = 'layout', metricas: Optional[str] = None, ocr: bool = False,
+                 limite_upload: int = LIMITE_UPLOAD_PADRAO, paginas: int = 0):
+        """``fila``: cupons em processamento ao mesmo tempo antes de recusar
+        com 503 (padrão: dois por processo, como no monitor). ``metricas``:
+        arquivo JSON lines que recebe o registro de cada cupom processado.
+        ``paginas``: processos por PDF grande, extraído por faixas de páginas
+        (``cupom_paralelo``); cada processo do pool abre os seus, então
+        convém usar poucos ``workers``."""
+        self.workers = workers or os.cpu_count() or 1
+        self.fila = fila or self.workers * 2
+        self.agrupar = agrupar
+        self.cache_path = cache_path
+        self.motor = motor
+        self.ocr = ocr
+        self.limite_upload = limite_upload
+        self.paginas = paginas
+        self.metricas = Metricas(metricas, origem='servidor') if metricas else None
+
+        self._executor: Optional[ProcessPoolExecutor] = None
+        # (hash, agrupar) -> resultado, do menos para o mais recente
+        self._resultados: OrderedDict = OrderedDict()
+        # Processamentos em andamento, compartilhados por envios do mesmo arquivo
+        self._pendentes: Dict[Tuple[str, bool], asyncio.Task] = {}
+        self._em_andamento = 0
+        self._inicio = datetime.now()
+        self._contadores = dict.fromkeys(
+            ('requisicoes', 'processados', 'falhas', 'cache_memoria', 'compartilhados',
+             'rejeitadas'), 0)
+        self._rotas: Dict[str, int] = {}
+        self._etapas: Dict[str, Dict] = {}
+
+    async def executar(self, host: str = '127.0.0.1', porta: int = PORTA_PADRAO,
+                       pronto: Optional[asyncio.Event] = None):
+        """Atende até ser cancelado; ``pronto`` é acionado quando a porta está aberta"""
+        self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        try:
+            servidor = await asyncio.start_server(self._atender, host, porta)
+            async with servidor:
+                for sock in servidor.sockets:
+                    logger.info("Servindo em http://%s:%d", *sock.getsockname()[:2])
+                if pronto is not None:
+                    pronto.set()
+                await servidor.serve_forever()
+        finally:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def _atender(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Uma conexão; atende requisições em sequência enquanto o cliente mantiver"""
+        try:
+            while True:
+                try:
+                    requisicao = await asyncio.wait_for(self._ler_requisicao(reader), TEMPO_LEITURA)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    return
+                except ErroHTTP as e:
+                    await self._responder(writer, e.status, {'erro': str(e)}, e.cabecalhos, manter=False)
+                    return
+                if requisicao is None:
+                    return
+                metodo, alvo, cabecalhos, corpo = requisicao
+                manter = cabecalhos.get('connection', '').lower() != 'close'
+                status, dados, extras = await self._despachar(metodo, alvo, cabecalhos, corpo)
+                await self._responder(writer, status, dados, extras, manter)
+                if not manter:
+                    return
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _ler_requisicao(self, reader: asyncio.StreamReader):
+        """(método, alvo, cabeçalhos, corpo), ou None se o cliente fechou a conexão"""
+        linha = await self._ler_linha(reader, 400, "Linha de requisição longa demais")
+        if not linha:
+            return None
+        try:
+            metodo, alvo, _ = linha.decode('latin-1').split()
+        except ValueError:
+            raise ErroHTTP(400, "Requisição inválida")
+        cabecalhos = {}
+        while True:
+            linha = await self._ler_linha(reader, 431, "Cabeçalho longo demais")
+            if linha in (b'\r\n', b'\n', b''):
+                break
+            nome, _, valor = linha.decode('latin-1').partition(':')
+            cabecalhos[nome.strip().lower()] = valor.strip()
+        try:
+            tamanho = int(cabecalhos.get('content-length', 0))
+        except ValueError:
+            tamanho = -1
+        if tamanho < 0:
+            raise ErroHTTP(400, "Content-Length inválido")
+        if tamanho > self.limite_upload:
+            raise ErroHTTP(413, f"Arquivo maior que {self.limite_upload} bytes")
+        corpo = await reader.readexactly(tamanho) if tamanho else b''
+        return metodo.upper(), alvo, cabecalhos, corpo
+
+    @staticmethod
+    async def _ler_linha(reader: asyncio.StreamReader, status: int, mensagem: str) -> bytes:
+        """Uma linha da requisição; além do limite do ``StreamReader``, ``ErroHTTP(status)``"""
+        try:
+            return await reader.readline()
+        except ValueError:  # LimitOverrunError, convertido por readline
+            raise ErroHTTP(status, mensagem)
+
+    async def _responder(self, writer: asyncio.StreamWriter, status: int, dados: Dict,
+                         extras: Optional[Dict[str, str]] = None, manter: bool = True):
+        corpo = json.dumps(dados, ensure_ascii=False, default=_json_padrao).encode('utf-8')
+        cabecalhos = {
+            'Content-Type': 'application/json; charset=utf-8',
+            'Content-Length': str(len(corpo)),
+            'Connection': 'keep-alive' if manter else 'close',
+            **(extras or {}),
+        }
+        inicio = f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n"
+        inicio += ''.join(f"{nome}: {valor}\r\n" for nome, valor in cabecalhos.items())
+        writer.write(inicio.encode('latin-1') + b'\r\n' + corpo)
+        await writer.drain()
+
+    async def _despachar(self, metodo: str, alvo: str, cabecalhos: Dict[str, str],
+                         corpo: bytes) -> Tuple[int, Dict, Dict[str, str]]:
+        url = urlsplit(alvo)
+        rotas = {
+            ('POST', '/processar'): self.processar,
+            ('POST', '/devolucao'): self.devolucao,
+            ('GET', '/saude'): self.saude,
+            ('GET', '/metricas'): self.resumo_metricas,
+        }
+        self._contadores['requisicoes'] += 1
+        self._rotas[url.path] = self._rotas.get(url.path, 0) + 1
+        rota = rotas.get((metodo, url.path))
+        try:
+            if rota is None:
+                permitido = [m for m, caminho in rotas if caminho == url.path]
+                if permitido:
+                    raise ErroHTTP(405, f"Use {permitido[0]} em {url.path}", {'Allow': permitido[0]})
+                raise ErroHTTP(404, f"Rota desconhecida: {url.path}")
+            return 200, await rota(parse_qs(url.query), cabecalhos, corpo), {}
+        except ErroHTTP as e:
+            return e.status, {'erro': str(e)}, e.cabecalhos
+        except Exception as e:
+            logger.exception("Falha em %s %s", metodo, alvo)
+            return 500, {'erro': f"Falha inesperada: {e}"}, {}
+
+    async def processar(self, consulta: Dict, cabecalhos: Dict[str, str], corpo: bytes) -> Dict:
+        """POST /processar: itens e totais do cupom enviado ou indicado"""
+        agrupar = _opcao(consulta, 'agrupar', self.agrupar)
+        usar_cache = not _opcao(consulta, 'reprocessar', False)
+        if cabecalhos.get('content-type', '').startswith('application/json'):
+            caminho = self._caminho_do_json(corpo)
+            hash_cupom, resultado = await self._cupom_do_caminho(caminho, agrupar, usar_cache)
+            nome = caminho
+        else:
+            if not corpo:
+                raise ErroHTTP(400, "Envie o arquivo no corpo ou JSON com 'caminho'")
+            nome = (consulta.get('nome') or ['upload'])[-1]
+            hash_cupom = hashlib.sha256(corpo).hexdigest()
+            resultado = await self._obter_cupom(hash_cupom, agrupar, usar_cache,
+                                                enviado=(corpo, _extensao_enviada(corpo)))
+        resposta = {'hash': hash_cupom, 'arquivo': nome}
+        if 'cupons' in resultado:
+            resposta['cupons'] = [self._sem_arquivo(c) for c in resultado['cupons']]
+        else:
+            resposta.update(self._sem_arquivo(resultado))
+        return resposta
+
+    async def devolucao(self, consulta: Dict, cabecalhos: Dict[str, str], corpo: bytes) -> Dict:
+        """POST /devolucao: confere as entradas contra o cupom, sem abater o saldo"""
+        pedido = self._ler_json(corpo)
+        agrupar = bool(pedido.get('agrupar', self.agrupar))
+        if pedido.get('hash'):
+            resultado = self._resultados.get((pedido['hash'], agrupar))
+            if resultado is None:
+                raise ErroHTTP(404, "Cupom não encontrado; envie o arquivo para /processar")
+        elif pedido.get('caminho'):
+            _, resultado = await self._cupom_do_caminho(self._caminho_do_json(corpo), agrupar, True)
+        else:
+            raise ErroHTTP(400, "Informe 'hash' ou 'caminho' do cupom")
+        if 'cupons' in resultado:
+            raise ErroHTTP(422, "O arquivo tem várias NFC-e; envie a nota da devolução")
+
+        entradas = pedido.get('entradas') or []
+        if isinstance(entradas, str):
+            entradas = entradas.split('\n')
+        resultados = IndiceDevolucao(resultado['itens']).registrar(entradas, confirmar=False)
+
+        divergencias = sum(r.status != STATUS_OK for r in resultados)
+        valor_total = sum(r.valor_devolvido for r in resultados if r.status != STATUS_NAO_ENCONTRADO)
+        return {
+            'itens_verificados': len(resultados),
+            'divergencias': divergencias,
+            'valor_devolver': Decimal(valor_total),
+            'resultados': [{
+                'entrada': r.entrada,
+                'quantidade': r.quantidade,
+                'quantidade_devolvida': r.quantidade_devolvida,
+                'valor_devolvido': r.valor_devolvido,
+                'status': r.status,
+                'item': r.item,
+            } for r in resultados],
+        }
+
+    async def saude(self, consulta: Dict, cabecalhos: Dict[str, str], corpo: bytes) -> Dict:
+        """GET /saude: 'ok' ou 'ocupado' (toda a fila em uso, novos cupons recebem 503)"""
+        return {
+            'status': 'ocupado' if self._em_andamento >= self.fila else 'ok',
+            'desde': self._inicio.isoformat(timespec='seconds'),
+            'workers': self.workers,
+            'fila': self.fila,
+            'em_andamento': self._em_andamento,
+            'resultados_em_memoria': len(self._resultados),
+        }
+
+    async def resumo_metricas(self, consulta: Dict, cabecalhos: Dict[str, str], corpo: bytes) -> Dict:
+        """GET /metricas: contadores desde o início e tempo médio de cada etapa"""
+        return {
+            **self._contadores,
+            'em_andamento': self._em_andamento,
+            'rotas': self._rotas,
+            'etapas': {
+                nome: {'cupons': e['cupons'], 'segundos': round(e['segundos'], 6),
+                       'media_ms': round(e['segundos'] * 1000 / e['cupons'], 3)}
+                for nome, e in self._etapas.items()
+            },
+        }
+
+    @staticmethod
+    def _ler_json(corpo: bytes) -> Dict:
+        try:
+            pedido = json.loads(corpo or b'{}')
+        except ValueError as e:
+            raise ErroHTTP(400, f"JSON inválido: {e}")
+        if not isinstance(pedido, dict):
+            raise ErroHTTP(400, "O JSON deve ser um objeto")
+        return pedido
+
+    def _caminho_do_json(self, corpo: bytes) -> str:
+        caminho = self._ler_json(corpo).get('caminho')
+        if not isinstance(caminho, str) or not caminho:
+            raise ErroHTTP(400, "Informe 'caminho' do arquivo")
+        return caminho
+
+    @staticmethod
+    def _sem_arquivo(resultado: Dict) -> Dict:
+        """O resultado sem o caminho interno (arquivo temporário do envio)"""
+        return {chave: valor for chave, valor in resultado.items() if chave != 'arquivo'}
+
+    async def _cupom_do_caminho(self, caminho: str, agrupar: bool, usar_cache: bool) -> Tuple[str, Dict]:
+        if not os.path.isfile(caminho):
+            raise ErroHTTP(404, f"Arquivo não encontrado: {caminho}")
+        try:
+            hash_pdf = await asyncio.to_thread(hash_arquivo, caminho)
+        except OSError as e:
+            raise ErroHTTP(422, f"Falha ao ler {caminho}: {e}")
+        return hash_pdf, await self._obter_cupom(hash_pdf, agrupar, usar_cache, caminho=caminho)
+
+    async def _obter_cupom(self, hash_pdf: str, agrupar: bool, usar_cache: bool,
+                           caminho: Optional[str] = None,
+                           enviado: Optional[Tuple[bytes, str]] = None) -> Dict:
+        """Resultado em memória, o processamento já em andamento ou um novo no pool"""
+        chave = (hash_pdf, agrupar)
+        if usar_cache:
+            resultado = self._resultados.get(chave)
+            if resultado is not None:
+                self._resultados.move_to_end(chave)
+                self._contadores['cache_memoria'] += 1
+                return resultado
+            pendente = self._pendentes.get(chave)
+            if pendente is not None:
+                self._contadores['compartilhados'] += 1
+                return await asyncio.shield(pendente)
+
+        if self._em_andamento >= self.fila:
+            self._contadores['rejeitadas'] += 1
+            raise ErroHTTP(503, "Servidor ocupado; tente novamente", {'Retry-After': '1'})
+        self._em_andamento += 1
+        tarefa = asyncio.ensure_future(self._processar_no_pool(chave, caminho, enviado, usar_cache))
+        self._pendentes[chave] = tarefa
+        # Se o cliente desistir, o processamento segue e o resultado fica em memória
+        return await asyncio.shield(tarefa)
+
+    async def _processar_no_pool(self, chave: Tuple[str, bool], caminho: Optional[str],
+                                 enviado: Optional[Tuple[bytes, str]], usar_cache: bool) -> Dict:
+        temporario = None
+        try:
+            if enviado is not None:
+                caminho = temporario = await asyncio.to_thread(_gravar_temporario, *enviado)
+            resultado = await asyncio.get_running_loop().run_in_executor(
+                self._executor, _processar_arquivo_lote, caminho, chave[1], self.cache_path,
+                usar_cache, True, None, self.motor, self.ocr, False, self.paginas
+            )
+        finally:
+            self._em_andamento -= 1
+            if self._pendentes.get(chave) is asyncio.current_task():
+                del self._pendentes[chave]
+            if temporario is not None:
+                os.remove(temporario)
+
+        for registro in resultado.pop('metricas', ()):
+            self._somar_etapas(registro)
+            if self.metricas is not None:
+                self.metricas.emitir(registro)
+        if 'erro' in resultado:
+            self._contadores['falhas'] += 1
+            raise ErroHTTP(422, resultado['erro'])
+        self._contadores['processados'] += 1
+        self._resultados[chave] = resultado
+        if len(self._resultados) > RESULTADOS_EM_MEMORIA:
+            self._resultados.popitem(last=False)
+        return resultado
+
+    def _somar_etapas(self, registro: Dict):
+        for nome, dados in registro.get('etapas', {}).items():
+            etapa = self._etapas.setdefault(nome, {'cupons': 0, 'segundos': 0.0})
+            etapa['cupons'] += 1
+            etapa['segundos'] += dados.get('segundos', 0.0)
+
+
+def criar_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Serviço HTTP local de leitura de cupons")
+    parser.add_argument('--host', default='127.0.0.1', help="Endereço de escuta (padrão: 127.0.0.1)")
+    parser.add_argument('--porta', type=int, default=PORTA_PADRAO,
+                        help=f"Porta (padrão: {PORTA_PADRAO})")
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help="Número de processos (padrão: todos os núcleos)")
+    parser.add_argument('--fila', type=int, default=None,
+                        help="Cupons em processamento antes de responder 503 (padrão: 2 por processo)")
+    parser.add_argument('--sem-agrupar', action='store_true', help="Não agrupa itens iguais")
+    parser.add_argument('--cache', default=CACHE_PADRAO, help=f"Arquivo do cache (padrão: {CACHE_PADRAO})")
+    parser.add_argument('--sem-cache', action='store_true', help="Não usa nem grava o cache em disco")
+    parser.add_argument('--motor', type=_motor_arg, default='layout',
+                        help="Motor de extração ou cadeia de fallback (veja cupom_lote.py)")
+    parser.add_argument('--metricas', help="Anexa métricas por etapa (JSON lines) a este arquivo")
+    parser.add_argument('--limite-upload', type=int, default=LIMITE_UPLOAD_PADRAO // (1024 * 1024),
+                        help="Tamanho máximo do arquivo enviado, em MB (padrão: 20)")
+    parser.add_argument('--ocr', action='store_true',
+                        help="OCR (Tesseract) dos PDFs sem itens no texto, ex.: digitalizados")
+    parser.add_argument('-P', '--paginas-paralelas', type=int, default=0, metavar='N',
+                        help="Extrai cada PDF grande em N processos, por faixas de páginas "
+                             "(de preferência com -j 1)")
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = criar_parser().parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    if args.ocr and not ocr_disponivel():
+        print("OCR indisponível: instale pytesseract, pypdfium2 e o Tesseract.", file=sys.stderr)
+        return 2
+
+    servidor = ServidorCupons(
+        args.workers, args.fila, not args.sem_agrupar, None if args.sem_cache else args.cache,
+        args.motor, args.metricas, args.ocr, args.limite_upload * 1024 * 1024,
+        args.paginas_paralelas
+    )
+    try:
+        asyncio.run(servidor.executar(args.host, args.porta))
+    except KeyboardInterrupt:
+        logger.info("Encerrado")
+    except OSError as e:
+        print(f"Falha ao abrir {args.host}:{args.porta}: {e}", file=sys.stderr)
+        return 2
+    return 0
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
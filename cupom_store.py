@@ -0,0 +1,340 @@
+"""Armazém local (SQLite) de todos os cupons processados, com busca indexada.
+
+Cada cupom é gravado uma vez (pelo hash do PDF e pela chave de acesso da
+NFC-e, então o PDF e o XML do mesmo cupom não se duplicam) com seus itens, e
+pode ser consultado sem reprocessar o PDF: por código (EAN, sem zeros à esquerda),
+por palavras da descrição (FTS5, sem diferenciar acentos), por período e
+por faixa de total. Os índices mantêm as buscas em milissegundos mesmo com
+centenas de milhares de cupons. As devoluções confirmadas também ficam
+gravadas, por cupom e linha, para o saldo devolvível sobreviver a reabrir o
+cupom.
+"""
+import os
+import time
+import sqlite3
+import threading
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from operator import itemgetter
+from typing import Optional, List, Dict, Iterable, Union
+
+from cupom_cache import CACHE_PADRAO, hash_arquivo
+from cupom_devolucao import ResultadoDevolucao, chave_linha, normalizar_codigo, normalizar_descricao
+from cupom_itens import CupomItem, para_centavos, de_centavos
+
+ARMAZEM_PADRAO = os.path.join(os.path.dirname(CACHE_PADRAO), 'cupons.sqlite3')
+
+Data = Union[date, datetime, str]
+
+
+def _data_iso(valor: Data, fim_do_dia: bool = False) -> str:
+    """Data (ou data/hora) no formato gravado; ``fim_do_dia`` torna uma data inclusiva"""
+    if isinstance(valor, str):
+        return valor
+    if not isinstance(valor, datetime):
+        if fim_do_dia:
+            valor += timedelta(days=1)
+        return valor.isoformat()
+    return valor.isoformat(timespec='seconds')
+
+
+def _contem_palavras(descricao: str, palavras: List[str]) -> bool:
+    """Cada palavra é o início de alguma palavra da descrição (como o FTS com prefixo)"""
+    termos = normalizar_descricao(descricao).split()
+    return all(any(t.startswith(p) for t in termos) for p in palavras)
+
+
+class CupomStore:
+    def __init__(self, caminho: str = ARMAZEM_PADRAO):
+        self.caminho = caminho
+        self._lock = threading.Lock()
+
+        pasta = os.path.dirname(caminho)
+        if pasta:
+            os.makedirs(pasta, exist_ok=True)
+        # A interface grava na thread de trabalho e consulta na thread do Tk
+        self._conn = sqlite3.connect(caminho, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS cupons (
+                id INTEGER PRIMARY KEY,
+                hash TEXT UNIQUE,
+                chave TEXT,  -- Chave de acesso da NFC-e (44 dígitos), se conhecida
+                arquivo TEXT NOT NULL,
+                data TEXT NOT NULL,  -- Emissão; sem ela, a data do processamento
+                emissao_conhecida INTEGER NOT NULL,
+                total_centavos INTEGER NOT NULL,
+                descontos_centavos INTEGER NOT NULL,
+                total_itens INTEGER NOT NULL,
+                processado_em REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_cupons_data ON cupons (data);
+            CREATE INDEX IF NOT EXISTS idx_cupons_total ON cupons (total_centavos);
+
+            CREATE TABLE IF NOT EXISTS itens (
+                id INTEGER PRIMARY KEY,
+                cupom_id INTEGER NOT NULL REFERENCES cupons (id),
+                item INTEGER NOT NULL,
+                codigo TEXT NOT NULL,
+                codigo_norm TEXT NOT NULL,
+                descricao TEXT NOT NULL,
+                quantidade REAL NOT NULL,
+                unidade TEXT NOT NULL,
+                valor_unitario TEXT NOT NULL,
+                valor_total_centavos INTEGER NOT NULL,
+                desconto_centavos INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_itens_codigo ON itens (codigo_norm, cupom_id);
+            CREATE INDEX IF NOT EXISTS idx_itens_cupom ON itens (cupom_id);
+
+            -- Quantidade devolvida de cada linha do cupom (veja chave_linha)
+            CREATE TABLE IF NOT EXISTS devolucoes (
+                id INTEGER PRIMARY KEY,
+                cupom_id INTEGER NOT NULL REFERENCES cupons (id),
+                item INTEGER NOT NULL,
+                codigo TEXT NOT NULL,
+                descricao TEXT NOT NULL,
+                valor_unitario TEXT NOT NULL,
+                quantidade REAL NOT NULL,
+                valor_centavos INTEGER NOT NULL,
+                registrada_em REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_devolucoes_cupom ON devolucoes (cupom_id);
+        """)
+        colunas = {row[1] for row in self._conn.execute("PRAGMA table_info(cupons)")}
+        if 'chave' not in colunas:  # Armazém criado antes da chave de acesso
+            self._conn.execute("ALTER TABLE cupons ADD COLUMN chave TEXT")
+        self._conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_cupons_chave ON cupons (chave)")
+        self._fts = self._criar_fts()
+        self._conn.commit()
+
+    def _criar_fts(self) -> bool:
+        """Índice de texto da descrição; sem FTS5 no SQLite, a busca usa LIKE"""
+        try:
+            self._conn.executescript("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS itens_fts USING fts5 (
+                    descricao, content='itens', content_rowid='id',
+                    tokenize='unicode61 remove_diacritics 2'
+                );
+                CREATE TRIGGER IF NOT EXISTS itens_fts_ai AFTER INSERT ON itens BEGIN
+                    INSERT INTO itens_fts (rowid, descricao) VALUES (new.id, new.descricao);
+                END;
+                CREATE TRIGGER IF NOT EXISTS itens_fts_ad AFTER DELETE ON itens BEGIN
+                    INSERT INTO itens_fts (itens_fts, rowid, descricao) VALUES ('delete', old.id, old.descricao);
+                END;
+            """)
+            return True
+        except sqlite3.OperationalError:
+            return False
+
+    def gravar(self, resultado: Dict, arquivo: Optional[str] = None) -> int:
+        """Grava (ou substitui) um resultado de ``process_cupom``; retorna o id.
+
+        O cupom é identificado por ``resultado['hash']`` (ou o hash do
+        ``arquivo``) e pela chave de acesso (``resultado['chave']``): o mesmo
+        PDF processado de novo, ou o XML do mesmo cupom, substitui o registro
+        anterior (e as devoluções dele passam para o novo). Resultados de
+        XML (com chave e sem hash) não usam o hash do arquivo, que pode
+        conter várias notas; um de vários cupons do mesmo arquivo sem chave
+        (``resultado['parte']``, de ``process_cupons`` ou de um XML com
+        várias notas) usa o hash do arquivo e a posição.
+        """
+        arquivo = arquivo or resultado.get('arquivo') or ""
+        hash_pdf = resultado.get('hash')
+        chave = resultado.get('chave')
+        if hash_pdf is None and chave is None and arquivo:
+            try:
+                hash_pdf = hash_arquivo(arquivo)
+            except OSError:
+                pass
+            else:
+                if resultado.get('parte'):
+                    hash_pdf += f"#{resultado['parte']}"
+        emissao = resultado.get('emissao')
+        data = emissao or datetime.now()
+
+        with self._lock:
+            with self._conn:  # Uma transação por cupom
+                if hash_pdf is not None or chave is not None:
+                    antigos = self._conn.execute(
+                        "SELECT id FROM cupons WHERE hash = ? OR chave = ?", (hash_pdf, chave)
+                    ).fetchall()
+                    self._conn.executemany("DELETE FROM itens WHERE cupom_id = ?", antigos)
+                    self._conn.executemany("DELETE FROM cupons WHERE id = ?", antigos)
+                cursor = self._conn.execute(
+                    "INSERT INTO cupons (hash, chave, arquivo, data, emissao_conhecida, total_centavos, "
+                    "descontos_centavos, total_itens, processado_em) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (hash_pdf, chave, arquivo, _data_iso(data), emissao is not None,
+                     para_centavos(resultado['total_geral']), para_centavos(resultado['total_descontos']),
+                     resultado['total_itens'], time.time())
+                )
+                cupom_id = cursor.lastrowid
+                if hash_pdf is not None or chave is not None:
+                    self._conn.executemany("UPDATE devolucoes SET cupom_id = ? WHERE cupom_id = ?",
+                                           [(cupom_id, antigo) for antigo, in antigos])
+                self._conn.executemany(
+                    "INSERT INTO itens (cupom_id, item, codigo, codigo_norm, descricao, quantidade, unidade, "
+                    "valor_unitario, valor_total_centavos, desconto_centavos) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(cupom_id, item['item'], item['codigo'], normalizar_codigo(item['codigo']),
+                      item['descricao'], item['quantidade'], item['unidade'], str(item['valor_unitario']),
+                      para_centavos(item['valor_total']), para_centavos(item['desconto']))
+                     for item in resultado['itens']]
+                )
+        return cupom_id
+
+    def buscar(self, codigo: Optional[str] = None, descricao: Optional[str] = None,
+               desde: Optional[Data] = None, ate: Optional[Data] = None,
+               total_min: Optional[Decimal] = None, total_max: Optional[Decimal] = None,
+               chave: Optional[str] = None, limite: int = 500) -> List[Dict]:
+        """Busca cupons, do mais recente ao mais antigo.
+
+        Com ``codigo`` e/ou ``descricao`` retorna uma linha por item
+        encontrado (com os campos do cupom e do item); sem eles, uma linha
+        por cupom. ``desde``/``ate`` filtram a data de emissão (datas
+        inclusivas), ``total_min``/``total_max`` o total do cupom e ``chave``
+        a chave de acesso (com ou sem espaços).
+
+        Só por descrição, a busca percorre o índice de texto dos itens
+        gravados mais recentemente para trás e para no ``limite``, em vez de
+        ordenar todas as ocorrências de uma palavra comum; os ``limite``
+        itens encontrados são então ordenados por data. Com código e
+        descrição, o código (indexado) restringe as linhas e a descrição é
+        conferida em seguida, sem consultar o índice de texto.
+        """
+        condicoes, params = [], []
+        por_item = bool(codigo or descricao)
+        origem = "itens i"
+        ordem = "c.data DESC, c.id, i.item"
+        conferir = None  # Palavras da descrição conferidas após a consulta
+        if codigo:
+            condicoes.append("i.codigo_norm = ?")
+            params.append(normalizar_codigo(codigo))
+        if descricao:
+            palavras = normalizar_descricao(descricao).replace('"', ' ').split()
+            consulta = ' '.join(f'"{p}"*' for p in palavras)
+            if codigo:
+                conferir = palavras
+            elif self._fts:
+                origem = "itens_fts f JOIN itens i ON i.id = f.rowid"
+                ordem = "f.rowid DESC"
+                condicoes.append("itens_fts MATCH ?")
+                params.append(consulta)
+            else:
+                for p in palavras:
+                    condicoes.append("i.descricao LIKE ?")
+                    params.append(f"%{p}%")
+        if desde is not None:
+            condicoes.append("c.data >= ?")
+            params.append(_data_iso(desde))
+        if ate is not None:
+            condicoes.append("c.data < ?" if not isinstance(ate, (datetime, str)) else "c.data <= ?")
+            params.append(_data_iso(ate, fim_do_dia=True))
+        if total_min is not None:
+            condicoes.append("c.total_centavos >= ?")
+            params.append(para_centavos(total_min))
+        if total_max is not None:
+            condicoes.append("c.total_centavos <= ?")
+            params.append(para_centavos(total_max))
+        if chave:
+            condicoes.append("c.chave = ?")
+            params.append(''.join(chave.split()))
+
+        where = f"WHERE {' AND '.join(condicoes)}" if condicoes else ""
+        colunas_cupom = ("c.id, c.arquivo, c.data, c.emissao_conhecida, c.total_centavos, c.total_itens, "
+                         "c.chave")
+        if por_item:
+            sql = (f"SELECT {colunas_cupom}, i.item, i.codigo, i.descricao, i.quantidade, i.unidade, "
+                   f"i.valor_total_centavos FROM {origem} JOIN cupons c ON c.id = i.cupom_id {where} "
+                   f"ORDER BY {ordem} LIMIT ?")
+        else:
+            sql = f"SELECT {colunas_cupom} FROM cupons c {where} ORDER BY c.data DESC, c.id LIMIT ?"
+        params.append(-1 if conferir else limite)
+
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        if conferir:
+            rows = [r for r in rows if _contem_palavras(r[9], conferir)][:limite]
+        elif origem != "itens i":
+            rows.sort(key=itemgetter(0, 7))
+            rows.sort(key=itemgetter(2), reverse=True)
+        resultados = []
+        for row in rows:
+            encontrado = {
+                'cupom_id': row[0],
+                'arquivo': row[1],
+                'data': datetime.fromisoformat(row[2]),
+                'emissao_conhecida': bool(row[3]),
+                'total_geral': de_centavos(row[4]),
+                'total_itens': row[5],
+                'chave': row[6],
+            }
+            if por_item:
+                encontrado.update(item=row[7], codigo=row[8], descricao=row[9], quantidade=row[10],
+                                  unidade=row[11], valor_total=de_centavos(row[12]))
+            resultados.append(encontrado)
+        return resultados
+
+    def carregar(self, cupom_id: int) -> Optional[Dict]:
+        """Resultado no mesmo formato de ``process_cupom`` (mais 'arquivo', 'hash' e 'cupom_id')"""
+        with self._lock:
+            cupom = self._conn.execute(
+                "SELECT arquivo, hash, chave, data, emissao_conhecida, total_centavos, descontos_centavos, "
+                "total_itens FROM cupons WHERE id = ?", (cupom_id,)
+            ).fetchone()
+            if cupom is None:
+                return None
+            itens = self._conn.execute(
+                "SELECT item, codigo, descricao, quantidade, unidade, valor_unitario, "
+                "valor_total_centavos, desconto_centavos FROM itens WHERE cupom_id = ? ORDER BY id",
+                (cupom_id,)
+            ).fetchall()
+        arquivo, hash_pdf, chave, data, emissao_conhecida, total, descontos, total_itens = cupom
+        return {
+            'cupom_id': cupom_id,
+            'arquivo': arquivo,
+            'hash': hash_pdf,
+            'chave': chave,
+            'total_itens': total_itens,
+            'total_geral': de_centavos(total),
+            'total_descontos': de_centavos(descontos),
+            'emissao': datetime.fromisoformat(data) if emissao_conhecida else None,
+            'itens': [
+                CupomItem(item, codigo, descricao, quantidade, unidade, Decimal(unitario),
+                          de_centavos(valor_total), de_centavos(desconto))
+                for item, codigo, descricao, quantidade, unidade, unitario, valor_total, desconto in itens
+            ],
+        }
+
+    def registrar_devolucao(self, cupom_id: int, resultados: Iterable[ResultadoDevolucao]):
+        """Grava as quantidades devolvidas de cada linha em uma devolução confirmada"""
+        agora = time.time()
+        linhas = [
+            (cupom_id, item.item, *chave_linha(item), quantidade, para_centavos(valor), agora)
+            for r in resultados
+            for item, quantidade, valor in zip(r.itens, r.quantidades, r.valores)
+            if quantidade > 0
+        ]
+        with self._lock:
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT INTO devolucoes (cupom_id, item, codigo, descricao, valor_unitario, quantidade, "
+                    "valor_centavos, registrada_em) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", linhas
+                )
+
+    def devolvidos(self, cupom_id: int) -> Dict[tuple, float]:
+        """Quantidade já devolvida de cada linha do cupom (por ``chave_linha``)"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT codigo, descricao, valor_unitario, SUM(quantidade) FROM devolucoes "
+                "WHERE cupom_id = ? GROUP BY codigo, descricao, valor_unitario", (cupom_id,)
+            ).fetchall()
+        return {(codigo, descricao, unitario): quantidade for codigo, descricao, unitario, quantidade in rows}
+
+    def contar(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM cupons").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,179 @@
+"""Leitura de cupons a partir do XML da NFC-e, sem renderizar o PDF.
+
+O XML traz os mesmos itens do cupom impresso (``det/prod``), com os valores
+exatos, então ler o XML é muito mais barato que extrair e interpretar o
+texto do PDF. Aceita um XML (``nfeProc``/``NFe`` ou um arquivo com várias
+notas) e um .zip de XMLs; o parse é incremental (``iterparse``), nota a
+nota, e gera os resultados no mesmo formato de ``process_cupom``, com a
+chave de acesso em ``'chave'``. O progresso é medido em bytes do XML lidos.
+"""
+import os
+import zipfile
+import xml.etree.ElementTree as ET
+from contextlib import nullcontext
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from operator import attrgetter
+from typing import Optional, List, Dict, Iterator, IO, Tuple, Union
+
+from cupom_itens import CupomItem, CENTAVO, ZERO
+from cupom_metricas import medir_etapa
+from cupom_reader import (CupomReader, CupomError, NoItemsError, ProcessingCancelled, Progresso,
+                          chave_valida)
+
+EXTENSOES_XML = ('.xml', '.zip')
+
+
+class XMLReadError(CupomError):
+    """Falha ao abrir ou interpretar o XML da NFC-e"""
+
+
+def _nome(tag: str) -> str:
+    """Nome da tag sem o namespace ('{http://www.portalfiscal.inf.br/nfe}det' -> 'det')"""
+    return tag.rpartition('}')[2]
+
+
+def _valor(texto: Optional[str]) -> Decimal:
+    """Valor do XML ('7.6200000000') com as casas decimais do cupom impresso"""
+    if not texto:
+        return ZERO
+    valor = Decimal(texto)
+    centavos = valor.quantize(CENTAVO)
+    return centavos if centavos == valor else valor.normalize()
+
+
+def _emissao(texto: str) -> Optional[datetime]:
+    """dhEmi ('2023-05-01T10:00:00-03:00') no horário local impresso no cupom"""
+    try:
+        return datetime.fromisoformat(texto.strip()).replace(tzinfo=None)
+    except ValueError:
+        return None
+
+
+def _item(det: ET.Element) -> CupomItem:
+    """Item do cupom a partir de um ``det``; o código é o GTIN ou, sem ele, o cProd"""
+    prod = next((e for e in det if _nome(e.tag) == 'prod'), det)
+    campos = {_nome(e.tag): (e.text or "").strip() for e in prod}
+    gtin = campos.get('cEAN', "")
+    return CupomItem(
+        int(det.get('nItem') or 0),
+        gtin if gtin.isdigit() else campos.get('cProd', ""),
+        campos.get('xProd', ""),
+        float(campos['qCom']),
+        campos.get('uCom', ""),
+        _valor(campos['vUnCom']),
+        _valor(campos['vProd']).quantize(CENTAVO),
+        _valor(campos.get('vDesc')).quantize(CENTAVO),
+    )
+
+
+def iter_notas(origem: Union[str, IO[bytes]]) -> Iterator[Dict]:
+    """Gera {'chave', 'emissao', 'itens'} de cada NFC-e do XML, uma por vez.
+
+    Cada ``det`` é descartado da árvore assim que vira item e cada nota é
+    retirada da raiz depois de gerada, então a árvore não cresce com o
+    arquivo, mesmo com milhares de notas.
+    """
+    itens: List[CupomItem] = []
+    emissao = None
+    raiz = None
+    try:
+        for evento, elem in ET.iterparse(origem, events=('start', 'end')):
+            if evento == 'start':
+                if raiz is None:
+                    raiz = elem
+                continue
+            nome = _nome(elem.tag)
+            if nome == 'det':
+                itens.append(_item(elem))
+                elem.clear()
+            elif nome in ('dhEmi', 'dEmi') and emissao is None:
+                emissao = _emissao(elem.text or "")
+            elif nome == 'infNFe':
+                chave = (elem.get('Id') or "").removeprefix('NFe')
+                yield {'chave': chave if chave_valida(chave) else None,
+                       'emissao': emissao, 'itens': itens}
+                itens, emissao = [], None
+                elem.clear()
+                # Sem isso os NFe/nfeProc já lidos (vazios) se acumulam na raiz
+                raiz.clear()
+    except ET.ParseError as e:
+        raise XMLReadError(f"Falha ao ler XML: {e}") from e
+    except (KeyError, ValueError, InvalidOperation) as e:
+        raise XMLReadError(f"Item inválido no XML: {e!r}") from e
+
+
+def _iter_origens(file_path: str) -> Iterator[Tuple[IO[bytes], int, int]]:
+    """O próprio XML ou cada XML de um .zip, com o byte (descomprimido) em
+    que ele começa e o total de bytes, para o progresso"""
+    if not file_path.lower().endswith('.zip'):
+        with open(file_path, 'rb') as f:
+            yield f, 0, os.fstat(f.fileno()).st_size
+        return
+    try:
+        with zipfile.ZipFile(file_path) as pacote:
+            membros = sorted((info for info in pacote.infolist() if info.filename.lower().endswith('.xml')),
+                             key=attrgetter('filename'))
+            total = sum(info.file_size for info in membros)
+            inicio = 0
+            for info in membros:
+                with pacote.open(info) as f:
+                    yield f, inicio, total
+                inicio += info.file_size
+    except zipfile.BadZipFile as e:
+        raise XMLReadError(f"Falha ao ler {file_path}: {e}") from e
+
+
+def processar_xml(file_path: str, reader: Optional[CupomReader] = None,
+                  progresso: Optional[Progresso] = None, cancelar=None) -> List[Dict]:
+    """Lê todas as NFC-e de um XML (ou .zip de XMLs) no formato de ``process_cupom``.
+
+    O ``reader`` define o agrupamento de itens e as métricas. ``progresso``
+    recebe (bytes lidos, total) a cada nota e ``cancelar`` (threading.Event)
+    interrompe entre notas com ``ProcessingCancelled``. Levanta
+    ``XMLReadError`` se o arquivo não puder ser lido e ``NoItemsError`` se
+    não houver nenhuma nota com itens.
+    """
+    reader = reader or CupomReader()
+    if reader.metricas is not None:
+        contexto = reader.metricas.cupom(file_path)
+    else:
+        contexto = nullcontext({'etapas': {}})
+    with contexto as registro:
+        registro['motor'] = 'xml'
+        resultados = []
+        try:
+            with medir_etapa(registro, 'xml') as etapa:
+                etapa['notas'] = etapa['itens'] = 0
+                for origem, inicio, total in _iter_origens(file_path):
+                    for nota in iter_notas(origem):
+                        if cancelar is not None and cancelar.is_set():
+                            raise ProcessingCancelled("Processamento cancelado")
+                        if progresso:
+                            progresso(inicio + origem.tell(), total)
+                        etapa['notas'] += 1
+                        etapa['itens'] += len(nota['itens'])
+                        if not nota['itens']:
+                            continue
+                        resultado = reader._montar_resultado(nota['itens'], None, nota['emissao'],
+                                                             nota['chave'])
+                        resultado['arquivo'] = file_path
+                        resultados.append(resultado)
+        except OSError as e:
+            raise XMLReadError(f"Falha ao ler {file_path}: {e}") from e
+        if not resultados:
+            raise NoItemsError("Nenhuma NFC-e com itens no XML")
+        if len(resultados) > 1:
+            # Identifica a nota no arquivo mesmo sem chave válida (veja CupomStore.gravar)
+            for parte, resultado in enumerate(resultados, 1):
+                resultado['parte'] = parte
+        return resultados
+
+
+def arquivo_correspondente(file_path: str, extensao: str) -> Optional[str]:
+    """Arquivo de mesmo nome com outra extensão (cupom.pdf -> cupom.xml), se existir"""
+    base, _ = os.path.splitext(file_path)
+    for candidato in (base + extensao, base + extensao.upper()):
+        if os.path.isfile(candidato):
+            return candidato
+    return None
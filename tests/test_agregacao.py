@@ -0,0 +1,93 @@
+"""RelatorioIncremental: o mesmo cupom lido de novo substitui a sua parte"""
+import os
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+
+from cupom_itens import CupomItem
+from cupom_agregacao import RelatorioIncremental, Agregacao
+from cupom_devolucao import IndiceDevolucao
+
+CHAVE = "41230576430438000184650010000123451000123456"
+LEITE = "7891000100103"
+ARROZ = "7896006716112"
+
+
+def cupom(*itens, **extras):
+    """Cupom com itens (código, quantidade, total)"""
+    itens = [CupomItem(n, codigo, codigo, qtd, "UN", Decimal(total), Decimal(total))
+             for n, (codigo, qtd, total) in enumerate(itens, 1)]
+    return {'itens': itens, 'emissao': datetime(2023, 5, 1, 10), 'chave': None, **extras}
+
+
+def totais(relatorio):
+    return {linha['produto']: (linha['quantidade'], linha['valor'], linha['linhas'])
+            for linha in relatorio.linhas()}
+
+
+@pytest.fixture
+def caminho(tmp_path):
+    return str(tmp_path / 'relatorio' / 'produtos.csv')
+
+
+def test_releitura_substitui_pela_chave(caminho):
+    relatorio = RelatorioIncremental(caminho, intervalo_csv=None)
+    relatorio.acumular(cupom((LEITE, 2.0, "15.24"), (ARROZ, 1.0, "27.90"), chave=CHAVE))
+    relatorio.acumular(cupom((LEITE, 1.0, "7.62"), chave=CHAVE))
+    assert relatorio.cupons == 1
+    # O arroz saiu do cupom relido e, sem outras linhas, do relatório
+    assert totais(relatorio) == {LEITE: (1.0, Decimal("7.62"), 1)}
+    relatorio.close()
+
+
+def test_releitura_apos_reabrir(caminho):
+    relatorio = RelatorioIncremental(caminho, intervalo_csv=None)
+    relatorio.acumular(cupom((LEITE, 2.0, "15.24"), chave=CHAVE))
+    relatorio.acumular(cupom((LEITE, 1.0, "7.62"), arquivo='/cupons/outro.pdf'))
+    relatorio.close()
+    assert os.path.exists(caminho)
+
+    relatorio = RelatorioIncremental(caminho, intervalo_csv=None)
+    relatorio.acumular(cupom((LEITE, 3.0, "22.86"), chave=CHAVE))
+    assert relatorio.cupons == 2
+    assert totais(relatorio) == {LEITE: (4.0, Decimal("30.48"), 2)}
+    relatorio.close()
+
+
+def test_partes_do_mesmo_arquivo(caminho):
+    relatorio = RelatorioIncremental(caminho, intervalo_csv=None)
+    relatorio.acumular(cupom((LEITE, 1.0, "7.62"), arquivo='/cupons/mesclado.pdf', parte=1))
+    relatorio.acumular(cupom((LEITE, 1.0, "7.62"), arquivo='/cupons/mesclado.pdf', parte=2))
+    relatorio.acumular(cupom((LEITE, 2.0, "15.24"), arquivo='/cupons/mesclado.pdf', parte=2))
+    assert relatorio.cupons == 2
+    assert totais(relatorio) == {LEITE: (3.0, Decimal("22.86"), 2)}
+    relatorio.close()
+
+
+def test_igual_a_agregacao_em_memoria(caminho):
+    cupons = [cupom((LEITE, 1.0, "7.62"), (ARROZ, 2.0, "55.80"), arquivo=f'/cupons/{n}.pdf')
+              for n in range(5)]
+    memoria = Agregacao()
+    relatorio = RelatorioIncremental(caminho, intervalo_csv=None)
+    for c in cupons:
+        memoria.acumular(c)
+        relatorio.acumular(c)
+    relatorio.acumular(cupons[0])  # Relido: não soma de novo
+    assert list(relatorio.linhas()) == memoria.linhas()
+    assert relatorio.cupons == memoria.cupons == 5
+    relatorio.close()
+
+
+def test_devolucoes_contadas_a_parte(caminho):
+    relatorio = RelatorioIncremental(caminho, ('dia', 'produto'), intervalo_csv=None)
+    vendido = cupom((LEITE, 2.0, "15.24"), chave=CHAVE)
+    resultados = IndiceDevolucao(vendido['itens']).registrar([LEITE])
+    relatorio.acumular_devolucao(vendido, resultados, datetime(2023, 5, 3, 9))
+    assert (relatorio.cupons, relatorio.devolucoes) == (0, 1)
+    linha, = relatorio.linhas()
+    assert (linha['dia'], linha['quantidade'], linha['valor']) == ("2023-05-03", 1.0, Decimal("7.62"))
+    relatorio.close()
+
+    with pytest.raises(ValueError):
+        RelatorioIncremental(caminho, ('produto',))
@@ -0,0 +1,99 @@
+"""Conferência de devoluções: parciais, acima do comprado, pesados e saldo"""
+from decimal import Decimal
+
+from cupom_itens import CupomItem
+from cupom_devolucao import (IndiceDevolucao, chave_linha, STATUS_OK, STATUS_PARCIAL,
+                             STATUS_JA_DEVOLVIDO, STATUS_NAO_ENCONTRADO)
+
+LEITE = "7891000100103"
+PAO = "2000123000000"
+
+
+def itens_cupom():
+    return [
+        # 3 x 2,00 com 0,30 de desconto: 1,90 líquido por unidade
+        CupomItem(1, LEITE, "LEITE CONDENSADO", 3.0, "UN", Decimal("2.00"), Decimal("6.00"),
+                  Decimal("0.30")),
+        CupomItem(2, PAO, "PÃO FRANCÊS KG", 0.857, "KG", Decimal("15.90"), Decimal("13.63")),
+        CupomItem(3, "7890000000017", "SACOLA", 1.0, "UN", Decimal("0.10"), Decimal("0.10")),
+        CupomItem(4, "7890000000017", "SACOLA", 1.0, "UN", Decimal("0.10"), Decimal("0.10")),
+    ]
+
+
+def test_devolucao_parcial_em_duas_vezes():
+    indice = IndiceDevolucao(itens_cupom())
+    primeira, = indice.registrar([f"2*{LEITE}"])
+    assert primeira.status == STATUS_OK
+    assert primeira.quantidade_devolvida == 2
+    assert primeira.valor_devolvido == Decimal("3.80")
+
+    segunda, = indice.registrar([LEITE, LEITE])  # Leituras repetidas somam
+    assert segunda.quantidade == 2
+    assert segunda.status == STATUS_PARCIAL
+    assert segunda.quantidade_devolvida == 1
+    # A última unidade leva o que falta do líquido da linha
+    assert primeira.valor_devolvido + segunda.valor_devolvido == Decimal("5.70")
+
+    terceira, = indice.registrar([LEITE])
+    assert terceira.status == STATUS_JA_DEVOLVIDO
+    assert terceira.valor_devolvido == 0
+
+
+def test_devolucao_acima_do_comprado():
+    indice = IndiceDevolucao(itens_cupom())
+    resultado, = indice.registrar([f"5*{LEITE}"])
+    assert resultado.status == STATUS_PARCIAL
+    assert resultado.quantidade_devolvida == 3
+    assert resultado.valor_devolvido == Decimal("5.70")
+    assert indice.restante[0] == 0
+
+
+def test_linhas_repetidas_sao_consumidas_em_ordem():
+    indice = IndiceDevolucao(itens_cupom())
+    resultado, = indice.registrar(["2*7890000000017"])
+    assert resultado.status == STATUS_OK
+    assert [item.item for item in resultado.itens] == [3, 4]
+    assert resultado.valores == [Decimal("0.10"), Decimal("0.10")]
+
+
+def test_item_pesado_por_peso_e_por_unidade():
+    indice = IndiceDevolucao(itens_cupom())
+    parte, = indice.registrar([f"0,5*{PAO}"])
+    assert parte.status == STATUS_OK
+    assert parte.valor_devolvido == Decimal("7.95")
+    resto, = indice.registrar([PAO])  # Por unidade: o que resta da linha
+    assert resto.status == STATUS_OK
+    assert resto.valor_devolvido == Decimal("5.68")
+    assert parte.valor_devolvido + resto.valor_devolvido == Decimal("13.63")
+
+
+def test_valor_devolvido_e_a_soma_das_linhas():
+    indice = IndiceDevolucao(itens_cupom())
+    for entrada in (LEITE, f"0,3*{PAO}", "#3", "sacola"):
+        resultado, = indice.registrar([entrada])
+        assert resultado.valor_devolvido == sum(resultado.valores)
+
+
+def test_linha_com_quantidade_zero():
+    itens = [CupomItem(1, LEITE, "LEITE CONDENSADO", 0.0, "UN", Decimal("2.00"), Decimal("0.00"))]
+    itens += itens_cupom()
+    resultado, = IndiceDevolucao(itens).registrar([LEITE])
+    assert resultado.status == STATUS_OK
+    assert resultado.valor_devolvido == Decimal("1.90")
+
+
+def test_simulacao_nao_altera_o_saldo():
+    indice = IndiceDevolucao(itens_cupom())
+    simulado, = indice.registrar([f"3*{LEITE}"], confirmar=False)
+    assert simulado.status == STATUS_OK
+    assert indice.restante[0] == 3
+    nao_encontrado, = indice.registrar(["ARROZ"], confirmar=False)
+    assert nao_encontrado.status == STATUS_NAO_ENCONTRADO
+
+
+def test_saldo_a_partir_das_devolucoes_gravadas():
+    itens = itens_cupom()
+    indice = IndiceDevolucao(itens, {chave_linha(itens[0]): 2.0})
+    resultado, = indice.registrar([f"2*{LEITE}"])
+    assert resultado.status == STATUS_PARCIAL
+    assert resultado.quantidade_devolvida == 1
@@ -0,0 +1,62 @@
+"""Tokenizador de linhas de item Muffato contra a regex original"""
+import random
+import re
+
+import pytest
+
+from cupom_formatos import _tokenizar_item
+
+# Padrão do parser original (uma regex com retrocesso na descrição)
+RE_LEGADO = re.compile(
+    r'^(\d+)\s+(\d{7,13})?\s*(.*?)\s+(\d+\.\d+|\d+\,\d+)\s+(\w+)\.?\s+(\d+\.\d+|\d+\,\d+)\s+(\d+\.\d+|\d+\,\d+)\s*$'
+)
+
+
+def legado(line: str):
+    match = RE_LEGADO.match(line)
+    if match is None:
+        return None
+    item, codigo, descricao, *cauda = match.groups()
+    return (item, codigo or "", descricao.strip(), *cauda)
+
+
+@pytest.mark.parametrize('line', [
+    "1 7891000100103 LEITE CONDENSADO 395G 2,000 UN 7,62 15,24",
+    "2 2000123000000 PAO FRANCES KG 0,350 KG 15,90 5,57",
+    "3 ARROZ TIPO 1 5KG 1,000 UN. 27,90 27,90",
+    "4 1234567 X 1.000 UN 1.00 1.00",
+    "5 123456 ITEM COM CODIGO CURTO 1,000 UN 1,00 1,00",
+    "6 12345678901234567 CODIGO LONGO 1,000 UN 1,00 1,00",
+    "7  1,000 UN 1,00 1,00",
+    "8 1,000 UN 1,00 1,00",
+    "9 7891000100103X DESCRICAO 1,000 UN 1,00 1,00",
+    "10 7891000100103 DESC 1,000 K G 1,00 1,00",
+    "11 7891000100103 DESC 1 UN 1,00 1,00",
+    "12 7891000100103 DESC 1,000 UN 1.234,56 1.234,56",
+    "13 7891000100103 DESC\t1,000\tUN\t1,00\t1,00",
+    "14 7891000100103 DESC 1,000 UN.. 1,00 1,00",
+    "15 7891000100103 DESC 1,000 UN 1,00 1,00",
+    "Seq.: 1 Desconto 1,00",
+    "TOTAL 10,00",
+])
+def test_linhas_conhecidas(line):
+    assert _tokenizar_item(line) == legado(line)
+
+
+def test_linhas_aleatorias():
+    """Colunas e separadores sorteados (inclusive espaços Unicode e casos
+    de borda da regex original); os dois devem concordar em toda linha"""
+    rnd = random.Random(0)
+    numeros = ["1,000", "0,350", "12.50", "1", "1.234,56", "12,5", "1,", ",5", "1.2.3", "٣,٥"]
+    codigos = ["7891000100103", "1234567", "123456", "", "12345678ABC", "١٢٣٤٥٦٧"]
+    descricoes = ["LEITE COND", "ARROZ TOTAL 5KG", "X", "", "PÃO  FRANCÊS  KG", "1,000", "a b"]
+    unidades = ["UN", "UN.", "KG", "K G", "Ü", "UN..", "_"]
+    separadores = [" ", "  ", "\t", " ", "\x1c", "   "]
+    for n in range(5000):
+        partes = [str(n), rnd.choice(codigos), rnd.choice(descricoes), rnd.choice(numeros),
+                  rnd.choice(unidades), rnd.choice(numeros), rnd.choice(numeros)]
+        line = partes[0]
+        for parte in partes[1:]:
+            line += rnd.choice(separadores) + parte
+        line = line.strip()
+        assert _tokenizar_item(line) == legado(line), repr(line)
@@ -0,0 +1,94 @@
+"""CupomItem e ItensColunares: visão de dicionário, ida e volta pelas colunas e centavos"""
+from array import array
+from decimal import Decimal, ROUND_HALF_UP
+
+import pytest
+
+import cupom_itens
+from cupom_itens import (CupomItem, ItensColunares, CAMPOS, para_centavos, de_centavos,
+                         somar_centavos)
+
+
+def itens_exemplo():
+    return [
+        CupomItem(1, "7891000100103", "LEITE CONDENSADO", 2.0, "UN", Decimal("7.62"), Decimal("15.24")),
+        CupomItem(2, "2000123000000", "PAO FRANCES KG", 0.35, "KG", Decimal("15.90"), Decimal("5.57"),
+                  Decimal("0.57")),
+        CupomItem(3, "", "SACOLA", 1.0, "UN", Decimal("0.1"), Decimal("0.10")),
+    ]
+
+
+def test_visao_de_dicionario():
+    item = itens_exemplo()[1]
+    assert item['descricao'] == "PAO FRANCES KG"
+    assert list(item.keys()) == list(CAMPOS)
+    assert 'desconto' in item and 'hash' not in item
+    assert item.get('hash', 'x') == 'x'
+    item['desconto'] = Decimal("1.00")
+    assert item.desconto == Decimal("1.00")
+    with pytest.raises(KeyError):
+        item['hash']
+    with pytest.raises(KeyError):
+        item['hash'] = 1
+
+
+def test_from_dict_aceita_texto_e_float():
+    item = itens_exemplo()[0]
+    dados = item.to_dict()
+    assert CupomItem.from_dict(dados) == item
+    dados.update(valor_unitario="7.62", valor_total=15.24, desconto="0.00")
+    assert CupomItem.from_dict(dados) == item
+
+
+def test_copy_independente():
+    item = itens_exemplo()[0]
+    copia = item.copy()
+    copia.quantidade = 5.0
+    assert copia == CupomItem(**{**item.to_dict(), 'quantidade': 5.0})
+    assert item.quantidade == 2.0
+
+
+def test_colunas_ida_e_volta():
+    itens = itens_exemplo()
+    colunas = ItensColunares(itens)
+    assert len(colunas) == 3
+    assert list(colunas) == itens
+    assert colunas[1] == itens[1]
+
+    # append e extend guardam as mesmas colunas
+    um_a_um = ItensColunares()
+    for item in itens:
+        um_a_um.append(item)
+    assert list(um_a_um) == itens
+    assert um_a_um.valor_total == colunas.valor_total
+    assert um_a_um.desconto == colunas.desconto
+
+
+@pytest.mark.parametrize('valor, centavos', [
+    (Decimal("15.24"), 1524),
+    (Decimal("0.005"), 1),  # Meio centavo arredonda para cima
+    (Decimal("0.004"), 0),
+    (Decimal("-1.005"), -101),
+    (Decimal("1234567.89"), 123456789),
+    (Decimal("7"), 700),
+])
+def test_centavos_ida_e_volta(valor, centavos):
+    assert para_centavos(valor) == centavos
+    assert de_centavos(centavos) == valor.quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+    assert para_centavos(de_centavos(centavos)) == centavos
+
+
+@pytest.mark.parametrize('com_numpy', [True, False])
+def test_somar_centavos_exato(monkeypatch, com_numpy):
+    if not com_numpy:
+        monkeypatch.setattr(cupom_itens, '_numpy', lambda: None)
+    assert somar_centavos(array('q', [10] * 10)) == 100
+    assert somar_centavos(array('q')) == 0
+    assert somar_centavos(array('q', [2 ** 40, -(2 ** 40), 1])) == 1
+
+
+def test_totais_das_colunas_iguais_a_soma_em_decimal():
+    itens = itens_exemplo() * 1000
+    colunas = ItensColunares(itens)
+    assert colunas.total_geral() == sum(item.valor_total for item in itens) == Decimal("20910.00")
+    assert colunas.total_descontos() == Decimal("570.00")
@@ -0,0 +1,95 @@
+"""Leitura da requisição HTTP do servidor: caminho normal e erros"""
+import asyncio
+
+import pytest
+
+from cupom_servidor import ServidorCupons, ErroHTTP
+
+
+def ler(dados: bytes, limite_upload: int = 1024):
+    """Resultado de ``_ler_requisicao`` com ``dados`` já recebidos (limite de linha: 1 KiB)"""
+    async def executar():
+        reader = asyncio.StreamReader(limit=1024)
+        reader.feed_data(dados)
+        reader.feed_eof()
+        return await ServidorCupons(workers=1, limite_upload=limite_upload)._ler_requisicao(reader)
+    return asyncio.run(executar())
+
+
+def status(dados: bytes, **opcoes) -> int:
+    with pytest.raises(ErroHTTP) as erro:
+        ler(dados, **opcoes)
+    return erro.value.status
+
+
+def test_requisicao_com_corpo():
+    metodo, alvo, cabecalhos, corpo = ler(
+        b'post /processar?agrupar=0 HTTP/1.1\r\nContent-Length: 3\r\nX-Teste:  a:b \r\n\r\nabcresto')
+    assert (metodo, alvo, corpo) == ('POST', '/processar?agrupar=0', b'abc')
+    assert cabecalhos == {'content-length': '3', 'x-teste': 'a:b'}
+
+
+def test_conexao_fechada():
+    assert ler(b'') is None
+
+
+@pytest.mark.parametrize('dados', [
+    b'GET\r\n\r\n',
+    b'GET / HTTP/1.1 extra\r\n\r\n',
+])
+def test_linha_de_requisicao_invalida(dados):
+    assert status(dados) == 400
+
+
+@pytest.mark.parametrize('tamanho', [b'-5', b'abc', b'1.5'])
+def test_content_length_invalido(tamanho):
+    assert status(b'POST /processar HTTP/1.1\r\nContent-Length: ' + tamanho + b'\r\n\r\nabc') == 400
+
+
+def test_corpo_acima_do_limite():
+    assert status(b'POST /processar HTTP/1.1\r\nContent-Length: 2048\r\n\r\n', limite_upload=1024) == 413
+
+
+def test_linha_de_requisicao_longa_demais():
+    assert status(b'GET /' + b'a' * 4096 + b' HTTP/1.1\r\n\r\n') == 400
+
+
+def test_cabecalho_longo_demais():
+    assert status(b'GET /saude HTTP/1.1\r\nX-Longo: ' + b'a' * 4096 + b'\r\n\r\n') == 431
+
+
+def test_corpo_incompleto():
+    with pytest.raises(asyncio.IncompleteReadError):
+        ler(b'POST /processar HTTP/1.1\r\nContent-Length: 10\r\n\r\nabc')
+
+
+class EscritorFalso:
+    def __init__(self):
+        self.dados = b''
+        self.fechado = False
+
+    def write(self, dados: bytes):
+        self.dados += dados
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        self.fechado = True
+
+
+@pytest.mark.parametrize('dados, esperado', [
+    (b'POST /processar HTTP/1.1\r\nContent-Length: -5\r\n\r\n', b'HTTP/1.1 400 '),
+    (b'GET /saude HTTP/1.1\r\nX-Longo: ' + b'a' * 4096 + b'\r\n\r\n', b'HTTP/1.1 431 '),
+])
+def test_erro_vira_resposta_e_fecha_a_conexao(dados, esperado):
+    async def executar():
+        reader = asyncio.StreamReader(limit=1024)
+        reader.feed_data(dados)
+        reader.feed_eof()
+        writer = EscritorFalso()
+        await ServidorCupons(workers=1)._atender(reader, writer)
+        return writer
+    writer = asyncio.run(executar())
+    assert writer.dados.startswith(esperado)
+    assert writer.fechado
@@ -0,0 +1,64 @@
+"""CupomStore.gravar: o mesmo cupom gravado de novo substitui o registro"""
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+
+from cupom_itens import CupomItem
+from cupom_store import CupomStore
+from cupom_devolucao import IndiceDevolucao
+
+CHAVE = "41230576430438000184650010000123451000123456"
+
+
+@pytest.fixture
+def armazem(tmp_path):
+    store = CupomStore(str(tmp_path / 'cupons.sqlite3'))
+    yield store
+    store.close()
+
+
+def resultado(valor="7.62", **extras):
+    itens = [CupomItem(1, "7891000100103", "LEITE CONDENSADO", 1.0, "UN", Decimal(valor), Decimal(valor))]
+    return {'total_itens': 1, 'total_geral': Decimal(valor), 'total_descontos': Decimal("0.00"),
+            'emissao': datetime(2023, 5, 1, 10), 'chave': None, 'itens': itens, **extras}
+
+
+def test_mesmo_hash_substitui(armazem):
+    armazem.gravar(resultado(hash='abc'))
+    cupom_id = armazem.gravar(resultado("8.00", hash='abc'))
+    assert armazem.contar() == 1
+    assert armazem.carregar(cupom_id)['total_geral'] == Decimal("8.00")
+
+
+def test_mesma_chave_substitui_e_leva_as_devolucoes(armazem):
+    # O PDF e depois o XML do mesmo cupom: hashes diferentes, mesma chave
+    pdf = armazem.gravar(resultado(hash='pdf', chave=CHAVE))
+    cupom = armazem.carregar(pdf)
+    armazem.registrar_devolucao(pdf, IndiceDevolucao(cupom['itens']).registrar(["7891000100103"]))
+
+    xml = armazem.gravar(resultado(chave=CHAVE, arquivo='/nao/existe.xml'))
+    assert armazem.contar() == 1
+    gravado = armazem.carregar(xml)
+    assert gravado['chave'] == CHAVE
+    assert gravado['hash'] is None  # Resultado de XML não usa o hash do arquivo
+    assert sum(armazem.devolvidos(xml).values()) == 1.0
+
+
+def test_cupons_diferentes_nao_se_substituem(armazem):
+    armazem.gravar(resultado(hash='a'))
+    armazem.gravar(resultado(hash='b'))
+    armazem.gravar(resultado(chave=CHAVE))
+    assert armazem.contar() == 3
+
+
+def test_partes_do_mesmo_arquivo(armazem, tmp_path):
+    # Sem hash nem chave: o hash do arquivo e a posição do cupom nele
+    arquivo = tmp_path / 'mesclado.pdf'
+    arquivo.write_bytes(b'%PDF-1.4 conteudo')
+    for parte in (1, 2):
+        armazem.gravar(resultado(arquivo=str(arquivo), parte=parte))
+    assert armazem.contar() == 2
+    armazem.gravar(resultado("9.99", arquivo=str(arquivo), parte=2))
+    assert armazem.contar() == 2
+    assert sorted(c['total_geral'] for c in armazem.buscar()) == [Decimal("7.62"), Decimal("9.99")]